@@ -67,9 +67,19 @@ class Attention(Layer):
            al. (2015), and 'scaled_dot' by Vaswani et al. (2017)
     @param (str) model_api: specify to use TF's Sequential OR Functional API, note that attention
            weights are not outputted with the former as it only accepts single-output layers
+    @param (str) topk_mode: how 'local-p*' uses its top @window_width timesteps, 'dense' scales them
+           in the full sequence and scores all the S timesteps, whereas 'gather' takes only those
+           timesteps (in the order of the sequence) and scores them, so the outputs have D timesteps
+           and the cost grows with the window instead of with the sequence
+
+    MASKING: with the mask of the source hidden states (e.g. an Embedding with mask_zero and the
+    BiLSTM after it) the padded timesteps get zero attention weights, 'local-p' predicts the aligned
+    position among the tokens, 'local-p*' only picks the padding if the sequence has less than
+    @window_width tokens, and the outputs keep the mask of the timesteps they have (except with
+    topk_mode='gather', whose padded timesteps have zero weights instead)
     """
     def __init__(self, context='many-to-many', alignment_type='global', window_width=None,
-                 score_function='general', model_api='functional', **kwargs):
+                 score_function='general', model_api='functional', topk_mode='dense', **kwargs):
         if context not in ['many-to-many', 'many-to-one']:
             raise ValueError("Argument for param @context is not recognized")
         if alignment_type not in ['global', 'local-m', 'local-p', 'local-p*']:
@@ -82,12 +92,15 @@ class Attention(Layer):
             raise ValueError("Argument for param @score_function is not recognized")
         if model_api not in ['sequential', 'functional']:
             raise ValueError("Argument for param @model_api is not recognized")
+        if topk_mode not in ['dense', 'gather']:
+            raise ValueError("Argument for param @topk_mode is not recognized")
         super(Attention, self).__init__(**kwargs)
         self.context = context
         self.alignment_type = alignment_type
         self.window_width = window_width  # D
         self.score_function = score_function
         self.model_api = model_api
+        self.topk_mode = topk_mode
 
     def get_config(self):
         base_config = super(Attention, self).get_config()
@@ -95,6 +108,7 @@ class Attention(Layer):
         base_config['window_width'] = self.window_width
         base_config['score_function'] = self.score_function
         base_config['model_api'] = self.model_api
+        base_config['topk_mode'] = self.topk_mode
         return base_config
 
     def build(self, input_shape):
@@ -104,6 +118,11 @@ class Attention(Layer):
             self.target_sequence_length = input_shape[1][1]
         elif self.context == 'many-to-one':
             self.input_sequence_length, self.hidden_dim = input_shape[0][1], input_shape[0][2]
+        # The sequence length can be None (batches of variable length). Otherwise the positions of the Gaussian of
+        # 'local-p' are computed once here.
+        self.positions = None
+        if self.alignment_type == 'local-p' and self.input_sequence_length is not None:
+            self.positions = np.arange(self.input_sequence_length, dtype=np.float32).reshape((1, -1, 1))
 
         # Build weight matrices for different alignment types and score functions
         if 'local-p' in self.alignment_type:
@@ -131,7 +150,53 @@ class Attention(Layer):
 
         super(Attention, self).build(input_shape)
 
-    def call(self, inputs):
+    def sequence_length(self, source_hidden_states):
+        """S as a float, the static one or, for batches of variable length, the one of the batch.
+        """
+        if self.input_sequence_length is not None:
+            return float(self.input_sequence_length)
+        return tf.cast(tf.shape(source_hidden_states)[1], source_hidden_states.dtype)
+
+    def gaussian_factor(self, aligned_position, source_hidden_states):
+        """Gaussian of 'local-p' centered in the aligned position, exp(-(s - p_t)^2 / (2 * (D / 2)^2)), for every
+        position s of the sequence at once (broadcast of the positions (1, S, 1) against p_t (B, 1, 1)).
+        """
+        positions = self.positions
+        if positions is None:
+            positions = tf.reshape(tf.range(tf.shape(source_hidden_states)[1], dtype=tf.float32), (1, -1, 1))
+        positions = tf.cast(positions, aligned_position.dtype)                                      # (1, S, 1)
+        return tf.exp(-tf.square(positions - aligned_position) /
+                      (2 * tf.square(self.window_width / 2)))                                       # (B, S, 1)
+
+    def local_m_window(self, current_timestep=None):
+        """Borders [left, right) of the 'local-m' window for a static S.
+        """
+        aligned_position = self.input_sequence_length if self.context == 'many-to-one' else current_timestep
+        left = int(aligned_position - self.window_width
+                   if aligned_position - self.window_width >= 0
+                   else 0)
+        right = int(aligned_position + self.window_width
+                    if aligned_position + self.window_width <= self.input_sequence_length
+                    else self.input_sequence_length)
+        return left, right
+
+    def compute_mask(self, inputs, mask=None):
+        source_mask = mask[0] if isinstance(mask, (list, tuple)) else mask
+        # The timesteps of 'gather' depend on the top-k of every sequence, see MASKING
+        if source_mask is None or (self.alignment_type == 'local-p*' and self.topk_mode == 'gather'):
+            return None
+        if self.alignment_type == 'local-m':
+            self.window_width = 8 if self.window_width is None else self.window_width
+            if self.input_sequence_length is None:
+                source_mask = source_mask[:, -self.window_width:]
+            else:
+                left, right = self.local_m_window(inputs[2] if self.context == 'many-to-many' else None)
+                source_mask = source_mask[:, left:right]
+        if self.model_api == 'functional':
+            return [source_mask, source_mask]
+        return source_mask
+
+    def call(self, inputs, mask=None):
         # Pass decoder output (prev. timestep) alongside encoder output for all scenarios
         if not isinstance(inputs, list):
             raise ValueError("Pass a list=[encoder_out (Tensor), decoder_out (Tensor)," +
@@ -148,6 +213,9 @@ class Attention(Layer):
             current_timestep = inputs[2]
             source_hidden_states = inputs[0]                                                        # (B, S, H)
 
+        # Mask of the source hidden states, if any (B, S)
+        source_mask = mask[0] if isinstance(mask, (list, tuple)) else mask
+
         # Add time axis to h_t
         target_hidden_state = tf.expand_dims(input=target_hidden_state, axis=1)                     # (B, 1, H)
 
@@ -160,28 +228,32 @@ class Attention(Layer):
             self.window_width = 8 if self.window_width is None else self.window_width
 
             # Get aligned position (between inputs & targets) and derive a context window to focus
-            if self.alignment_type == 'local-m':                                                    # Monotonic Alignment
-                # Set alignment position
-                if self.context == 'many-to-one':
-                    aligned_position = self.input_sequence_length
-                elif self.context == 'many-to-many':
-                    aligned_position = current_timestep
-                # Get window borders
-                left = int(aligned_position - self.window_width
-                           if aligned_position - self.window_width >= 0
-                           else 0)
-                right = int(aligned_position + self.window_width
-                            if aligned_position + self.window_width <= self.input_sequence_length
-                            else self.input_sequence_length)
+            if self.alignment_type == 'local-m' and self.input_sequence_length is None:            # Monotonic Alignment (variable length)
+                # Aligned position is the last timestep, so the window is the last D timesteps of the batch
+                source_hidden_states = source_hidden_states[:, -self.window_width:, :]             # (B, S*=D, H)
+                if source_mask is not None:
+                    source_mask = source_mask[:, -self.window_width:]                               # (B, S*=D)
+
+            elif self.alignment_type == 'local-m':                                                  # Monotonic Alignment
+                # Get window borders around the alignment position
+                left, right = self.local_m_window(current_timestep if self.context == 'many-to-many' else None)
                 # Extract window window
                 source_hidden_states = Lambda(lambda x: x[:, left:right, :])(source_hidden_states)  # (B, S*=(D, 2xD), H)
+                if source_mask is not None:
+                    source_mask = source_mask[:, left:right]                                        # (B, S*=(D, 2xD))
 
             elif self.alignment_type == 'local-p':                                                  # Predictive Alignment
                 aligned_position = self.W_p(target_hidden_state)                                    # (B, 1, H)
                 aligned_position = Activation('tanh')(aligned_position)                             # (B, 1, H)
                 aligned_position = self.v_p(aligned_position)                                       # (B, 1, 1)
                 aligned_position = Activation('sigmoid')(aligned_position)                          # (B, 1, 1)
-                aligned_position = aligned_position * self.input_sequence_length                    # (B, 1, 1)
+                if source_mask is None:
+                    aligned_position = aligned_position * self.sequence_length(source_hidden_states)  # (B, 1, 1)
+                else:  # In the tokens, which are after the padding
+                    n_tokens = tf.reduce_sum(tf.cast(source_mask, aligned_position.dtype), axis=1)  # (B,)
+                    n_tokens = tf.reshape(n_tokens, (-1, 1, 1))                                     # (B, 1, 1)
+                    n_padding = self.sequence_length(source_hidden_states) - n_tokens               # (B, 1, 1)
+                    aligned_position = n_padding + aligned_position * n_tokens                      # (B, 1, 1)
 
             elif self.alignment_type == 'local-p*':                                                 # Completely Predictive Alignment
                 aligned_position = self.W_p(source_hidden_states)                                   # (B, S, H)
@@ -190,11 +262,34 @@ class Attention(Layer):
                 aligned_position = Activation('sigmoid')(aligned_position)                          # (B, S, 1)
                 # Only keep top D values out of the sigmoid activation, and zero-out the rest
                 aligned_position = tf.squeeze(aligned_position, axis=-1)                            # (B, S)
+                if source_mask is not None:  # The padding is never preferred to a token
+                    aligned_position *= tf.cast(source_mask, aligned_position.dtype)                # (B, S)
+                # S is taken from the batch, so it also works with batches of variable length
+                sequence_length = tf.shape(aligned_position)[1]
+                if self.input_sequence_length is not None:  # static D, e.g. for the 'location' score
+                    window_width = min(self.window_width, self.input_sequence_length)
+                else:
+                    window_width = tf.minimum(self.window_width, sequence_length)
                 top_probabilities = tf.nn.top_k(input=aligned_position,                             # (values:(B, D), indices:(B, D))
-                                                k=self.window_width,
+                                                k=window_width,
                                                 sorted=False)
+
+            if self.alignment_type == 'local-p*' and self.topk_mode == 'gather':                   # Top-D timesteps only
+                # Sorted so the window keeps the order of the sequence
+                indices = tf.sort(top_probabilities.indices, axis=-1)                               # (B, D)
+                source_hidden_states = tf.gather(source_hidden_states, indices, batch_dims=1)       # (B, S*=D, H)
+                aligned_position = tf.gather(aligned_position, indices, batch_dims=1)               # (B, D)
+                if source_mask is not None:
+                    source_mask = tf.gather(source_mask, indices, batch_dims=1)                     # (B, D)
+                aligned_position = tf.expand_dims(aligned_position, axis=-1)                        # (B, D, 1)
+                # Same values as the dense mode in these timesteps
+                scaled_hidden_states = source_hidden_states * aligned_position                      # (B, D, H)
+                scaled_hidden_states /= aligned_position + tf.keras.backend.epsilon()               # (B, D, H)
+                source_hidden_states = source_hidden_states + scaled_hidden_states                  # (B, D, H)
+
+            elif self.alignment_type == 'local-p*':                                                 # Top-D timesteps in the sequence
                 onehot_vector = tf.one_hot(indices=top_probabilities.indices,
-                                           depth=self.input_sequence_length)                        # (B, D, S)
+                                           depth=sequence_length)                                   # (B, D, S)
                 onehot_vector = tf.reduce_sum(onehot_vector, axis=1)                                # (B, S)
                 aligned_position = Multiply()([aligned_position, onehot_vector])                    # (B, S)
                 aligned_position = tf.expand_dims(aligned_position, axis=-1)                        # (B, S, 1)
@@ -234,13 +329,13 @@ class Attention(Layer):
 
         # Distribute weights around aligned position for local-p approach only
         if self.alignment_type == 'local-p':                                                        # Gaussian Distribution
-            gaussian_estimation = lambda s: tf.exp(-tf.square(s - aligned_position) /
-                                                   (2 * tf.square(self.window_width / 2)))
-            gaussian_factor = gaussian_estimation(0)
-            for i in range(1, self.input_sequence_length):
-                gaussian_factor = Concatenate(axis=1)([gaussian_factor, gaussian_estimation(i)])    # (B, S*, 1)
+            gaussian_factor = self.gaussian_factor(aligned_position, source_hidden_states)          # (B, S*, 1)
             attention_weights = attention_weights * gaussian_factor                                 # (B, S*, 1)
 
+        # No attention to the padding
+        if source_mask is not None:
+            attention_weights *= tf.expand_dims(tf.cast(source_mask, attention_weights.dtype), -1)  # (B, S*, 1)
+
         # Derive context vector
         context_vector = source_hidden_states * attention_weights                                   # (B, S*, H)
 
@@ -264,6 +359,9 @@ class SelfAttention(Layer):
     @param (int) penalty_coefficient: the weight of the extra loss
     @param (str) model_api: specify to use TF's Sequential OR Functional API, note that attention
            weights are not outputted with the former as it only accepts single-output layers
+
+    MASKING: with the mask of the inputs the softmax of every hop is only over the tokens, the
+    padded timesteps get zero attention weights
     """
     def __init__(self, size, num_hops=8, use_penalization=True,
                  penalty_coefficient=0.1, model_api='functional', **kwargs):
@@ -296,13 +394,20 @@ class SelfAttention(Layer):
                                   trainable=True)
         super(SelfAttention, self).build(input_shape)
 
-    def call(self, inputs):  # (B, S, H)
+    def compute_mask(self, inputs, mask=None):
+        # The outputs don't have the time axis
+        return None
+
+    def call(self, inputs, mask=None):  # (B, S, H)
         # Expand weights to include batch size through implicit broadcasting
         W1, W2 = self.W1[None, :, :], self.W2[None, :, :]
         hidden_states_transposed = Permute(dims=(2, 1))(inputs)                                     # (B, H, S)
         attention_score = tf.matmul(W1, hidden_states_transposed)                                   # (B, size, S)
         attention_score = Activation('tanh')(attention_score)                                       # (B, size, S)
         attention_weights = tf.matmul(W2, attention_score)                                          # (B, num_hops, S)
+        if mask is not None:  # The lowest value to the padding so the softmax gives it 0
+            attention_weights = tf.where(tf.cast(mask, tf.bool)[:, None, :], attention_weights,
+                                         attention_weights.dtype.min)                               # (B, num_hops, S)
         attention_weights = Activation('softmax')(attention_weights)                                # (B, num_hops, S)
         embedding_matrix = tf.matmul(attention_weights, inputs)                                     # (B, num_hops, H)
         embedding_matrix_flattened = Flatten()(embedding_matrix)                                    # (B, num_hops*H)
@@ -11,13 +11,10 @@ from tensorflow.keras.layers import LSTM, Bidirectional, Conv1D, GlobalAveragePo
     Dropout, Layer, Dense, MaxPool1D, Concatenate, LayerNormalization, SpatialDropout1D, Flatten
 from tensorflow.keras.losses import BinaryCrossentropy, CategoricalCrossentropy, SparseCategoricalCrossentropy
 from tensorflow.keras.regularizers import l2, l1, l1_l2
-from sklearn.metrics import classification_report, accuracy_score, roc_auc_score
 from tensorflow.keras.callbacks import ReduceLROnPlateau, EarlyStopping, ModelCheckpoint
 from basemodel import BaseModel
 from banhdanauattention import BahdanauAttention
 from attention_layers import Attention, SelfAttention
-from sklearn.metrics import classification_report, accuracy_score, roc_auc_score, f1_score, precision_score, \
-    recall_score
 
 # Visualization
 import matplotlib.pyplot as plt
@@ -37,8 +34,8 @@ class AttentionModel(BaseModel):
                  path_train, path_test, vocab_size=None, l2_rate=1e-5, path_dev=None,
                  learning_rate=1e-3, pool_size=4, rate=0.2, filters=64, kernel_size=5,
                  embedding_size=300, max_len=1900, load_embeddings=True, buffer_size=3, emb_type='fasttext',
-                 length_type='median', dense_units=128, both_embeddings=False, att_units=0):
-        """Init function for the model.
+                 length_type='median', dense_units=128, both_embeddings=False, att_units=0, **kwargs):
+        """Init function for the model. The keyword arguments not listed here are passed to BaseModel.
         """
         super(AttentionModel, self).__init__(max_len=max_len, path_train=path_train,
                                              path_test=path_test, path_dev=path_dev, batch_size=batch_size,
@@ -49,7 +46,7 @@ class AttentionModel(BaseModel):
                                              length_type=length_type, dense_units=dense_units,
                                              both_embeddings=both_embeddings, buffer_size=buffer_size,
                                              filters=filters, kernel_size=kernel_size, pool_size=pool_size,
-                                             l2_rate=l2_rate
+                                             l2_rate=l2_rate, **kwargs
                                              )
         self.lstm_units = lstm_units
 
@@ -90,11 +87,8 @@ class AttentionModel(BaseModel):
     def call(self):
         # First Model
         # Prepraring the embeddings input
-        sequence_input = tf.keras.layers.Input(shape=(self.max_sequence_len,), dtype="int32", name="seq_input")
-        token_embeddings_glove = tf.keras.layers.Embedding(self.nb_words, self.embedding_size,
-                                                           weights=[self.embeddings_matrix],
-                                                           input_length=self.max_sequence_len,
-                                                           trainable=False, name='embeddings')
+        sequence_input = tf.keras.layers.Input(shape=(self.input_sequence_len,), dtype="int32", name="seq_input")
+        token_embeddings_glove = self.build_embedding_layer(self.embeddings_matrix, name='embeddings')
         # embedding_sequence = Concatenate(axis=1, name='full_embeddings')([embedding_sequence_glove,
         #                                                                   embedding_sequence_ft])
         embedding_sequence = token_embeddings_glove(sequence_input)
@@ -211,59 +205,3 @@ class AttentionModel(BaseModel):
         r = 255 - int(attention_score * 255)
         color = self.rgb_to_hex((255, r, r))
         return str(color)
-
-    def predict(self):
-        """Make the prediction for the test/dev data. It uses the data from the own class.
-        """
-        # Actually it works as a test function to prove that the code is working.
-        print('TEST SET')
-        preds = self.model.predict(self.X_test, batch_size=self.batch_size, verbose=0)
-        real_preds = []
-        for p in preds:
-            if p[0] > p[1]:
-                real_preds.append(0)
-            else:
-                real_preds.append(1)
-        print(real_preds[:10])
-        y_true = []
-        for p in self.y_test:
-            if p[0] > p[1]:
-                y_true.append(0)
-            else:
-                y_true.append(1)
-
-        print(classification_report(y_true, real_preds))
-        print('Roc auc score: ', roc_auc_score(y_true, real_preds))
-        print('Accuracy: ', accuracy_score(y_true, real_preds))
-        print('Precision-Propaganda: ', precision_score(y_true, real_preds))
-        print('Recall-Propaganda: ', recall_score(y_true, real_preds))
-        print('F1-Propaganda: ', f1_score(y_true, real_preds))
-        print('Macro F1-Propaganda: ', f1_score(y_true, real_preds, average='macro'))
-
-    def predict_dev(self):
-        """Make the prediction for the test/dev data. It uses the data from the own class.
-                """
-        # Actually it works as a test function to prove that the code is working.
-        print('DEV SET')
-        preds = self.model.predict(self.X_dev, batch_size=self.batch_size, verbose=0)
-        real_preds = []
-        for p in preds:
-            if p[0] > p[1]:
-                real_preds.append(0)
-            else:
-                real_preds.append(1)
-        print(real_preds[:10])
-        y_true = []
-        for p in self.y_dev:
-            if p[0] > p[1]:
-                y_true.append(0)
-            else:
-                y_true.append(1)
-
-        print(classification_report(y_true, real_preds))
-        print('Roc auc score: ', roc_auc_score(y_true, real_preds))
-        print('Accuracy: ', accuracy_score(y_true, real_preds))
-        print('Precision-Propaganda: ', precision_score(y_true, real_preds))
-        print('Recall-Propaganda: ', recall_score(y_true, real_preds))
-        print('F1-Propaganda: ', f1_score(y_true, real_preds))
-        print('Macro F1-Propaganda: ', f1_score(y_true, real_preds, average='macro'))
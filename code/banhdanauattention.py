@@ -8,7 +8,13 @@ class BahdanauAttention(tf.keras.layers.Layer):
         self.W2 = tf.keras.layers.Dense(units)
         self.V = tf.keras.layers.Dense(1)
 
-    def call(self, query, values):
+    def compute_mask(self, query, mask=None):
+        # The context vector doesn't have the time axis
+        return None
+
+    def call(self, query, values, mask=None):
+        # mask shape == (batch_size, max_len), the mask of the values. Keras only passes the mask of the first
+        # input (query), so it has to be given: layer(query, values, mask=values._keras_mask)
         # query hidden state shape == (batch_size, hidden size)
         # query_with_time_axis shape == (batch_size, 1, hidden size)
         # values shape == (batch_size, max_len, hidden size)
@@ -20,6 +26,9 @@ class BahdanauAttention(tf.keras.layers.Layer):
         # the shape of the tensor before applying self.V is (batch_size, max_length, units)
         score = self.V(tf.nn.tanh(
             self.W1(query_with_time_axis) + self.W2(values)))
+        if mask is not None:
+            # The lowest value to the padding so the softmax gives it 0
+            score = tf.where(tf.cast(mask, tf.bool)[:, :, None], score, score.dtype.min)
 
         # attention_weights shape == (batch_size, max_length, 1)
         attention_weights = tf.nn.softmax(score, axis=1)
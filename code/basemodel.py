@@ -1,25 +1,32 @@
 import copy
-import statistics
+import json
+import os
+import time
+from ast import literal_eval
 import pandas as pd
 import numpy as np
-from matplotlib import pyplot as plt
 import tensorflow as tf
-import tensorflow_datasets as tfds
 from nltk import sent_tokenize
 from tensorflow.keras.layers import Layer
 from tensorflow.keras import backend as K
 from tensorflow.keras.preprocessing.sequence import pad_sequences
-from tensorflow.keras.preprocessing.text import Tokenizer
+from tensorflow.keras.preprocessing.text import Tokenizer, tokenizer_from_json
 from factory_embeddings import FactoryEmbeddings
+from embeddings import EmbeddingsStore
+from quantizedembedding import QuantizedMatrix, QuantizedEmbedding
 from abc import abstractmethod
 # import tensorflow_docs as tfdocs  # To use in the future.
 # import tensorflow_docs.modeling
 # import tensorflow_docs.plots
 from tensorflow.keras.callbacks import ReduceLROnPlateau, EarlyStopping, ModelCheckpoint
 from tensorflow.keras.optimizers import Adam, RMSprop
-from sklearn.metrics import classification_report, accuracy_score, roc_auc_score, f1_score, precision_score, \
-    recall_score
+from evaluation import evaluate, iterate_batches
 from preprocessing import Preprocessing
+from preprocessing_cache import read_table
+from input_pipeline import InputPipeline, InputBoundCallback
+from tfrecords import TFRecordShards
+from sequence_lengths import LengthProfile
+from vocabulary_cache import VocabularyCache
 from sklearn.model_selection import train_test_split
 
 SEED = 42
@@ -30,7 +37,10 @@ class BaseModel(Layer):
     def __init__(self, max_len, path_train, path_test, path_dev, epochs, learning_rate, optimizer,
                  load_embeddings, batch_size=32, embedding_size='300', emb_type='fasttext', l2_rate=1e-5,
                  vocabulary=None, vocab_size=None, max_sequence_len=None, rate=0.2, length_type='median',
-                 dense_units=128, both_embeddings=False, filters=64, kernel_size=5, pool_size=2, buffer_size=3):
+                 dense_units=128, both_embeddings=False, filters=64, kernel_size=5, pool_size=2, buffer_size=3,
+                 filter_embeddings=False, embeddings_dtype='float32', max_padding=0.2, shuffle_buffer=10000,
+                 cache_data=None, profile_input=False, vocabulary_cache=None,
+                 mask_padding=False, trim_padding=False):
         super(BaseModel).__init__()
         self._vocabulary = vocabulary
         self.max_len = max_len
@@ -95,6 +105,9 @@ class BaseModel(Layer):
         self.initial_bias = self.pos / self.total
         self.history = None
         self.word_index = None
+        self.tokenizer = None
+        # Statistics of the words not found in every type of embeddings (see create_1_embedding_matrix)
+        self.embeddings_coverage = {}
         self.both_embeddings = both_embeddings
         if self.both_embeddings:
             self.nb_words_glove = None
@@ -119,8 +132,45 @@ class BaseModel(Layer):
         self.kernel_size = kernel_size
         self.pool_size = pool_size
         self.buffer_size = buffer_size
+        # If True only the pretrained embeddings of the words in the tokenizer vocabulary are loaded
+        self.filter_embeddings = filter_embeddings
+        # dtype of the frozen embeddings matrix: float64, float32, float16 or int8 (quantized with a scale per row)
+        if embeddings_dtype not in ['float64', 'float32', 'float16', 'int8']:
+            raise ValueError("Argument for param @embeddings_dtype is not recognized")
+        self.embeddings_dtype = embeddings_dtype
+        self.emb = None
+        # Profile of the lengths of the train sequences (see pad_sentences), and max fraction of padded tokens
+        # allowed when length_type is 'auto'
+        self.length_profile = None
+        self.max_padding = max_padding
+        # True if the data is fed in length buckets (see prepare_data_as_buckets), so the models are built for
+        # batches of any length
+        self.bucketed = False
+        # Options of the tf.data pipelines (cache_data: None, '' for memory or a directory, see InputPipeline) and
+        # if fit_as_tensors reports per epoch whether the training waits for the input
+        self.check_padding_options(mask_padding, trim_padding)
+        self.input_pipeline = InputPipeline(batch_size=self.batch_size, shuffle_buffer=shuffle_buffer, seed=SEED,
+                                            cache=cache_data, trim_padding=trim_padding)
+        # If True the embedding layer masks the padding (index 0), so the BiLSTM skips it and the attention layers
+        # and the pooling ignore it. With trim_padding every batch is trimmed to its longest document (see
+        # InputPipeline.trim_batch), also in evaluate_split, and the models accept batches of any length.
+        self.mask_padding = mask_padding
+        self.profile_input = profile_input
+        # Directory of the cache of the fitted tokenizer and of the embeddings matrices (None, by default, to always
+        # fit and build them, e.g. '../data/cache/vocabulary'), and the key of the corpus in it (see pad_sentences)
+        self.vocabulary_cache = VocabularyCache(vocabulary_cache) if vocabulary_cache is not None else None
+        self.vocabulary_key = None
         self.print_configuration()
 
+    @staticmethod
+    def check_padding_options(mask_padding, trim_padding):
+        """Trimming the batches needs the padding masked: otherwise the padding left in every batch (and the
+        positions of the transformer) depends on the longest document of the batch, which changes between epochs and
+        between training and evaluation.
+        """
+        if trim_padding and not mask_padding:
+            raise ValueError("trim_padding needs mask_padding (--trim-padding needs --mask-padding)")
+
     def recall_m(self, y_true, y_pred):
         true_positives = K.sum(K.round(K.clip(y_true * y_pred, 0, 1)))
         possible_positives = K.sum(K.round(K.clip(y_true, 0, 1)))
@@ -160,18 +210,32 @@ class BaseModel(Layer):
 
     @property
     def mean_length(self):
+        if self.length_profile is not None:
+            return self.length_profile.mean
         return 583
 
     @property
     def mode_length(self):
+        if self.length_profile is not None:
+            return self.length_profile.mode
         return 282
 
     @property
     def median_length(self):
+        if self.length_profile is not None:
+            return self.length_profile.median
         return 461
 
+    @property
+    def input_sequence_len(self):
+        """Length of the input layer of the models: max_sequence_len, or None if the batches have variable length.
+        """
+        return None if self.bucketed or self.input_pipeline.trim_padding else self.max_sequence_len
+
     @property
     def max_length(self):
+        if self.length_profile is not None:
+            return self.length_profile.max
         return 600
 
     def print_configuration(self):
@@ -180,6 +244,7 @@ class BaseModel(Layer):
         print('Epochs for training: ' + str(self.epochs))
         print('Bath Size: ' + str(self.batch_size))
         print('Embeddings Selected: ' + self.emb_type)
+        print('Embeddings dtype: ' + self.embeddings_dtype)
         print('Dense Units: ' + str(self.dense_units))
         print('Learning Rate: ' + str(self.learning_rate))
         print('Dropout Rate: ' + str(self.rate))
@@ -187,15 +252,15 @@ class BaseModel(Layer):
 
     def load_data(self):
         """Load the 3 DataFrames, train-test-dev. The data here will be preprocessed, previously tokenized,
-        stopwords deleted and stem.
+        stopwords deleted and stem. The paths can be TSV files or the Parquet files written by main.py --mode 1.
         """
         # Load train-test-dev data
-        self.train = pd.read_csv(self.path_train, sep='\t')
+        self.train = read_table(self.path_train)
         self.train.loc[self.train['label'] == -1, 'label'] = 0
-        self.test = pd.read_csv(self.path_test, sep='\t')
+        self.test = read_table(self.path_test)
         self.test.loc[self.test['label'] == -1, 'label'] = 0
         if self.path_dev is not None:
-            self.dev = pd.read_csv(self.path_dev, sep='\t')
+            self.dev = read_table(self.path_dev)
             self.dev.loc[self.dev['label'] == -1, 'label'] = 0
         # Change the label column to categorical.
         self.y_train = tf.keras.utils.to_categorical(self.train['label'], num_classes=2)
@@ -208,14 +273,24 @@ class BaseModel(Layer):
 
     def pad_sentences(self):
         """Function that pad all the sentences  to the max_len parameter from the class.
-        First it tokenize the data with tensorflow tokenizer and then apply the pad_sequences function
+        First it tokenize the data with tensorflow tokenizer and then apply the pad_sequences function.
+        The tokenizer fitted on the same corpus in a previous run is read from the vocabulary cache.
         """
-        tokenizer = Tokenizer(num_words=self.max_len, lower=True, char_level=False)
         if self.path_dev is not None:
             full_text = pd.concat([self.train.text, self.test.text, self.dev.text])
         else:
             full_text = pd.concat([self.train.text, self.test.text])
-        tokenizer.fit_on_texts(full_text)
+        tokenizer = None
+        if self.vocabulary_cache is not None:
+            self.vocabulary_key = VocabularyCache.key(full_text, num_words=self.max_len)
+            tokenizer = self.vocabulary_cache.load_tokenizer(self.vocabulary_key)
+        if tokenizer is not None:
+            print('Using the cached tokenizer ' + self.vocabulary_key)
+        else:
+            tokenizer = Tokenizer(num_words=self.max_len, lower=True, char_level=False)
+            tokenizer.fit_on_texts(full_text)
+            if self.vocabulary_cache is not None:
+                self.vocabulary_cache.store_tokenizer(self.vocabulary_key, tokenizer)
         word_seq_train = tokenizer.texts_to_sequences(self.train['text'])
         word_seq_test = tokenizer.texts_to_sequences(self.test['text'])
         if self.path_dev is not None:
@@ -223,20 +298,26 @@ class BaseModel(Layer):
 
         self.word_index = tokenizer.word_index
 
+        self.length_profile = LengthProfile.from_sequences(word_seq_train)
         if self.length_type.lower() == 'fixed':
             print('Se usará {} como max_sequence_len.', self.max_sequence_len)
         elif self.length_type.lower() == 'mean':
             print('Se usará la media como max_sequence_len.')
-            self.max_sequence_len = self.__mean_padding(word_seq_train)
+            self.max_sequence_len = self.mean_length
         elif self.length_type.lower() == 'mode':
             print('Se usará la moda como max_sequence_len.')
-            self.max_sequence_len = self.__mode_padding(word_seq_train)
+            self.max_sequence_len = self.mode_length
         elif self.length_type.lower() == 'median':
             print('Se usará la mediana como max_sequence_len.')
-            self.max_sequence_len = self.__median_padding(word_seq_train)
+            self.max_sequence_len = self.median_length
+        elif self.length_type.lower() == 'auto':
+            print('Se usará la longitud con como mucho un {:.0%} de padding como max_sequence_len.'.format(
+                self.max_padding))
+            self.max_sequence_len = self.length_profile.recommend(self.max_padding)
         else:
             print('The padding used will be the fixed one.')
         print('The max_sequence_len is: ', self.max_sequence_len)
+        self.length_profile.print_summary(self.max_sequence_len)
 
         self.X_train = pad_sequences(word_seq_train, maxlen=self.max_sequence_len)
         self.X_test = pad_sequences(word_seq_test, maxlen=self.max_sequence_len)
@@ -245,24 +326,6 @@ class BaseModel(Layer):
 
         self.tokenizer=tokenizer
 
-    def __mean_padding(self, text):
-        lst = []
-        for sequence in text:
-            lst.append(len(sequence))
-        return int(statistics.mean(lst))
-
-    def __mode_padding(self, text):
-        lst = []
-        for sequence in text:
-            lst.append(len(sequence))
-        return int(statistics.mode(lst))
-
-    def __median_padding(self, text):
-        lst = []
-        for sequence in text:
-            lst.append(len(sequence))
-        return int(statistics.median(lst))
-
     def __sentence_median_padding(self, text):
         """Function that calculate the median of sentences in the text to pad the mean_model to that maximum
         sentences per sequence.
@@ -271,10 +334,7 @@ class BaseModel(Layer):
         Returns:
             - The padding to apply
         """
-        lst = []
-        for sequence in text:
-            lst.append(len(sent_tokenize(sequence)))
-        return int(statistics.median(lst))
+        return LengthProfile.from_sequences([sent_tokenize(sequence) for sequence in text]).median
 
     def load_vocabulary(self):
         """Function that extract the vocabulary from the train DataFrame. This functions will be used with it's needed
@@ -293,36 +353,116 @@ class BaseModel(Layer):
             self.nb_words_ft, self.embeddings_matrix_ft = self.create_1_embedding_matrix('fasttext')
 
     def create_1_embedding_matrix(self, type=None):
-        """Function that create the embedding matrix
+        """Function that create the embedding matrix. The matrix built for the same corpus and embeddings file in a
+        previous run is read from the vocabulary cache.
         """
+        if self.vocabulary_key is not None:
+            source = VocabularyCache.embeddings_fingerprint(FactoryEmbeddings.embeddings_files(type))
+            embeddings_matrix, coverage = self.vocabulary_cache.load_matrix(self.vocabulary_key, type,
+                                                                            self.embedding_size,
+                                                                            self.embeddings_dtype, source)
+            if embeddings_matrix is not None:
+                self.embeddings_coverage[type] = coverage
+                self.print_coverage(type)
+                print('Using the cached {} embeddings matrix ({:.2f} MB)'.format(type,
+                                                                               embeddings_matrix.nbytes / 2 ** 20))
+                return embeddings_matrix.shape[0], embeddings_matrix
+        start_time = time.time()
         self.emb = FactoryEmbeddings()
-        self.emb.load_embeddings(type)
-        embeddings = self.emb.embeddings.embeddings_full
-        words_not_found = []
+        if self.filter_embeddings:
+            # Stream the embeddings file and keep only the words of our vocabulary
+            self.emb.load_embeddings(type, vocabulary=self.word_index)
+        else:
+            self.emb.load_embeddings(type)
+        store = self.emb.embeddings.embeddings_full
+        if not isinstance(store, EmbeddingsStore):
+            store = EmbeddingsStore(list(store.keys()), np.array(list(store.values()), dtype=np.float32))
+        load_time = time.time() - start_time
         # Se calcula el número máximo de palabras de nuestro vocabulario
         print('Word index: ' + str(len(self.word_index)))
         nb_words = max(self.max_len, len(self.word_index))
-        # Se crea la matriz de embeddings
-        embeddings_matrix = np.zeros((nb_words, self.embedding_size))
-        # self.nb_words = min(self.max_len, len(self.word_index))
-        # self.embeddings_matrix = np.zeros((self.nb_words, self.embedding_size))
-
-        for word, i in self.word_index.items():
-            # if i >= nb_words:
-            #     continue
-            embedding_vector = embeddings.get(word)
-            if embedding_vector is not None and len(embedding_vector) > 0:
-                embeddings_matrix[i] = embedding_vector
-            else:
-                words_not_found.append(word)
-        print('Total number of null words: %d' % np.sum(np.sum(embeddings_matrix, axis=1) == 0))
+        # Every word of the vocabulary is resolved to its row in the embeddings at once, and the matrix is built with
+        # a single gather of the rows in the order of the word_index. The words with index >= nb_words are out of
+        # the num_words of the tokenizer, so they never appear in the sequences.
+        words = list(self.word_index)
+        indices = np.fromiter(self.word_index.values(), dtype=np.int64, count=len(words))
+        rows = store.rows(words)
+        in_matrix = indices < nb_words
+        found = in_matrix & (rows >= 0)
+        source_rows = np.full(nb_words, -1, dtype=np.int64)
+        source_rows[indices[found]] = rows[found]
+        if len(store) > 0:
+            embeddings_matrix = np.take(store.matrix, np.maximum(source_rows, 0), axis=0)
+            embeddings_matrix[source_rows < 0] = 0
+        else:
+            embeddings_matrix = np.zeros((nb_words, self.embedding_size), dtype=np.float32)
+        # Se crea la matriz de embeddings. The int8 matrix is quantized once it's filled in float32.
+        matrix_dtype = np.float32 if self.embeddings_dtype == 'int8' else self.embeddings_dtype
+        embeddings_matrix = embeddings_matrix.astype(matrix_dtype, copy=False)
+        self.embeddings_coverage[type] = self.coverage_stats(words, found, in_matrix)
+        self.print_coverage(type)
+        print('Embeddings matrix built in {:.2f} seconds ({:.2f} loading the embeddings).'.format(
+            time.time() - start_time, load_time))
+        if self.embeddings_dtype == 'int8':
+            embeddings_matrix = QuantizedMatrix.from_float(embeddings_matrix)
+        print('Embeddings matrix size: {:.2f} MB'.format(embeddings_matrix.nbytes / 2 ** 20))
+        if self.vocabulary_key is not None:
+            self.vocabulary_cache.store_matrix(self.vocabulary_key, type, self.embedding_size, self.embeddings_dtype,
+                                               source, embeddings_matrix, self.embeddings_coverage[type])
         return nb_words, embeddings_matrix
 
+    def print_coverage(self, type):
+        """Print the coverage statistics of the embeddings of the type (see coverage_stats).
+        """
+        stats = self.embeddings_coverage[type]
+        print('Words not found: {} of {} ({:.1%}). Coverage of the tokens of the corpus: {:.1%}'.format(
+            stats['not_found'], stats['words'], stats['not_found'] / max(stats['words'], 1),
+            stats['token_coverage']))
+
+    def coverage_stats(self, words, found, in_matrix):
+        """Statistics of the words of the vocabulary not found in the embeddings.
+        Arguments:
+            - words: list with the words of the vocabulary.
+            - found: np.array of bools, True for the words with an embedding in the matrix.
+            - in_matrix: np.array of bools, True for the words with a row in the matrix.
+        Returns:
+            - dict with the number of words with a row in the matrix, the number of them not found, the fraction
+            of the tokens of the corpus (by the word_counts of the tokenizer) that have an embedding and the 20
+            most frequent words not found.
+        """
+        word_counts = self.tokenizer.word_counts if self.tokenizer is not None else {}
+        counts = np.fromiter((word_counts.get(word, 0) for word in words), dtype=np.int64, count=len(words))
+        missed = np.flatnonzero(in_matrix & ~found)
+        top_missed = missed[np.argsort(-counts[missed], kind='stable')[:20]]
+        return {'words': int(in_matrix.sum()), 'not_found': int(missed.size),
+                'token_coverage': float(counts[found].sum() / max(counts[in_matrix].sum(), 1)),
+                'top_not_found': [words[i] for i in top_missed]}
+
+    def build_embedding_layer(self, matrix, name='embeddings'):
+        """Create the frozen embedding layer for the matrix built in create_1_embedding_matrix. With mask_padding
+        it masks the index 0.
+        Arguments:
+            - matrix: np.array (float64, float32 or float16) or QuantizedMatrix.
+            - name: name of the layer.
+        Returns:
+            - The embedding layer.
+        """
+        if isinstance(matrix, QuantizedMatrix):
+            return QuantizedEmbedding(matrix, input_length=self.input_sequence_len, mask_zero=self.mask_padding,
+                                      name=name)
+        # The float64 matrix is kept as float32 by Keras, like before. The float16 one keeps its dtype and the
+        # next layers cast its output to their own dtype.
+        dtype = 'float16' if matrix.dtype == np.float16 else 'float32'
+        return tf.keras.layers.Embedding(matrix.shape[0], self.embedding_size, weights=[matrix],
+                                         input_length=self.input_sequence_len, mask_zero=self.mask_padding,
+                                         trainable=False, dtype=dtype, name=name)
+
     def preprare_mean_document_embeddings(self):
-        if self.emb is None:
+        # The filtered embeddings only have the tokenizer vocabulary, so the full ones are needed here
+        if self.emb is None or self.filter_embeddings:
             self.emb = FactoryEmbeddings()
             self.emb.load_embeddings(self.emb_type)
-        self.max_sentences_in_sequence = self.train.text
+        self.max_sentences_in_sequence = self.__sentence_median_padding(self.train.text)
         print('El número máximo de sentencias a usar es de: ', self.max_sentences_in_sequence)
         self.mean_embeddings = self.emb.embeddings.calc_embeddings(self.train.text, self.max_sequence_len,
                                                                    self.max_sentences_in_sequence)
@@ -351,6 +491,16 @@ class BaseModel(Layer):
 
     def prepare_data_v3(self):
         self.prepare_data()
+        self.load_fact_labels()
+        self.X_train = [self.X_train, self.train_aux]
+        self.X_test = [self.X_test, self.test_aux]
+        if self.path_dev is not None:
+            self.X_dev = [self.X_dev, self.dev_aux]
+
+    def load_fact_labels(self):
+        """Load the FactLabel of the source of every document as one-hot DataFrames in train_aux, test_aux and
+        dev_aux.
+        """
         self.train_data_aux = pd.read_csv('../data/train_aux_data.tsv', sep='\t')
         self.test_data_aux = pd.read_csv('../data/test_aux_data.tsv', sep='\t')
         self.dev_data_aux = pd.read_csv('../data/dev_aux_data.tsv', sep='\t')
@@ -371,35 +521,181 @@ class BaseModel(Layer):
             print(self.train_aux.shape)
             print(self.test_aux.shape)
             raise ValueError("Shapes are differents!")
-        self.X_train = [self.X_train, self.train_aux]
-        self.X_test = [self.X_test, self.test_aux]
+
+    def load_nela_features(self):
+        """Load the NELA features of every document in nela_features_train, nela_features_test and
+        nela_features_dev.
+        """
+        nela_train = pd.read_csv('../data/train_nela_features.csv')
+        self.nela_features_train = np.asarray([np.array(literal_eval(feature))
+                                               for feature in nela_train['nela_features']], dtype=np.float32)
+        nela_test = pd.read_csv('../data/test_nela_features.csv')
+        self.nela_features_test = np.asarray([np.array(literal_eval(feature))
+                                              for feature in nela_test['nela_features']], dtype=np.float32)
         if self.path_dev is not None:
-            self.X_dev = [self.X_dev, self.dev_aux]
+            nela_dev = pd.read_csv('../data/dev_nela_features.csv')
+            self.nela_features_dev = np.asarray([np.array(literal_eval(feature))
+                                                 for feature in nela_dev['nela_features']], dtype=np.float32)
 
     def prepare_data_as_tensors(self):
         self.prepare_data()
         print('Loading data as tensors')
         # Load data as tensors
-        self.train_dataset = tf.data.Dataset.from_tensor_slices((self.X_train, self.y_train))
-        self.train_dataset = self.train_dataset.shuffle(len(self.X_train)).batch(self.batch_size)
+        self.train_dataset = self.input_pipeline.from_tensor_slices(self.X_train, self.y_train, name='train')
 
         if self.path_dev is not None:
-            self.val_dataset = tf.data.Dataset.from_tensor_slices((self.X_dev, self.y_dev))
-            self.val_dataset = self.val_dataset.shuffle(len(self.X_dev)).batch(self.batch_size)
+            self.val_dataset = self.input_pipeline.from_tensor_slices(self.X_dev, self.y_dev, training=False,
+                                                                      name='dev')
+
+    @staticmethod
+    def bucketed_dataset(X, y, bucket_boundaries, pipeline, training=True, name='data'):
+        """Dataset whose batches are padded only to the boundary of their length bucket instead of to the full
+        length of X.
+        Arguments:
+            - X: sequences padded and truncated by pad_sequences (padding at the start, index 0 only as padding).
+            - y: labels.
+            - bucket_boundaries: boundaries of the buckets, the last one greater than the length of X.
+            - pipeline: InputPipeline with the batch size, shuffle, cache and prefetch options.
+            - training: shuffle the data before making the buckets.
+            - name: name of the cache file when caching on disk.
+        Returns:
+            - tf.data.Dataset of (sequences, labels) batches.
+        """
+        lengths = np.count_nonzero(X, axis=1)
+        # bucket_by_sequence_length pads at the end, so the sequences are reversed before and the batches after it:
+        # the tokens keep their order and the padding goes to the start, like with pad_sequences
+        dataset = tf.data.Dataset.from_tensor_slices((np.ascontiguousarray(X[:, ::-1]), lengths, y))
+        dataset = pipeline.prepare(dataset, len(X), training=training, name=name)
+        dataset = pipeline.map(dataset, lambda sequence, length, label: (sequence[:length], label))
+        dataset = dataset.apply(tf.data.experimental.bucket_by_sequence_length(
+            element_length_func=lambda sequence, label: tf.shape(sequence)[0],
+            bucket_boundaries=bucket_boundaries,
+            bucket_batch_sizes=[pipeline.batch_size] * (len(bucket_boundaries) + 1),
+            pad_to_bucket_boundary=True))
+        dataset = pipeline.map(dataset, lambda sequences, labels: (tf.reverse(sequences, axis=[1]), labels))
+        return pipeline.finish(dataset)
+
+    def prepare_data_as_buckets(self, n_buckets=8):
+        """Same as prepare_data_as_tensors, but every batch is padded only to the length of its bucket, so the short
+        documents don't pay for the longest ones. The buckets hold about the same number of train documents. The
+        models built after this accept batches of any length.
+        Arguments:
+            - n_buckets: max number of length buckets.
+        """
+        self.prepare_data()
+        self.bucketed = True
+        self.bucket_boundaries = self.length_profile.bucket_boundaries(n_buckets, self.X_train.shape[1])
+        print('Loading data as tensors in buckets with boundaries: ', self.bucket_boundaries)
+        self.train_dataset = self.bucketed_dataset(self.X_train, self.y_train, self.bucket_boundaries,
+                                                   self.input_pipeline, name='train_buckets')
+        if self.path_dev is not None:
+            self.val_dataset = self.bucketed_dataset(self.X_dev, self.y_dev, self.bucket_boundaries,
+                                                     self.input_pipeline, training=False, name='dev_buckets')
+
+    def tfrecord_features(self, split, features):
+        """Auxiliary inputs of a split for export_tfrecords, loading them if needed.
+        Arguments:
+            - split: 'train', 'test' or 'dev'.
+            - features: names of the inputs: 'mean_emb' (preprare_mean_document_embeddings), 'nela_input'
+            (load_nela_features) and 'fact_label' (load_fact_labels).
+        Returns:
+            - Dict name -> np.array.
+        """
+        sources = {
+            'mean_emb': {'train': 'mean_embeddings', 'test': 'mean_embeddings_test', 'dev': 'mean_embeddings_dev'},
+            'nela_input': {'train': 'nela_features_train', 'test': 'nela_features_test',
+                           'dev': 'nela_features_dev'},
+            'fact_label': {'train': 'train_aux', 'test': 'test_aux', 'dev': 'dev_aux'},
+        }
+        unknown = [name for name in features if name not in sources]
+        if unknown:
+            raise ValueError("Unknown auxiliary inputs {}, use {}".format(', '.join(unknown), ', '.join(sources)))
+        if 'mean_emb' in features and getattr(self, 'mean_embeddings', None) is None:
+            self.preprare_mean_document_embeddings()
+        if 'nela_input' in features and getattr(self, 'nela_features_train', None) is None:
+            self.load_nela_features()
+        if 'fact_label' in features and getattr(self, 'train_aux', None) is None:
+            self.load_fact_labels()
+        return {name: np.asarray(getattr(self, sources[name][split]), dtype=np.float32) for name in features}
+
+    def export_tfrecords(self, directory, features=(), n_shards=8):
+        """Write the tokenized and truncated splits, their labels and the auxiliary inputs to sharded TFRecord files
+        (see tfrecords.py), plus the fitted tokenizer (tokenizer.json). The data must be loaded with prepare_data
+        first. prepare_data_from_tfrecords reads them back without tokenizing again.
+        Arguments:
+            - directory: output directory.
+            - features: auxiliary inputs to export (see tfrecord_features).
+            - n_shards: number of files of the train split (test and dev use half).
+        """
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'tokenizer.json'), 'w') as f:
+            f.write(self.tokenizer.to_json())
+        # The key of the corpus in the vocabulary cache, so the embeddings matrix is read from it on the way back
+        with open(os.path.join(directory, 'vocabulary.json'), 'w') as f:
+            json.dump({'key': self.vocabulary_key}, f)
+        splits = [('train', self.X_train, self.y_train, n_shards), ('test', self.X_test, self.y_test, n_shards // 2)]
+        if self.path_dev is not None:
+            splits.append(('dev', self.X_dev, self.y_dev, n_shards // 2))
+        for split, X, y, shards in splits:
+            # The sequences are the first input when prepare_data_v2/v3 or a subclass added auxiliary ones
+            X = X[0] if isinstance(X, list) else X
+            TFRecordShards.write(os.path.join(directory, split), X, y, self.tfrecord_features(split, features),
+                                 n_shards=shards)
+            print('Exported {} examples of {} to {}'.format(len(X), split, directory))
+
+    def prepare_data_from_tfrecords(self, directory, features=(), n_buckets=0):
+        """Same as prepare_data_as_tensors (or prepare_data_as_buckets with n_buckets > 0) but reading the files of
+        export_tfrecords, so the TSVs aren't read and the tokenizer isn't fitted. The train and dev splits are
+        streamed from the shards, the test one is loaded in X_test and y_test.
+        Arguments:
+            - directory: directory of the export.
+            - features: auxiliary inputs to read. With them the inputs are dicts (seq_input plus the features).
+            - n_buckets: max number of length buckets, 0 to pad every batch to max_sequence_len.
+        """
+        with open(os.path.join(directory, 'tokenizer.json')) as f:
+            self.tokenizer = tokenizer_from_json(f.read())
+        self.word_index = self.tokenizer.word_index
+        if self.vocabulary_cache is not None and os.path.exists(os.path.join(directory, 'vocabulary.json')):
+            with open(os.path.join(directory, 'vocabulary.json')) as f:
+                self.vocabulary_key = json.load(f)['key']
+        train = TFRecordShards(os.path.join(directory, 'train'))
+        missing = [name for name in features if name not in train.features]
+        if missing:
+            raise ValueError("The export in {} doesn't have the inputs {}, export them with --mode 14 "
+                             "--tfrecord-features".format(directory, ', '.join(missing)))
+        self.max_sequence_len = train.meta['max_sequence_len']
+        print('The max_sequence_len is: ', self.max_sequence_len)
+        print('Loading Vocabulary and Embeddings Matrix')
+        self.create_embeddings_matrix()
+        self.bucket_boundaries = None
+        if n_buckets:
+            self.bucketed = True
+            self.length_profile = train.length_profile()
+            self.bucket_boundaries = self.length_profile.bucket_boundaries(n_buckets, self.max_sequence_len)
+        self.train_dataset = train.dataset(self.input_pipeline, features=features,
+                                           bucket_boundaries=self.bucket_boundaries)
+        self.X_test, self.y_test = TFRecordShards(os.path.join(directory, 'test')).arrays(self.input_pipeline,
+                                                                                           features=features)
+        # X_train stays None, so fit_as_tensors(with_validation=True) validates with the dev split
+        self.val_dataset = None
+        if self.path_dev is not None:
+            dev = TFRecordShards(os.path.join(directory, 'dev'))
+            self.val_dataset = dev.dataset(self.input_pipeline, features=features, training=False,
+                                           bucket_boundaries=self.bucket_boundaries)
+            self.X_dev, self.y_dev = dev.arrays(self.input_pipeline, features=features)
 
     def prepare_data_as_tensors_v2(self):
         self.prepare_data()
         self.preprare_mean_document_embeddings()
         print('Loading data as tensors')
         # Load data as tensors
-        self.train_dataset = tf.data.Dataset.from_tensor_slices(
-            ({'seq_input': self.X_train, 'mean_emb': self.mean_embeddings}, self.y_train))
-        self.train_dataset = self.train_dataset.shuffle(len(self.X_train)).batch(self.batch_size)
+        self.train_dataset = self.input_pipeline.from_tensor_slices(
+            {'seq_input': self.X_train, 'mean_emb': self.mean_embeddings}, self.y_train, name='train_v2')
         print(self.train_dataset)
         if self.path_dev is not None:
-            self.val_dataset = tf.data.Dataset.from_tensor_slices(
-                ({'seq_input': self.X_dev, 'mean_emb': self.mean_embeddings_dev}, self.y_dev))
-            self.val_dataset = self.val_dataset.shuffle(len(self.X_dev)).batch(self.batch_size)
+            self.val_dataset = self.input_pipeline.from_tensor_slices(
+                {'seq_input': self.X_dev, 'mean_emb': self.mean_embeddings_dev}, self.y_dev, training=False,
+                name='dev_v2')
 
         """
         # TODO: Prepare val_dataset as tensor using train_dataset
@@ -440,84 +736,77 @@ class BaseModel(Layer):
         """Fit the model using the keras fit function. The data must be loaded using the prepare_data_as_tensors
         function.
         Arguments:
-            - with_validation (bool): If True test data is applied as validation set
+            - with_validation (bool): If True test data is applied as validation set (10% of the train split, or the
+            dev split when the data comes from prepare_data_from_tfrecords)
         """
         tf.random.set_seed(SEED)
+        callbacks = list(self.callbacks)
         if not with_validation:
-            self.history = self.model.fit(self.train_dataset, epochs=self.epochs, verbose=1, callbacks=self.callbacks,
+            if self.profile_input:
+                callbacks.append(InputBoundCallback(self.train_dataset))
+            self.history = self.model.fit(self.train_dataset, epochs=self.epochs, verbose=1, callbacks=callbacks,
                                           class_weight=self.class_weights)
         # elif self.path_dev is not None:
         #     self.history = self.model.fit(self.train_dataset, epochs=self.epochs, verbose=1, callbacks=self.callbacks,
         #                                   class_weight=self.class_weights, validation_data=self.val_dataset)
+        elif self.X_train is None:
+            # Read from the TFRecord export (prepare_data_from_tfrecords): the train split is only streamed, so the
+            # exported dev split is the validation data
+            if self.val_dataset is None:
+                raise ValueError("Validation with --tfrecords needs the dev split in the export (path_dev)")
+            if self.profile_input:
+                callbacks.append(InputBoundCallback(self.train_dataset))
+            self.history = self.model.fit(self.train_dataset, epochs=self.epochs, verbose=1, callbacks=callbacks,
+                                          class_weight=self.class_weights, validation_data=self.val_dataset)
         else:
             X_train_data, X_val_data, y_train_label, y_val_label = train_test_split(self.X_train, self.y_train,
                                                                                     test_size=0.1, random_state=42)
-            self.train_dataset = tf.data.Dataset.from_tensor_slices((X_train_data, y_train_label))
-            self.train_dataset = self.train_dataset.shuffle(len(X_train_data)).batch(self.batch_size)
-            self.val_dataset = tf.data.Dataset.from_tensor_slices((X_val_data, y_val_label))
-            self.val_dataset = self.val_dataset.shuffle(len(X_val_data)).batch(self.batch_size)
-            self.history = self.model.fit(self.train_dataset, epochs=self.epochs, verbose=1, callbacks=self.callbacks,
+            if self.bucketed:
+                self.train_dataset = self.bucketed_dataset(X_train_data, y_train_label, self.bucket_boundaries,
+                                                           self.input_pipeline, name='train_split_buckets')
+                self.val_dataset = self.bucketed_dataset(X_val_data, y_val_label, self.bucket_boundaries,
+                                                         self.input_pipeline, training=False,
+                                                         name='val_split_buckets')
+            else:
+                self.train_dataset = self.input_pipeline.from_tensor_slices(X_train_data, y_train_label,
+                                                                            name='train_split')
+                self.val_dataset = self.input_pipeline.from_tensor_slices(X_val_data, y_val_label, training=False,
+                                                                          name='val_split')
+            if self.profile_input:
+                callbacks.append(InputBoundCallback(self.train_dataset))
+            self.history = self.model.fit(self.train_dataset, epochs=self.epochs, verbose=1, callbacks=callbacks,
                                           class_weight=self.class_weights, validation_data=self.val_dataset)
 
     @abstractmethod
     def call(self):
         pass
 
+    def evaluate_split(self, inputs, labels):
+        """Evaluate the model over the inputs in batches (see evaluation.py), printing the first predictions and
+        the metrics.
+        Arguments:
+            - inputs: np.array, list or dict of np.arrays with the inputs of the model.
+            - labels: one-hot labels.
+        Returns:
+            - The ConfusionMatrix, from which every metric is derived.
+        """
+        batches = iterate_batches(inputs, labels, self.batch_size)
+        if self.input_pipeline.trim_padding:
+            batches = (InputPipeline.trim_batch(*batch) for batch in batches)
+        return evaluate(self.model, batches)
+
     def predict(self):
-        """Make the prediction for the test/dev data. It uses the data from the own class.
+        """Make the prediction for the test data. It uses the data from the own class.
         """
         # Actually it works as a test function to prove that the code is working.
         print('TEST SET')
-        preds = self.model.predict(self.X_test, batch_size=self.batch_size, verbose=0)
-        real_preds = []
-        for p in preds:
-            if p[0] > p[1]:
-                real_preds.append(0)
-            else:
-                real_preds.append(1)
-        print(real_preds[:10])
-        y_true = []
-        for p in self.y_test:
-            if p[0] > p[1]:
-                y_true.append(0)
-            else:
-                y_true.append(1)
-
-        print(classification_report(y_true, real_preds))
-        print('Roc auc score: ', roc_auc_score(y_true, real_preds))
-        print('Accuracy: ', accuracy_score(y_true, real_preds))
-        print('Precision-Propaganda: ', precision_score(y_true, real_preds))
-        print('Recall-Propaganda: ', recall_score(y_true, real_preds))
-        print('F1-Propaganda: ', f1_score(y_true, real_preds))
-        print('Macro F1-Propaganda: ', f1_score(y_true, real_preds, average='macro'))
+        return self.evaluate_split(self.X_test, self.y_test)
 
     def predict_dev(self):
-        """Make the prediction for the test/dev data. It uses the data from the own class.
-                """
-        # Actually it works as a test function to prove that the code is working.
+        """Make the prediction for the dev data. It uses the data from the own class.
+        """
         print('DEV SET')
-        preds = self.model.predict(self.X_dev, batch_size=self.batch_size, verbose=0)
-        real_preds = []
-        for p in preds:
-            if p[0] > p[1]:
-                real_preds.append(0)
-            else:
-                real_preds.append(1)
-        print(real_preds[:10])
-        y_true = []
-        for p in self.y_dev:
-            if p[0] > p[1]:
-                y_true.append(0)
-            else:
-                y_true.append(1)
-
-        print(classification_report(y_true, real_preds))
-        print('Roc auc score: ', roc_auc_score(y_true, real_preds))
-        print('Accuracy: ', accuracy_score(y_true, real_preds))
-        print('Precision-Propaganda: ', precision_score(y_true, real_preds))
-        print('Recall-Propaganda: ', recall_score(y_true, real_preds))
-        print('F1-Propaganda: ', f1_score(y_true, real_preds))
-        print('Macro F1-Propaganda: ', f1_score(y_true, real_preds, average='macro'))
+        return self.evaluate_split(self.X_dev, self.y_dev)
 
     def predict_test_dev(self):
         self.predict()
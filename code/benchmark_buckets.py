@@ -0,0 +1,78 @@
+"""
+Benchmark of the training throughput (samples/s) with every batch padded to max_sequence_len (prepare_data_as_tensors)
+against batches padded to their length bucket (prepare_data_as_buckets), for the BiLSTM + local-p* attention of
+LocalAttentionModel with random embeddings and documents with lognormal lengths like the Proppy ones.
+Usage: python benchmark_buckets.py --documents 2048 --max-sequence-len 650 --buckets 8
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Bidirectional, LSTM, Concatenate, Dense, GlobalMaxPool1D
+from tensorflow.keras.models import Model
+from tensorflow.keras.preprocessing.sequence import pad_sequences
+
+from attention_layers import Attention
+from basemodel import BaseModel
+from input_pipeline import InputPipeline
+from sequence_lengths import LengthProfile
+
+
+def build_model(sequence_len, vocab_size, embedding_size=300, lstm_units=64):
+    """BiLSTM + local-p* attention, as LocalAttentionModel.call.
+    """
+    sequence_input = tf.keras.layers.Input(shape=(sequence_len,), dtype='int32')
+    x = tf.keras.layers.Embedding(vocab_size, embedding_size, trainable=False)(sequence_input)
+    x, forward_h, _, backward_h, _ = Bidirectional(LSTM(lstm_units, return_sequences=True, return_state=True))(x)
+    x, _ = Attention(context='many-to-one', alignment_type='local-p*', window_width=100,
+                     score_function='scaled_dot')([x, Concatenate()([forward_h, backward_h])])
+    x = GlobalMaxPool1D()(Dense(128, activation='tanh')(x))
+    model = Model(sequence_input, Dense(2, activation='softmax')(x))
+    model.compile(loss='binary_crossentropy', optimizer='adam')
+    return model
+
+
+def samples_per_second(model, dataset, n_samples, epochs):
+    """Throughput of model.fit after a first epoch of warm up (tracing of every batch shape).
+    """
+    model.fit(dataset, epochs=1, verbose=0)
+    start = time.perf_counter()
+    model.fit(dataset, epochs=epochs, verbose=0)
+    return epochs * n_samples / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=2048)
+    parser.add_argument('--max-sequence-len', type=int, default=650)
+    parser.add_argument('--buckets', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--vocab-size', type=int, default=20000)
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+    # Median around 400 tokens and a long tail, like the Proppy articles
+    lengths = np.clip(rng.lognormal(6, 0.6, args.documents).astype(int), 1, None)
+    sequences = [rng.integers(1, args.vocab_size, length).tolist() for length in lengths]
+    X = pad_sequences(sequences, maxlen=args.max_sequence_len)
+    y = tf.keras.utils.to_categorical(rng.integers(0, 2, args.documents), num_classes=2)
+    profile = LengthProfile.from_sequences(sequences)
+    profile.print_summary(args.max_sequence_len)
+    boundaries = profile.bucket_boundaries(args.buckets, args.max_sequence_len)
+    print('Bucket boundaries: ', boundaries)
+
+    pipeline = InputPipeline(batch_size=args.batch_size)
+    fixed = pipeline.from_tensor_slices(X, y)
+    bucketed = BaseModel.bucketed_dataset(X, y, boundaries, pipeline)
+    results = {
+        'fixed': samples_per_second(build_model(args.max_sequence_len, args.vocab_size), fixed, len(X), args.epochs),
+        'bucketed': samples_per_second(build_model(None, args.vocab_size), bucketed, len(X), args.epochs),
+    }
+    for name, throughput in results.items():
+        print('{:<10}{:>12.1f} samples/s'.format(name, throughput))
+    print('Speedup: {:.2f}x'.format(results['bucketed'] / results['fixed']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of Preprocessing.remove_contractions (one lookup per word) against the previous implementation (a dict rebuilt on every
+call and a str.replace over the whole article for every contraction found).
+By default it uses synthetic articles with the length of the Proppy ones; use --data to time real articles.
+Usage: python benchmark_contractions.py --data ../data/proppy_1.0.dev.tsv
+"""
+import argparse
+import random
+import timeit
+
+import pandas as pd
+
+from preprocessing import Preprocessing, CONTRACTIONS
+
+
+def legacy_remove_contractions(text):
+    """Previous implementation of Preprocessing.remove_contractions.
+    """
+    contractions = dict(CONTRACTIONS)
+    for word in ['u', 'ur', 'n']:
+        contractions[' ' + word + ' '] = ' ' + contractions.pop(word) + ' '
+    for word in text.split():
+        if word.lower() in contractions:
+            text = text.replace(word, contractions[word.lower()])
+    return text
+
+
+def synthetic_articles(n_articles, n_words, seed=42):
+    """Articles of n_words words where around 2% of the words are contractions.
+    """
+    rng = random.Random(seed)
+    vocabulary = ['the', 'government', 'said', 'that', 'people', 'would', 'news', 'president', 'report', 'about',
+                  'media', 'election', 'and', 'of', 'to', 'in', 'a', 'was', 'for', 'on']
+    contractions = [word for word in CONTRACTIONS if "'" in word]
+    return [' '.join(rng.choice(contractions) if rng.random() < 0.02 else rng.choice(vocabulary)
+                     for _ in range(n_words))
+            for _ in range(n_articles)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default=None, help='TSV with the articles in the first column.')
+    parser.add_argument('--articles', type=int, default=200)
+    parser.add_argument('--words', type=int, default=600, help='Words per synthetic article.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    if args.data is not None:
+        data = pd.read_csv(args.data, sep='\t', header=None)
+        articles = list(data[data.columns[0]][:args.articles])
+    else:
+        articles = synthetic_articles(args.articles, args.words)
+    print('{} articles, {:.0f} words per article.'.format(len(articles),
+                                                          sum(len(a.split()) for a in articles) / len(articles)))
+    results = {}
+    for name, function in [('legacy', legacy_remove_contractions), ('single-pass', Preprocessing.remove_contractions)]:
+        seconds = min(timeit.repeat(lambda: [function(article) for article in articles], number=1,
+                                    repeat=args.repeat))
+        results[name] = seconds
+        print('{:<12}{:>10.4f} s{:>12.1f} articles/s'.format(name, seconds, len(articles) / seconds))
+    print('Speedup: {:.1f}x'.format(results['legacy'] / results['single-pass']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark of the construction of the embeddings matrix (BaseModel.create_1_embedding_matrix): the previous loop
+over the word_index with a dict lookup and a row copy per word, against resolving all the words to rows at once
+and filling the matrix with a single gather. Random embeddings of --embeddings words and a vocabulary of
+--vocabulary words, --miss of them not in the embeddings.
+Usage: python benchmark_embedding_matrix.py --embeddings 1000000 --vocabulary 100000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from embeddings import EmbeddingsStore
+
+
+def loop_matrix(store, word_index, nb_words, d):
+    """Previous version: one lookup and one row copy per word, and a pass over the matrix to count the misses.
+    """
+    matrix = np.zeros((nb_words, d), dtype=np.float32)
+    for word, i in word_index.items():
+        vector = store.get(word)
+        if vector is not None and len(vector) > 0:
+            matrix[i] = vector
+    return matrix, int(np.sum(np.sum(matrix, axis=1) == 0))
+
+
+def gather_matrix(store, word_index, nb_words, d):
+    """Current version: rows resolved in one pass and a single gather in the order of the word_index. The misses
+    are a by-product.
+    """
+    words = list(word_index)
+    indices = np.fromiter(word_index.values(), dtype=np.int64, count=len(words))
+    rows = store.rows(words)
+    found = (indices < nb_words) & (rows >= 0)
+    source_rows = np.full(nb_words, -1, dtype=np.int64)
+    source_rows[indices[found]] = rows[found]
+    matrix = np.take(store.matrix, np.maximum(source_rows, 0), axis=0)
+    matrix[source_rows < 0] = 0
+    return matrix, int((~found).sum())
+
+
+def best_time(function, repeat, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--embeddings', type=int, default=1000000)
+    parser.add_argument('--vocabulary', type=int, default=100000)
+    parser.add_argument('--miss', type=float, default=0.1, help='Fraction of the vocabulary not in the embeddings.')
+    parser.add_argument('--dim', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+    store = EmbeddingsStore(['w{}'.format(i) for i in range(args.embeddings)],
+                            rng.standard_normal((args.embeddings, args.dim), dtype=np.float32))
+    n_miss = int(args.vocabulary * args.miss)
+    words = ['w{}'.format(i) for i in rng.choice(args.embeddings, args.vocabulary - n_miss, replace=False)] + \
+            ['oov{}'.format(i) for i in range(n_miss)]
+    rng.shuffle(words)
+    word_index = {word: i + 1 for i, word in enumerate(words)}
+    nb_words = len(word_index) + 1
+    loop_time, (loop, _) = best_time(loop_matrix, args.repeat, store, word_index, nb_words, args.dim)
+    gather_time, (gather, misses) = best_time(gather_matrix, args.repeat, store, word_index, nb_words, args.dim)
+    print('Same matrix: {} - words not found: {}'.format(np.array_equal(loop, gather), misses))
+    print('{:<10}{:>12.3f} s'.format('loop', loop_time))
+    print('{:<10}{:>12.3f} s'.format('gather', gather_time))
+    print('Speedup: {:.1f}x'.format(loop_time / gather_time))
+
+
+if __name__ == '__main__':
+    main()
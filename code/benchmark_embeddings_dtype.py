@@ -0,0 +1,65 @@
+"""
+Benchmark of the dtype used for the frozen embeddings matrix. For every dtype it trains the attention model of
+--mode 2 and reports the size of the embeddings matrix and the macro F1 on the Proppy dev set.
+Usage: python benchmark_embeddings_dtype.py --epochs 5
+"""
+import argparse
+import time
+
+import numpy as np
+from sklearn.metrics import f1_score
+
+from attention_model import AttentionModel
+from modelconfiguration import ModelConfig
+
+DTYPES = ['float64', 'float32', 'float16', 'int8']
+
+
+def run(dtype, epochs):
+    """Train the attention model with the embeddings matrix in the dtype given.
+    Returns:
+        - Bytes of the embeddings matrix and macro F1 on the dev set.
+    """
+    config = ModelConfig.AttentionConfig.value
+    model = AttentionModel(batch_size=config['batch_size'], epochs=epochs or config['epochs'],
+                           vocab_size=config['vocab_size'],
+                           max_len=config['max_len'], filters=config['filters'], kernel_size=config['kernel_size'],
+                           optimizer=config['optimizer'], learning_rate=config['learning_rate'],
+                           max_sequence_len=config['max_sequence_len'], lstm_units=config['lstm_units'],
+                           embedding_size=config['embedding_size'], load_embeddings=config['load_embeddings'],
+                           pool_size=config['pool_size'], path_train=config['path_train'],
+                           path_test=config['path_test'], path_dev=config['path_dev'], emb_type=config['emb_type'],
+                           buffer_size=config['buffer_size'], rate=config['rate'],
+                           length_type=config['length_type'],
+                           dense_units=config['dense_units'],
+                           att_units=config['att_units'],
+                           embeddings_dtype=dtype
+                           )
+    model.prepare_data_as_tensors()
+    model.call()
+    model.fit_as_tensors(with_validation=False)
+    preds = model.model.predict(model.X_dev, batch_size=model.batch_size, verbose=0)
+    macro_f1 = f1_score(np.argmax(model.y_dev, axis=1), np.argmax(preds, axis=1), average='macro')
+    return model.embeddings_matrix.nbytes, macro_f1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--epochs', type=int, help='Epochs to train every model.', default=None)
+    parser.add_argument('--dtypes', nargs='+', choices=DTYPES, default=DTYPES)
+    args = parser.parse_args()
+    results = {}
+    for dtype in args.dtypes:
+        start_time = time.time()
+        results[dtype] = run(dtype, args.epochs)
+        print('{} done in {:.2f} seconds.'.format(dtype, time.time() - start_time))
+    base_bytes, base_f1 = results[args.dtypes[0]]
+    print('{:<10}{:>12}{:>12}{:>12}{:>12}'.format('dtype', 'MB', 'saved MB', 'macro F1', 'delta F1'))
+    for dtype, (nbytes, macro_f1) in results.items():
+        print('{:<10}{:>12.2f}{:>12.2f}{:>12.4f}{:>+12.4f}'.format(dtype, nbytes / 2 ** 20,
+                                                                  (base_bytes - nbytes) / 2 ** 20,
+                                                                  macro_f1, macro_f1 - base_f1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark of the Gaussian of the 'local-p' alignment of attention_layers.Attention: the previous loop, which added
+a Concatenate op per position of the sequence, against the broadcast of the positions against the aligned
+position. For every sequence length it reports the ops in the graph of the forward pass, the time to trace and
+run the first training step, the time per training step and the peak memory of the process. Every case runs in a
+new interpreter so the peak memory of one doesn't hide the next one.
+Usage: python benchmark_local_p.py --lengths 256 512 1024
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Bidirectional, LSTM, Concatenate, Dense, GlobalMaxPool1D
+from tensorflow.keras.models import Model
+
+from attention_layers import Attention
+
+
+class LoopGaussianAttention(Attention):
+    """Attention with the previous Gaussian of 'local-p', one Concatenate per position.
+    """
+
+    def gaussian_factor(self, aligned_position, source_hidden_states):
+        gaussian_estimation = lambda s: tf.exp(-tf.square(s - aligned_position) /
+                                               (2 * tf.square(self.window_width / 2)))
+        gaussian_factor = gaussian_estimation(0)
+        for i in range(1, self.input_sequence_length):
+            gaussian_factor = Concatenate(axis=1)([gaussian_factor, gaussian_estimation(i)])
+        return gaussian_factor
+
+
+def build_model(layer_class, sequence_len, embedding_size=64, lstm_units=32):
+    """BiLSTM + local-p attention, as the models of mean_model.py.
+    """
+    sequence_input = tf.keras.layers.Input(shape=(sequence_len, embedding_size))
+    x, forward_h, _, backward_h, _ = Bidirectional(LSTM(lstm_units, return_sequences=True,
+                                                        return_state=True))(sequence_input)
+    x, _ = layer_class(context='many-to-one', alignment_type='local-p', window_width=100,
+                       score_function='scaled_dot')([x, Concatenate()([forward_h, backward_h])])
+    x = GlobalMaxPool1D()(Dense(64, activation='tanh')(x))
+    model = Model(sequence_input, Dense(2, activation='softmax')(x))
+    model.compile(loss='binary_crossentropy', optimizer='adam')
+    return model
+
+
+def run_case(variant, sequence_len, batch_size, steps):
+    """Measure one case in this process.
+    """
+    layer_class = LoopGaussianAttention if variant == 'loop' else Attention
+    rng = np.random.default_rng(42)
+    X = rng.standard_normal((batch_size, sequence_len, 64)).astype(np.float32)
+    y = tf.keras.utils.to_categorical(rng.integers(0, 2, batch_size), num_classes=2)
+    start = time.perf_counter()
+    model = build_model(layer_class, sequence_len)
+    forward = tf.function(model).get_concrete_function(tf.TensorSpec((None, sequence_len, 64), tf.float32))
+    n_ops = len(forward.graph.get_operations())
+    model.train_on_batch(X, y)
+    trace_seconds = time.perf_counter() - start
+    times = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        model.train_on_batch(X, y)
+        times.append(time.perf_counter() - start)
+    return {'ops': n_ops, 'trace_seconds': trace_seconds, 'step_ms': 1000 * float(np.median(times)),
+            'peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='+', default=[256, 512, 1024])
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--case', nargs=2, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.case is not None:
+        print(json.dumps(run_case(args.case[0], int(args.case[1]), args.batch_size, args.steps)))
+        return
+    print('{:>6}{:>12}{:>10}{:>12}{:>12}{:>12}'.format('S', 'variant', 'ops', 'trace s', 'step ms', 'peak MB'))
+    for sequence_len in args.lengths:
+        for variant in ['loop', 'broadcast']:
+            result = subprocess.run([sys.executable, __file__, '--case', variant, str(sequence_len),
+                                     '--batch-size', str(args.batch_size), '--steps', str(args.steps)],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+            if result.returncode != 0:
+                print('{:>6}{:>12}{:>10}'.format(sequence_len, variant, 'error'))
+                continue
+            case = json.loads(result.stdout.strip().splitlines()[-1])
+            print('{:>6}{:>12}{:>10}{:>12.2f}{:>12.1f}{:>12.0f}'.format(sequence_len, variant, case['ops'],
+                                                                        case['trace_seconds'], case['step_ms'],
+                                                                        case['peak_mb']))
+
+
+if __name__ == '__main__':
+    main()
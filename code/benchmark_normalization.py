@@ -0,0 +1,75 @@
+"""
+Micro-benchmark of the stopwords and stemming stages of the preprocessing: the previous implementation (list of
+stopwords and a new PorterStemmer per call, one stem per token occurrence) against Preprocessing.normalize_tokens
+(frozenset of stopwords and vocabulary-level stem cache).
+By default it uses synthetic tokenized articles; use --data to time real articles (they are tokenized first).
+Usage: python benchmark_normalization.py --data ../data/proppy_1.0.dev.tsv
+"""
+import argparse
+import random
+import timeit
+
+import pandas as pd
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer
+from stop_words import get_stop_words
+
+from preprocessing import Preprocessing
+
+
+def legacy_normalize_tokens(text):
+    """Previous delete_stopwords followed by the previous stemming.
+    """
+    all_stop_words = list(get_stop_words('en')) + list(stopwords.words('english'))
+    text = [[w for w in word if w not in all_stop_words] for word in text]
+    stemmer = PorterStemmer()
+    stem_list = [[stemmer.stem(token) for token in sentence] for sentence in text]
+    stem_join = [' '.join(sentence) for sentence in stem_list]
+    return stem_list, stem_join
+
+
+def synthetic_documents(n_documents, n_tokens, vocabulary_size=20000, seed=42):
+    """Tokenized documents with Zipf distributed tokens: a third of them stopwords and the rest random words.
+    """
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    vocabulary = [''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))) + rng.choice(['', 's', 'ing', 'ed'])
+                  for _ in range(vocabulary_size)]
+    weights = [1. / (rank + 1) for rank in range(vocabulary_size)]
+    stop_words = sorted(Preprocessing.stop_words())
+    return [[rng.choice(stop_words) if rng.random() < 0.33 else token
+             for token in rng.choices(vocabulary, weights=weights, k=n_tokens)]
+            for _ in range(n_documents)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', default=None, help='TSV with the articles in the first column.')
+    parser.add_argument('--documents', type=int, default=500)
+    parser.add_argument('--tokens', type=int, default=600, help='Tokens per synthetic document.')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    if args.data is not None:
+        data = pd.read_csv(args.data, sep='\t', header=None)
+        documents = list(data[data.columns[0]][:args.documents])
+        documents = Preprocessing.tokenize(Preprocessing.remove_all_contractions(
+            Preprocessing.preprocess_all_sentences(documents)))
+    else:
+        documents = synthetic_documents(args.documents, args.tokens)
+    n_tokens = sum(len(document) for document in documents)
+    print('{} documents, {} tokens.'.format(len(documents), n_tokens))
+    assert legacy_normalize_tokens(documents) == Preprocessing.normalize_tokens(documents)
+    results = {}
+    for name, function in [('legacy', legacy_normalize_tokens), ('cached', Preprocessing.normalize_tokens)]:
+        # The stem cache starts empty on every run.
+        seconds = min(timeit.repeat(lambda: function(documents), setup=Preprocessing.stem_cache.clear, number=1,
+                                    repeat=args.repeat))
+        results[name] = seconds
+        print('{:<12}{:>10.4f} s{:>14.1f} tokens/s'.format(name, seconds, n_tokens / seconds))
+    print('Speedup: {:.1f}x (stem cache: {} stems, {:.1f}% hit rate)'.format(
+        results['legacy'] / results['cached'], len(Preprocessing.stem_cache),
+        100 * Preprocessing.stem_cache.hit_rate()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark of the padding of the BiLSTM + local-p* model of LocalAttentionModel (mean_model.py) over an epoch of
+documents with a long-tailed length distribution, all padded at the start to --max-len: 'padded' as before,
+'masked' with the Embedding masking the padding (mask_zero), and 'trimmed' masking it and trimming every batch to
+its longest document (InputPipeline.trim_batch). With --sort the documents are sorted by length first, which is
+what the length buckets do (see BaseModel.prepare_data_as_buckets). It also checks that the masked model gives
+the same outputs with and without trimming. Every variant runs in a new interpreter, as the ones measured after
+others in the same process were slower, and the CPU seconds of the epoch are reported next to the wall ones, which
+are noisy on shared machines.
+Usage: python benchmark_padding.py --max-len 650 --documents 2048
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Bidirectional, LSTM, Concatenate, Dense, Embedding
+from tensorflow.keras.models import Model
+
+from attention_layers import Attention
+from input_pipeline import InputPipeline
+from maskedpooling import MaskedGlobalMaxPool1D
+
+
+def build_model(matrix, sequence_len, mask_zero, lstm_units=64, dense_units=128):
+    """Embedding + BiLSTM + local-p* attention + Dense + max pooling, as LocalAttentionModel.call.
+    """
+    sequence_input = tf.keras.layers.Input(shape=(sequence_len,), dtype='int32')
+    x = Embedding(matrix.shape[0], matrix.shape[1], weights=[matrix], trainable=False,
+                  mask_zero=mask_zero)(sequence_input)
+    x, forward_h, _, backward_h, _ = Bidirectional(LSTM(lstm_units, return_sequences=True, return_state=True))(x)
+    x, _ = Attention(context='many-to-one', alignment_type='local-p*', window_width=100,
+                     score_function='scaled_dot')([x, Concatenate()([forward_h, backward_h])])
+    x = MaskedGlobalMaxPool1D()(Dense(dense_units, activation='tanh')(x))
+    model = Model(sequence_input, Dense(2, activation='softmax')(x))
+    model.compile(loss='binary_crossentropy', optimizer='adam')
+    return model
+
+
+def documents(n_documents, max_len, vocabulary, rng):
+    """Documents with log-normal lengths (median max_len / 4) padded at the start to max_len.
+    """
+    lengths = np.clip(rng.lognormal(np.log(max_len / 4), 0.8, n_documents).astype(int), 1, max_len)
+    X = np.zeros((n_documents, max_len), dtype=np.int32)
+    for i, length in enumerate(lengths):
+        X[i, max_len - length:] = rng.integers(1, vocabulary, length)
+    return X, lengths
+
+
+def epoch_seconds(model, dataset):
+    """Wall and CPU seconds of a training epoch.
+    """
+    start, start_cpu = time.perf_counter(), time.process_time()
+    for inputs, labels in dataset:
+        model.train_on_batch(inputs, labels)
+    return time.perf_counter() - start, time.process_time() - start_cpu
+
+
+def run_case(variant, args):
+    """Measure one variant in this process.
+    """
+    rng = np.random.default_rng(42)
+    matrix = rng.standard_normal((args.vocabulary, 300)).astype(np.float32)
+    X, lengths = documents(args.documents, args.max_len, args.vocabulary, rng)
+    if args.sort:
+        X, lengths = X[np.argsort(lengths, kind='stable')], np.sort(lengths)
+    y = tf.keras.utils.to_categorical(rng.integers(0, 2, args.documents), num_classes=2)
+    trim_padding = variant == 'trimmed'
+    dataset = InputPipeline(batch_size=args.batch_size, trim_padding=trim_padding).from_tensor_slices(
+        X, y, training=False)
+    model = build_model(matrix, None if trim_padding else args.max_len, mask_zero=variant != 'padded')
+    # The first epoch traces the model (a few times when trimming, until the length of the batches is relaxed)
+    epoch_seconds(model, dataset)
+    case = {'median_length': float(np.median(lengths)), 'padding': float(1 - lengths.sum() / X.size),
+            'seconds': epoch_seconds(model, dataset),
+            'columns': sum(int(inputs.shape[0]) * int(inputs.shape[1]) for inputs, _ in dataset) / X.size}
+    if trim_padding:
+        batch = X[:args.batch_size]
+        trimmed = InputPipeline.trim_batch(batch, None)[0]
+        case['difference'] = float(np.abs(model.predict_on_batch(batch) - model.predict_on_batch(trimmed)).max())
+    return case
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-len', type=int, default=650)
+    parser.add_argument('--documents', type=int, default=2048)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    parser.add_argument('--sort', action='store_true', help='Sort the documents by length.')
+    parser.add_argument('--case', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.case is not None:
+        print(json.dumps(run_case(args.case, args)))
+        return
+    options = ['--max-len', str(args.max_len), '--documents', str(args.documents), '--batch-size',
+               str(args.batch_size), '--vocabulary', str(args.vocabulary)] + (['--sort'] if args.sort else [])
+    print('{:<10}{:>14}{:>14}{:>12}'.format('variant', 'epoch s', 'epoch cpu s', 'columns'))
+    for variant in ['padded', 'masked', 'trimmed']:
+        result = subprocess.run([sys.executable, __file__, '--case', variant] + options,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        if result.returncode != 0:
+            print('{:<10}{:>14}'.format(variant, 'error'))
+            continue
+        case = json.loads(result.stdout.strip().splitlines()[-1])
+        print('{:<10}{:>14.2f}{:>14.2f}{:>11.0%}'.format(variant, *case['seconds'], case['columns']))
+    print('Median length {:.0f}, padding {:.0%} of the tokens'.format(case['median_length'], case['padding']))
+    if 'difference' in case:
+        print('Max difference of the outputs with and without trimming: {:.2e}'.format(case['difference']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Cold-start benchmark of main.py: time until every mode can start working, i.e. the time a fresh interpreter needs
+to import the modules that the mode uses. 'all' is the previous behaviour, where every mode imported all the models
+(and so TensorFlow, torch, transformers, tensorflow_hub, bert and seaborn).
+Usage: python benchmark_startup.py --repeat 3
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+# Modules imported by every mode of main.py
+MODE_MODULES = {
+    1: ['preprocessing', 'preprocessing_cache'],
+    2: ['attention_model'],
+    3: ['cnnrnn_model'],
+    4: ['cnnrnn_model'],
+    5: ['bertmodel'],
+    6: ['modeltransformer'],
+    7: ['mean_model'],
+    8: ['attention_model'],
+    9: ['attention_model'],
+    10: ['bertmodel'],
+    11: ['mean_model'],
+    12: ['bertbilstmmodel'],
+    13: ['embeddings'],
+    14: ['attention_model'],
+    'all': ['cnnrnn_model', 'attention_model', 'mean_model', 'modeltransformer', 'finetune', 'bertmodel',
+            'bertbilstmmodel', 'preprocessing', 'embeddings', 'preprocessing_cache'],
+}
+
+
+def cold_start(modules):
+    """Seconds that a new interpreter needs to start and import the modules, or None if an import fails.
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', 'import main; ' + '; '.join('import ' + m for m in modules)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if result.returncode != 0:
+        return None
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print('{:<8}{:>12}  {}'.format('mode', 'seconds', 'modules'))
+    for mode, modules in MODE_MODULES.items():
+        times = [cold_start(modules) for _ in range(args.repeat)]
+        if None in times:
+            print('{:<8}{:>12}  {}'.format(mode, 'error', ', '.join(modules)))
+        else:
+            print('{:<8}{:>12.2f}  {}'.format(mode, min(times), ', '.join(modules)))
+
+
+if __name__ == '__main__':
+    main()
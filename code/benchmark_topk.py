@@ -0,0 +1,87 @@
+"""
+Benchmark of the two modes of the 'local-p*' attention of attention_layers.Attention: 'dense', which scales the
+top window_width timesteps in the full sequence and scores the S timesteps, against 'gather', which scores only the
+top window_width timesteps. It reports the time per training and per inference step of the BiLSTM + local-p* model
+of LocalAttentionModel (without the embeddings), and of the attention and the layers after it alone (the BiLSTM
+outputs as inputs), for every sequence length.
+Usage: python benchmark_topk.py --lengths 650 1300 2600 --window-width 100
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Bidirectional, LSTM, Concatenate, Dense, GlobalMaxPool1D
+from tensorflow.keras.models import Model
+
+from attention_layers import Attention
+
+
+def attention_head(x, hidden_state, topk_mode, window_width, dense_units=128):
+    """local-p* attention + Dense + GlobalMaxPool1D + softmax, as LocalAttentionModel.call.
+    """
+    x, _ = Attention(context='many-to-one', alignment_type='local-p*', window_width=window_width,
+                     score_function='scaled_dot', topk_mode=topk_mode)([x, hidden_state])
+    x = GlobalMaxPool1D()(Dense(dense_units, activation='tanh')(x))
+    return Dense(2, activation='softmax')(x)
+
+
+def build_model(topk_mode, sequence_len, window_width, embedding_size=300, lstm_units=64):
+    """BiLSTM + attention_head.
+    """
+    sequence_input = tf.keras.layers.Input(shape=(sequence_len, embedding_size))
+    x, forward_h, _, backward_h, _ = Bidirectional(LSTM(lstm_units, return_sequences=True,
+                                                        return_state=True))(sequence_input)
+    model = Model(sequence_input, attention_head(x, Concatenate()([forward_h, backward_h]), topk_mode,
+                                                 window_width))
+    model.compile(loss='binary_crossentropy', optimizer='adam')
+    return model
+
+
+def build_head(topk_mode, sequence_len, window_width, lstm_units=64):
+    """attention_head alone, with the outputs and the last hidden state of the BiLSTM as inputs.
+    """
+    states = tf.keras.layers.Input(shape=(sequence_len, 2 * lstm_units))
+    hidden_state = tf.keras.layers.Input(shape=(2 * lstm_units,))
+    model = Model([states, hidden_state], attention_head(states, hidden_state, topk_mode, window_width))
+    model.compile(loss='binary_crossentropy', optimizer='adam')
+    return model
+
+
+def median_ms(function, steps):
+    function()
+    times = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return 1000 * float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='+', default=[650, 1300, 2600])
+    parser.add_argument('--window-width', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=10)
+    args = parser.parse_args()
+    rng = np.random.default_rng(42)
+    print('{:>6}{:>10}{:>14}{:>14}{:>16}{:>16}'.format('S', 'mode', 'train ms', 'predict ms', 'head train ms',
+                                                       'head pred ms'))
+    for sequence_len in args.lengths:
+        X = rng.standard_normal((args.batch_size, sequence_len, 300)).astype(np.float32)
+        states = [rng.standard_normal((args.batch_size, sequence_len, 128)).astype(np.float32),
+                  rng.standard_normal((args.batch_size, 128)).astype(np.float32)]
+        y = tf.keras.utils.to_categorical(rng.integers(0, 2, args.batch_size), num_classes=2)
+        for topk_mode in ['dense', 'gather']:
+            model = build_model(topk_mode, sequence_len, args.window_width)
+            head = build_head(topk_mode, sequence_len, args.window_width)
+            times = [median_ms(lambda: model.train_on_batch(X, y), args.steps),
+                     median_ms(lambda: model.predict_on_batch(X), args.steps),
+                     median_ms(lambda: head.train_on_batch(states, y), args.steps),
+                     median_ms(lambda: head.predict_on_batch(states), args.steps)]
+            print('{:>6}{:>10}{:>14.1f}{:>14.1f}{:>16.2f}{:>16.2f}'.format(sequence_len, topk_mode, *times))
+
+
+if __name__ == '__main__':
+    main()
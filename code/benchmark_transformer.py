@@ -0,0 +1,102 @@
+"""
+Benchmark of the self attention of TransformerModel (modeltransformer.py) for every max_sequence_len: 'separate',
+the previous query, key and value Dense layers and full (seq_len, seq_len) attention, 'fused', a single Dense for
+the three and full attention, and 'chunked', the fused projection with the attention in blocks of --chunk-size
+(MultiHeadSelfAttention.chunked_attention), and 'window', the fused projection with the local attention of
+--window tokens at each side and --global-tokens global tokens (MultiHeadSelfAttention.local_attention). The model
+is the one of TransformerModel.call with the options of TransformerConfig and random embeddings. It reports the
+time per training step, the CPU time per step and the peak memory of the process. Every case runs in a new
+interpreter so the peak memory of one doesn't hide the next one.
+Usage: python benchmark_transformer.py --lengths 650 1300 2600 --chunk-size 128 --window 64 --global-tokens 4
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from modelconfiguration import ModelConfig
+from modeltransformer import TransformerModel
+
+VARIANTS = {'separate': {'fused_qkv': False, 'attention_chunk_size': None},
+            'fused': {'fused_qkv': True, 'attention_chunk_size': None},
+            'chunked': {'fused_qkv': True},
+            'window': {'fused_qkv': True, 'attention_chunk_size': None}}
+
+
+def build_model(variant, sequence_len, chunk_size, window, global_tokens, vocabulary):
+    """TransformerModel with the options of TransformerConfig, without loading data nor embeddings.
+    """
+    config = ModelConfig.TransformerConfig.value
+    options = dict(VARIANTS[variant])
+    options.setdefault('attention_chunk_size', chunk_size)
+    if variant == 'window':
+        options.update(attention_window=window, global_tokens=global_tokens)
+    model = TransformerModel(batch_size=config['batch_size'], epochs=1, vocab_size=config['vocab_size'],
+                             max_len=config['max_len'], optimizer=config['optimizer'],
+                             learning_rate=config['learning_rate'], max_sequence_len=sequence_len,
+                             lstm_units=config['lstm_units'], embedding_size=config['embedding_size'],
+                             load_embeddings=False, path_train=None, path_test=None, path_dev=None,
+                             rate=config['rate'], dense_units=config['dense_units'], attheads=config['attheads'],
+                             att_layers=config['att_layers'], vocabulary_cache=None, **options)
+    model.nb_words = vocabulary
+    model.embeddings_matrix = np.random.default_rng(42).standard_normal(
+        (vocabulary, config['embedding_size'])).astype(np.float32)
+    model.call()
+    return model.model
+
+
+def run_case(variant, sequence_len, chunk_size, window, global_tokens, batch_size, steps, vocabulary=20000):
+    """Measure one case in this process.
+    """
+    rng = np.random.default_rng(42)
+    X = rng.integers(1, vocabulary, (batch_size, sequence_len)).astype(np.int32)
+    y = tf.keras.utils.to_categorical(rng.integers(0, 2, batch_size), num_classes=2)
+    model = build_model(variant, sequence_len, chunk_size, window, global_tokens, vocabulary)
+    model.train_on_batch(X, y)
+    times, cpu_times = [], []
+    for _ in range(steps):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        model.train_on_batch(X, y)
+        times.append(time.perf_counter() - start)
+        cpu_times.append(time.process_time() - start_cpu)
+    return {'step_ms': 1000 * float(np.median(times)), 'cpu_ms': 1000 * float(np.median(cpu_times)),
+            'peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='+', default=[650, 1300, 2600])
+    parser.add_argument('--chunk-size', type=int, default=128)
+    parser.add_argument('--window', type=int, default=64)
+    parser.add_argument('--global-tokens', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--case', nargs=2, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.case is not None:
+        print(json.dumps(run_case(args.case[0], int(args.case[1]), args.chunk_size, args.window, args.global_tokens,
+                                  args.batch_size, args.steps)))
+        return
+    print('{:>6}{:>10}{:>12}{:>12}{:>12}'.format('S', 'variant', 'step ms', 'cpu ms', 'peak MB'))
+    for sequence_len in args.lengths:
+        for variant in VARIANTS:
+            result = subprocess.run([sys.executable, __file__, '--case', variant, str(sequence_len),
+                                     '--chunk-size', str(args.chunk_size), '--window', str(args.window),
+                                     '--global-tokens', str(args.global_tokens), '--batch-size', str(args.batch_size),
+                                     '--steps', str(args.steps)],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+            if result.returncode != 0:
+                print('{:>6}{:>10}{:>12}'.format(sequence_len, variant, 'error'))
+                continue
+            case = json.loads(result.stdout.strip().splitlines()[-1])
+            print('{:>6}{:>10}{:>12.1f}{:>12.1f}{:>12.0f}'.format(sequence_len, variant, case['step_ms'],
+                                                                  case['cpu_ms'], case['peak_mb']))
+
+
+if __name__ == '__main__':
+    main()
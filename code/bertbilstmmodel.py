@@ -13,13 +13,11 @@ from tensorflow.keras.layers import LSTM, Bidirectional, Conv1D, GlobalAveragePo
     Dropout, Layer, Dense, MaxPool1D, Concatenate, LayerNormalization, SpatialDropout1D, Flatten
 from tensorflow.keras.losses import BinaryCrossentropy, CategoricalCrossentropy, SparseCategoricalCrossentropy
 from tensorflow.keras.regularizers import l2, l1, l1_l2
-from sklearn.metrics import classification_report, accuracy_score, roc_auc_score
 from tensorflow.keras.callbacks import ReduceLROnPlateau, EarlyStopping, ModelCheckpoint
 from basemodel import BaseModel
+from maskedpooling import MaskedGlobalMaxPool1D
 from banhdanauattention import BahdanauAttention
 from attention_layers import Attention, SelfAttention
-from sklearn.metrics import classification_report, accuracy_score, roc_auc_score, f1_score, precision_score, \
-    recall_score
 from nela_features.nela_features import NELAFeatureExtractor
 import calendar
 # Visualization
@@ -40,8 +38,10 @@ class LocalAttentionModelNela(BaseModel):
                  path_train, path_test, vocab_size=None, l2_rate=1e-5, path_dev=None,
                  learning_rate=1e-3, pool_size=4, rate=0.2, filters=64, kernel_size=5,
                  embedding_size=300, max_len=1900, load_embeddings=True, buffer_size=3, emb_type='fasttext',
-                 length_type='median', dense_units=128, both_embeddings=False):
-        """Init function for the model.
+                 length_type='median', dense_units=128, both_embeddings=False, topk_mode='dense', **kwargs):
+        """Init function for the model. The keyword arguments not listed here are passed to BaseModel.
+        topk_mode is the one of the local-p* attention: 'dense' or 'gather' (only the top window_width timesteps
+        are scored, see attention_layers.Attention).
         """
         super(LocalAttentionModelNela, self).__init__(max_len=max_len, path_train=path_train,
                                                       path_test=path_test, path_dev=path_dev, batch_size=batch_size,
@@ -53,9 +53,10 @@ class LocalAttentionModelNela(BaseModel):
                                                       length_type=length_type, dense_units=dense_units,
                                                       both_embeddings=both_embeddings, buffer_size=buffer_size,
                                                       filters=filters, kernel_size=kernel_size, pool_size=pool_size,
-                                                      l2_rate=l2_rate
+                                                      l2_rate=l2_rate, **kwargs
                                                       )
         self.lstm_units = lstm_units
+        self.topk_mode = topk_mode
 
     def attention(self, query, key, value):
         """Function that computes the Scaled Dot-Product Attention
@@ -94,11 +95,8 @@ class LocalAttentionModelNela(BaseModel):
     def call(self):
         # First Model
         # Prepraring the embeddings input
-        sequence_input = tf.keras.layers.Input(shape=(self.max_sequence_len,), dtype="int32", name="seq_input")
-        token_embeddings_glove = tf.keras.layers.Embedding(self.nb_words, self.embedding_size,
-                                                           weights=[self.embeddings_matrix],
-                                                           input_length=self.max_sequence_len,
-                                                           trainable=False, name='embeddings')
+        sequence_input = tf.keras.layers.Input(shape=(self.input_sequence_len,), dtype="int32", name="seq_input")
+        token_embeddings_glove = self.build_embedding_layer(self.embeddings_matrix, name='embeddings')
         # embedding_sequence = Concatenate(axis=1, name='full_embeddings')([embedding_sequence_glove,
         #                                                                   embedding_sequence_ft])
         embedding_sequence = token_embeddings_glove(sequence_input)
@@ -125,6 +123,7 @@ class LocalAttentionModelNela(BaseModel):
                                                 alignment_type='local-p*',
                                                 window_width=100,
                                                 score_function='scaled_dot',
+                                                topk_mode=self.topk_mode,
                                                 name='attention_layer')(attention_input)
         # out = LayerNormalization(epsilon=1e-6)([encoder_output+att_weights])
         ########################## NEW ###############################
@@ -135,7 +134,7 @@ class LocalAttentionModelNela(BaseModel):
         # out = Dropout(rate=self.rate, name='dropout')(out)
         # encoder_output = Flatten()(encoder_output)
         # out = GlobalMaxPool1D()(encoder_output)
-        out = GlobalMaxPool1D()(out)
+        out = MaskedGlobalMaxPool1D()(out)
         # concat = Dense(self.dense_units/2, activation='relu', kernel_regularizer=l2(self.l2_rate))(concat)
         ###################### ADDING NELA FEATURES #####################
         nela_input = tf.keras.layers.Input(shape=(126,), dtype="float32", name="nela_input")
@@ -156,27 +155,12 @@ class LocalAttentionModelNela(BaseModel):
         # tf.keras.utils.plot_model(self.model, show_shapes=True, dpi=48, to_file='local_attention_model.png')
 
     def calculate_nela_features(self):
-        self.nela_features_train = []
-        self.nela_features_test = []
-        # Create the Nela Feature extractor
-        nela_train = pd.read_csv('../data/train_nela_features.csv')
-        nela_test = pd.read_csv('../data/test_nela_features.csv')
-        nela_features_train = np.asarray([np.array(literal_eval(feature)) for feature in nela_train['nela_features']], dtype=np.float32)
-        nela_train['nela_features'] = nela_features_train
-        self.nela_features_train = nela_features_train
-        nela_features_test = np.asarray([np.array(literal_eval(feature)) for feature in nela_test['nela_features']], dtype=np.float32)
-        nela_test['nela_features'] = nela_features_test
-        self.nela_features_test = nela_features_test
+        self.load_nela_features()
         print(len(self.nela_features_test))
         self.X_train = [self.X_train, self.nela_features_train]
         self.X_test = [self.X_test, self.nela_features_test]
         # If we're going for exp 1
         if self.path_dev is not None:
-            self.nela_features_dev = []
-            nela_dev = pd.read_csv('../data/dev_nela_features.csv')
-            nela_features_dev = np.asarray([np.array(literal_eval(feature)) for feature in nela_dev['nela_features']], dtype=np.float32)
-            nela_dev['nela_features'] = nela_features_dev
-            self.nela_features_dev = nela_features_dev
             print(len(self.nela_features_dev))
             self.X_dev = [self.X_dev, self.nela_features_dev]
 
@@ -246,59 +230,3 @@ class LocalAttentionModelNela(BaseModel):
         r = 255 - int(attention_score * 255)
         color = self.rgb_to_hex((255, r, r))
         return str(color)
-
-    def predict(self):
-        """Make the prediction for the test/dev data. It uses the data from the own class.
-        """
-        # Actually it works as a test function to prove that the code is working.
-        print('TEST SET')
-        preds = self.model.predict(self.X_test, batch_size=self.batch_size, verbose=0)
-        real_preds = []
-        for p in preds:
-            if p[0] > p[1]:
-                real_preds.append(0)
-            else:
-                real_preds.append(1)
-        print(real_preds[:10])
-        y_true = []
-        for p in self.y_test:
-            if p[0] > p[1]:
-                y_true.append(0)
-            else:
-                y_true.append(1)
-
-        print(classification_report(y_true, real_preds))
-        print('Roc auc score: ', roc_auc_score(y_true, real_preds))
-        print('Accuracy: ', accuracy_score(y_true, real_preds))
-        print('Precision-Propaganda: ', precision_score(y_true, real_preds))
-        print('Recall-Propaganda: ', recall_score(y_true, real_preds))
-        print('F1-Propaganda: ', f1_score(y_true, real_preds))
-        print('Macro F1-Propaganda: ', f1_score(y_true, real_preds, average='macro'))
-
-    def predict_dev(self):
-        """Make the prediction for the test/dev data. It uses the data from the own class.
-                """
-        # Actually it works as a test function to prove that the code is working.
-        print('DEV SET')
-        preds = self.model.predict(self.X_dev, batch_size=self.batch_size, verbose=0)
-        real_preds = []
-        for p in preds:
-            if p[0] > p[1]:
-                real_preds.append(0)
-            else:
-                real_preds.append(1)
-        print(real_preds[:10])
-        y_true = []
-        for p in self.y_dev:
-            if p[0] > p[1]:
-                y_true.append(0)
-            else:
-                y_true.append(1)
-
-        print(classification_report(y_true, real_preds))
-        print('Roc auc score: ', roc_auc_score(y_true, real_preds))
-        print('Accuracy: ', accuracy_score(y_true, real_preds))
-        print('Precision-Propaganda: ', precision_score(y_true, real_preds))
-        print('Recall-Propaganda: ', recall_score(y_true, real_preds))
-        print('F1-Propaganda: ', f1_score(y_true, real_preds))
-        print('Macro F1-Propaganda: ', f1_score(y_true, real_preds, average='macro'))
@@ -5,14 +5,11 @@ import pandas as pd
 import numpy as np
 import tensorflow as tf
 import tensorflow_hub as hub
-import tensorflow_datasets as tfds
 from tensorflow.keras import Model
 from tensorflow.keras.layers import LSTM, Bidirectional, Conv1D, Attention, GlobalAveragePooling1D, GlobalMaxPool1D, \
     Dropout, Layer, Dense, MaxPool1D, Concatenate, SpatialDropout1D
 from basemodel import BaseModel
 from tensorflow.keras.losses import BinaryCrossentropy
-from sklearn.metrics import classification_report, accuracy_score, roc_auc_score, f1_score, precision_score, \
-    recall_score
 
 
 class BertModel(BaseModel):
@@ -83,52 +80,9 @@ class BertModel(BaseModel):
 
     def predict(self):
         print('TEST SET')
-        preds = self.model.predict(self.test_inputs, batch_size=self.batch_size)
-        real_preds = []
-        for p in preds:
-            if p[0] > p[1]:
-                real_preds.append(0)
-            else:
-                real_preds.append(1)
-        print(real_preds[:10])
-        y_true = []
-        for p in self.y_test:
-            if p[0] > p[1]:
-                y_true.append(0)
-            else:
-                y_true.append(1)
-
-        print(classification_report(y_true, real_preds))
-        print('Roc auc score: ', roc_auc_score(y_true, real_preds))
-        print('Accuracy: ', accuracy_score(y_true, real_preds))
-        print('Precision: ', precision_score(y_true, real_preds))
-        print('Recall: ', recall_score(y_true, real_preds))
-        print('F1-Propaganda: ', f1_score(y_true, real_preds))
-        print('Macro F1-Propaganda: ', f1_score(y_true, real_preds, average='macro'))
-
+        self.evaluate_split(self.test_inputs, self.y_test)
         print('DEV SET')
-        preds = self.model.predict(self.dev_inputs, batch_size=self.batch_size)
-        real_preds = []
-        for p in preds:
-            if p[0] > p[1]:
-                real_preds.append(0)
-            else:
-                real_preds.append(1)
-        print(real_preds[:10])
-        y_true = []
-        for p in self.y_dev:
-            if p[0] > p[1]:
-                y_true.append(0)
-            else:
-                y_true.append(1)
-
-        print(classification_report(y_true, real_preds))
-        print('Roc auc score: ', roc_auc_score(y_true, real_preds))
-        print('Accuracy: ', accuracy_score(y_true, real_preds))
-        print('Precision: ', precision_score(y_true, real_preds))
-        print('Recall: ', recall_score(y_true, real_preds))
-        print('F1-Propaganda: ', f1_score(y_true, real_preds))
-        print('Macro F1-Propaganda: ', f1_score(y_true, real_preds, average='macro'))
+        self.evaluate_split(self.dev_inputs, self.y_dev)
 
     def load_data(self):
         """Load the data from the paths given. This function override the BaseModel load_data function.
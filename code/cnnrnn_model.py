@@ -12,6 +12,7 @@ from tensorflow.keras.regularizers import l2, l1, l1_l2
 from sklearn.metrics import classification_report, accuracy_score, roc_auc_score
 from tensorflow.keras.callbacks import ReduceLROnPlateau, EarlyStopping, ModelCheckpoint
 from basemodel import BaseModel
+from maskedpooling import MaskedGlobalMaxPool1D
 
 SEED = 42
 
@@ -24,8 +25,8 @@ class BiLSTMModel(BaseModel):
                  path_train, path_test, path_dev, vocab_size=None, learning_rate=1e-3,
                  filters=64, kernel_size=5, pool_size=4, rate=0.2,
                  embedding_size=300, max_len=100000, load_embeddings=True, buffer_size=3, emb_type='glove',
-                 length_type='median', dense_units=128, concat=False, l2_rate=1e-5):
-        """Init function for the model.
+                 length_type='median', dense_units=128, concat=False, l2_rate=1e-5, **kwargs):
+        """Init function for the model. The keyword arguments not listed here are passed to BaseModel.
         """
         super(BiLSTMModel, self).__init__(max_len=max_len, path_train=path_train,
                                           path_test=path_test, path_dev=path_dev, batch_size=batch_size,
@@ -34,7 +35,7 @@ class BiLSTMModel(BaseModel):
                                           optimizer=optimizer, load_embeddings=load_embeddings, rate=rate,
                                           length_type=length_type, dense_units=dense_units,
                                           filters=filters, kernel_size=kernel_size, pool_size=pool_size,
-                                          buffer_size=buffer_size, l2_rate=l2_rate
+                                          buffer_size=buffer_size, l2_rate=l2_rate, **kwargs
                                           )
         self.lstm_units = lstm_units
         self.concat = concat
@@ -73,11 +74,8 @@ class BiLSTMModel(BaseModel):
             - input_shape: Added but not need to use cause max_sequence_len is used.
         """
         # Prepraring the embeddings input
-        sequence_input = tf.keras.layers.Input(shape=(self.max_sequence_len,), dtype="int32", name="seq_input")
-        embedding_layer = tf.keras.layers.Embedding(self.nb_words, self.embedding_size,
-                                                    weights=[self.embeddings_matrix],
-                                                    input_length=self.max_sequence_len,
-                                                    trainable=False, name='embeddings')
+        sequence_input = tf.keras.layers.Input(shape=(self.input_sequence_len,), dtype="int32", name="seq_input")
+        embedding_layer = self.build_embedding_layer(self.embeddings_matrix, name='embeddings')
         embedding_sequence = embedding_layer(sequence_input)
         embedding_sequence = SpatialDropout1D(0.2)(embedding_sequence)
         # Add the BiLSTM layer
@@ -92,7 +90,7 @@ class BiLSTMModel(BaseModel):
             concat = Concatenate(axis=1)([x, dense])
         else:
             concat = x
-        max_pooling = GlobalMaxPool1D(name='pooling')(concat)
+        max_pooling = MaskedGlobalMaxPool1D(name='pooling')(concat)
         # Add the Dense layer
         dense = Dense(units=self.dense_units, activation='relu', kernel_regularizer=l2(self.l2_rate),
                       name='dense_layer')(max_pooling)
@@ -1,9 +1,230 @@
 import io
+import os
 import time
+from itertools import repeat
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
 from abc import ABC, abstractmethod
 from nltk import sent_tokenize, word_tokenize
 
+GLOVE_FILE = '../glove.6B.300d.txt'
+FASTTEXT_FILE = '../wiki-news-300d-1M.vec'
+
+
+def _parse_range(fname, start, end, d):
+    """Parse the lines of fname between the bytes start and end. The float conversion is done at once for all
+    the lines of the range.
+    Returns:
+        - words: list with the words found.
+        - matrix: np.array with shape (len(words), d) and dtype float32.
+    """
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    words = []
+    values = []
+    for line in data.split(b'\n'):
+        word, _, vector = line.rstrip().partition(b' ')
+        # Skip the headers and the malformed lines
+        if vector.count(b' ') != d - 1:
+            continue
+        words.append(word.decode('utf-8', errors='ignore'))
+        values.append(vector)
+    matrix = np.array(b' '.join(values).split(), dtype=np.float32).reshape(len(words), d)
+    return words, matrix
+
+
+def _line_ranges(fname, n_ranges):
+    """Split fname in n_ranges byte ranges that start and end on line boundaries.
+    """
+    size = os.path.getsize(fname)
+    bounds = [0]
+    with open(fname, 'rb') as f:
+        for i in range(1, n_ranges):
+            f.seek(max(size * i // n_ranges, bounds[-1]))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+class EmbeddingsStore:
+    """Embeddings kept as one contiguous float32 matrix plus a word -> row index.
+    It behaves like the old dict of embeddings (get, keys, [], in), so the code that uses the embeddings
+    doesn't need to know how they are stored. The binary version of a text file is made of two files next
+    to it: <name>.npy with the matrix and <name>.vocab with one word per line (in row order).
+    """
+
+    def __init__(self, words, matrix):
+        """Sole constructor for the class
+        Arguments:
+            - words: list with the words, in the same order as the rows of the matrix.
+            - matrix: np.array (or np.memmap) with shape (len(words), d).
+        """
+        if len(words) != matrix.shape[0]:
+            raise ValueError("The number of words and the number of rows of the matrix aren't the same.")
+        self.words = words
+        self.matrix = matrix
+        self.word_index = {word: i for i, word in enumerate(words)}
+        # Shared memory segments that hold the matrix, if it was attached with from_shared_memory
+        self.segments = None
+
+    @staticmethod
+    def binary_paths(fname):
+        """Return the paths of the matrix and the vocabulary files for the text file fname.
+        """
+        base = os.path.splitext(fname)[0]
+        return base + '.npy', base + '.vocab'
+
+    @staticmethod
+    def exists(fname):
+        """Check if the text file fname has been converted to the binary format.
+        """
+        return all(os.path.exists(path) for path in EmbeddingsStore.binary_paths(fname))
+
+    @classmethod
+    def open(cls, fname):
+        """Open the binary version of fname with np.memmap. Nothing is read until it's used, and all the
+        processes that open the same file share the pages through the OS page cache.
+        """
+        matrix_path, vocab_path = EmbeddingsStore.binary_paths(fname)
+        matrix = np.load(matrix_path, mmap_mode='r')
+        with io.open(vocab_path, 'r', encoding='utf-8', newline='\n') as f:
+            words = f.read().split('\n')[:matrix.shape[0]]
+        return cls(words, matrix)
+
+    @staticmethod
+    def convert(fname, d=300):
+        """One-time conversion from a text file (Glove/FastText format) to the binary format. Lines that don't
+        have d values (as the FastText header) are skipped.
+        Arguments:
+            - fname: path to the text file.
+            - d: dimension of the embeddings.
+        Returns:
+            - The number of words converted.
+        """
+        start_time = time.time()
+        print('Converting ' + fname + ' to the binary format.')
+        # First pass: count the valid lines so the matrix can be written directly on disk.
+        with io.open(fname, 'r', encoding='utf-8', newline='\n', errors='ignore') as f:
+            n_words = sum(1 for line in f if line.rstrip().count(' ') == d)
+        matrix_path, vocab_path = EmbeddingsStore.binary_paths(fname)
+        matrix = np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float32, shape=(n_words, d))
+        i = 0
+        with io.open(fname, 'r', encoding='utf-8', newline='\n', errors='ignore') as f, \
+                io.open(vocab_path, 'w', encoding='utf-8', newline='\n') as vocab:
+            for line in f:
+                tokens = line.rstrip().split(' ')
+                if len(tokens) != d + 1:
+                    continue
+                matrix[i] = np.array(tokens[1:], dtype=np.float32)
+                vocab.write(tokens[0] + '\n')
+                i += 1
+        matrix.flush()
+        del matrix
+        print('Converted {} words in {:.2f} seconds.'.format(n_words, time.time() - start_time))
+        return n_words
+
+    @classmethod
+    def parse(cls, fname, d=300, workers=None):
+        """Parse a text file (Glove/FastText format) in parallel. The file is split in byte ranges on line
+        boundaries, every range is parsed in a process pool and the results are copied in one preallocated
+        matrix.
+        Arguments:
+            - fname: path to the text file.
+            - d: dimension of the embeddings.
+            - workers: number of processes to use. By default the number of cores.
+        Returns:
+            - EmbeddingsStore with all the embeddings of the file.
+        """
+        start_time = time.time()
+        workers = workers or os.cpu_count() or 1
+        # More ranges than workers so a slow range doesn't keep the rest of the pool waiting
+        ranges = _line_ranges(fname, workers * 4)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_parse_range, fname, start, end, d) for start, end in ranges]
+            parsed = [future.result() for future in futures]
+        matrix = np.empty((sum(len(words) for words, _ in parsed), d), dtype=np.float32)
+        words = []
+        for range_words, range_matrix in parsed:
+            matrix[len(words):len(words) + len(range_words)] = range_matrix
+            words.extend(range_words)
+        print('Parsed {} words with {} processes in {:.2f} seconds.'.format(len(words), workers,
+                                                                         time.time() - start_time))
+        return cls(words, matrix)
+
+    def to_shared_memory(self, name):
+        """Copy the store to shared memory so other processes can attach to it without copying it. Two segments
+        are created: <name>_matrix with the matrix and <name>_vocab with the shape and the words.
+        Arguments:
+            - name: name of the segments.
+        Returns:
+            - list with the SharedMemory segments. The process that creates them must keep them and close and
+            unlink them when the workers have finished.
+        """
+        vocab = '\n'.join(self.words).encode('utf-8')
+        shm_matrix = shared_memory.SharedMemory(name=name + '_matrix', create=True, size=max(self.matrix.nbytes, 1))
+        shm_vocab = shared_memory.SharedMemory(name=name + '_vocab', create=True, size=16 + len(vocab))
+        np.ndarray(self.matrix.shape, dtype=np.float32, buffer=shm_matrix.buf)[:] = self.matrix
+        np.ndarray((2,), dtype=np.int64, buffer=shm_vocab.buf)[:] = self.matrix.shape
+        shm_vocab.buf[16:16 + len(vocab)] = vocab
+        return [shm_matrix, shm_vocab]
+
+    @classmethod
+    def from_shared_memory(cls, name):
+        """Attach to a store copied to shared memory with to_shared_memory. The matrix is not copied.
+        """
+        segments = []
+        for suffix in ['_matrix', '_vocab']:
+            shm = shared_memory.SharedMemory(name=name + suffix)
+            # Only the process that created the segment must unlink it, not the workers when they exit
+            resource_tracker.unregister(shm._name, 'shared_memory')
+            segments.append(shm)
+        shm_matrix, shm_vocab = segments
+        n_words, d = np.ndarray((2,), dtype=np.int64, buffer=shm_vocab.buf)
+        words = bytes(shm_vocab.buf[16:]).rstrip(b'\x00').decode('utf-8').split('\n')[:n_words]
+        store = cls(words, np.ndarray((n_words, d), dtype=np.float32, buffer=shm_matrix.buf))
+        # Keep the segments alive as long as the store
+        store.segments = segments
+        return store
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return word in self.word_index
+
+    def __getitem__(self, word):
+        return self.matrix[self.word_index[word]]
+
+    def rows(self, words):
+        """Row of every word in the matrix, resolved in one pass.
+        Arguments:
+            - words: list with the words.
+        Returns:
+            - np.array of int64 with the row of every word, -1 for the words not found.
+        """
+        return np.fromiter(map(self.word_index.get, words, repeat(-1)), dtype=np.int64, count=len(words))
+
+    def get(self, word, default=None):
+        i = self.word_index.get(word)
+        if i is None:
+            return default
+        return self.matrix[i]
+
+    def keys(self):
+        return self.word_index.keys()
+
+    def items(self):
+        for word, i in self.word_index.items():
+            yield word, self.matrix[i]
+
+
 class Embeddings(ABC):
     """Abstract class to load different embeddings
     """
@@ -25,81 +246,128 @@ class Embeddings(ABC):
     def embeddings_full(self):
         return self.embeddings
 
+    @classmethod
+    def from_store(cls, store):
+        """Create the embeddings from an EmbeddingsStore already loaded, without reading any file.
+        """
+        embeddings = cls.__new__(cls)
+        Embeddings.__init__(embeddings)
+        embeddings.embeddings = store
+        return embeddings
+
+    @property
+    def nbytes(self):
+        """Bytes used by the embeddings.
+        """
+        if isinstance(self.embeddings, EmbeddingsStore):
+            return self.embeddings.nbytes
+        return sum(vec.nbytes for vec in self.embeddings.values())
+
+    @property
+    def mapped(self):
+        """True if the embeddings are memory mapped from disk or attached from shared memory instead of loaded in
+        the memory of this process.
+        """
+        return isinstance(self.embeddings, EmbeddingsStore) and \
+            (isinstance(self.embeddings.matrix, np.memmap) or self.embeddings.segments is not None)
+
     @abstractmethod
     def load_vectors(self, fname):
         pass
 
     @abstractmethod
-    def load_embeddings(self, fname):
+    def load_embeddings(self, fname, vocabulary=None):
         pass
 
-    def calc_embeddings(self, text, max_sequence_len, max_sentences_in_sequence):
-        """Function that apply the vector to get the embeddings from the text.
+    def load_filtered(self, fname, vocabulary):
+        """Load only the embeddings of the words in the vocabulary. The file is read line by line and only the
+        lines whose word is in the vocabulary are parsed, so the memory needed grows with the vocabulary of the
+        corpus instead of with the vocabulary of the pretrained embeddings.
         Arguments:
-            - text: list of lists with the text at least tokenized.
+            - fname: path to the embeddings file (text or converted to binary).
+            - vocabulary: collection with the words to keep (i.e. the word_index of the tokenizer).
         Returns:
-            - embeddings: list of embeddings.
-        """
-        # This function will be deleted in the future
-        embeddings = []
-        null_embeddings = np.zeros(self.d)
-        for sequence in text:
-            max_words_allowed = 0
-            sentences = sent_tokenize(sequence)
-            embedding_sequence = null_embeddings
-            count = 0 # Count all the lines
-            for sentence in sentences:
-                if count >= max_sentences_in_sequence: # If limit of sentences reached
+            - EmbeddingsStore with the embeddings found.
+        """
+        if EmbeddingsStore.exists(fname):
+            store = EmbeddingsStore.open(fname)
+            words = [word for word in vocabulary if word in store]
+            rows = [store.word_index[word] for word in words]
+            return EmbeddingsStore(words, np.asarray(store.matrix[rows]))
+        # Position of every word kept in the list of vectors. Repeated words keep the last vector, like a dict.
+        positions = {}
+        vectors = []
+        with io.open(fname, 'r', encoding='utf-8', newline='\n', errors='ignore') as f:
+            for line in f:
+                word = line[:line.find(' ')]
+                if word not in vocabulary:
+                    continue
+                tokens = line.rstrip().split(' ')
+                if len(tokens) != self.d + 1:
                     continue
-                embedding_sentence = null_embeddings
-                words = word_tokenize(sentence, preserve_line=True)
-                count_word = 0
-                count += 1
-                for word in words: # Every word in the line
-                    count_word += 1
-                    if max_words_allowed >= max_sequence_len:
-                        continue
-                    if word in self.embeddings.keys():
-                        embedding_word = self.embeddings[word]
-                    else:
-                        # embedding_word = np.random.normal(0, 1, self.d)
-                        embedding_word = null_embeddings
-                    embedding_sentence = np.sum([embedding_sentence, embedding_word], axis=0)
-                    max_words_allowed+=1
-                # embedding_sentence = embedding_sentence / count_word
-                embedding_sequence = np.sum([embedding_sequence, embedding_sentence], axis=0)
-            embedding_sequence = embedding_sequence / count # Divide by all the lines
-            embeddings.append(embedding_sequence)
-
-        """
-        # Alternative:
-        for i in range(len(text)):
-            embedding_sentence = []
-            for j in range(len(text[i])):
-                if text[i][j] in self.data:
-                    embedding_word = self.data[text[i][j]]
+                vec = np.array(tokens[1:], dtype=np.float32)
+                if word in positions:
+                    vectors[positions[word]] = vec
                 else:
-                    embedding_word = np.random.normal(0, 1, self.d)
-                embedding_sentence.append(embedding_word)
-            embeddings.append(embedding_sentence)
+                    positions[word] = len(vectors)
+                    vectors.append(vec)
+        matrix = np.array(vectors, dtype=np.float32).reshape(len(vectors), self.d)
+        return EmbeddingsStore(list(positions), matrix)
+
+    def calc_embeddings(self, text, max_sequence_len, max_sentences_in_sequence, batch_size=128):
+        """Function that apply the vector to get the embeddings from the text. The embedding of a document is the
+        sum of the embeddings of its first max_sequence_len words (only from its first max_sentences_in_sequence
+        sentences) divided by the number of sentences used. The words not found count for the limit but add
+        nothing.
+        The words are mapped to rows of the embeddings matrix once, and the documents are summed by batches
+        with np.add.reduceat over the rows gathered.
+        Arguments:
+            - text: list or pandas series with the documents.
+            - max_sequence_len: max number of words used per document.
+            - max_sentences_in_sequence: max number of sentences used per document.
+            - batch_size: number of documents gathered at once.
+        Returns:
+            - embeddings: np.array with shape (len(text), d).
         """
-        if len(text) != len(embeddings):
-            raise ValueError(
-                "The len of the text and the embeddings corresponding to it, arent the same."
-            )
-        return np.array(embeddings)
+        store = self.embeddings
+        if not isinstance(store, EmbeddingsStore):
+            store = EmbeddingsStore(list(store.keys()), np.array(list(store.values()), dtype=np.float32))
+        text = list(text)
+        embeddings = np.zeros((len(text), self.d))
+        for start in range(0, len(text), batch_size):
+            rows = []  # Rows of the words found, for all the documents of the batch
+            lengths = []  # Number of words found per document
+            counts = []  # Number of sentences used per document
+            for sequence in text[start:start + batch_size]:
+                sentences = sent_tokenize(sequence)[:max_sentences_in_sequence]
+                words = [word for sentence in sentences
+                         for word in word_tokenize(sentence, preserve_line=True)][:max_sequence_len]
+                found = [store.word_index[word] for word in words if word in store.word_index]
+                rows.extend(found)
+                lengths.append(len(found))
+                counts.append(len(sentences))
+            lengths = np.array(lengths)
+            sums = np.zeros((len(lengths), self.d))
+            if rows:
+                # Segments are contiguous, so reducing only from the start of the non-empty ones is enough
+                starts = (np.cumsum(lengths) - lengths)[lengths > 0]
+                sums[lengths > 0] = np.add.reduceat(store.matrix[np.array(rows)], starts, axis=0, dtype=np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # Divide by all the lines (the documents without sentences get nan, as before)
+                embeddings[start:start + len(lengths)] = sums / np.array(counts)[:, None]
+        return embeddings
 
 
 
 class GloveEmbeddings(Embeddings):
     """Class to load the Glove embeddings
     """
-    def __init__(self):
+    def __init__(self, vocabulary=None):
         super(GloveEmbeddings, self).__init__()
-        self.load_embeddings()
+        self.load_embeddings(vocabulary=vocabulary)
         print('Embeddings cargados')
 
-    def load_vectors(self, fname='../glove.6B.300d.txt'):
+    def load_vectors(self, fname=GLOVE_FILE):
         """Function to load the Glove embeddings instead of random initialize them
         """
         print('Loading Glove')
@@ -119,28 +387,29 @@ class GloveEmbeddings(Embeddings):
                 # Add the embedding to the matrix of embeddings
                 self.embeddings_matrix.append(vec)
 
-    def load_embeddings(self, fname='../glove.6B.300d.txt'):
+    def load_embeddings(self, fname=GLOVE_FILE, vocabulary=None):
+        if vocabulary is not None:
+            print('Loading Glove Embeddings for a vocabulary of {} words'.format(len(vocabulary)))
+            self.embeddings = self.load_filtered(fname, vocabulary)
+            return
+        if EmbeddingsStore.exists(fname):
+            print('Loading Glove Embeddings (binary)')
+            self.embeddings = EmbeddingsStore.open(fname)
+            return
         print('Loading Glove Embeddings')
-        # Open the Glove file
-        with open(fname, 'r') as f:
-            # Read all the lines
-            lines = f.readlines()
-            # Create the embeddings
-            for line in lines:
-                token = line.split(' ')
-                self.embeddings[token[0]] = np.array(token[1:], dtype=np.float32)
+        self.embeddings = EmbeddingsStore.parse(fname, self.d)
 
 
 
 class FTEmbeddings(Embeddings):
     """Class to load the FastText embeddings
     """
-    def __init__(self):
+    def __init__(self, vocabulary=None):
         super(FTEmbeddings, self).__init__()
-        self.load_embeddings()
+        self.load_embeddings(vocabulary=vocabulary)
         print('Embeddings cargados')
 
-    def load_vectors(self, fname='../wiki-news-300d-1M.vec'):
+    def load_vectors(self, fname=FASTTEXT_FILE):
         """Function to load the Fasttext embeddings instead of random initialize them
         """
         # To probe with 2M words instead of 1M
@@ -161,12 +430,17 @@ class FTEmbeddings(Embeddings):
                 # Add the embedding to the matrix of embeddings as a np.array
                 self.embeddings_matrix.append(np.array(tokens[1:]))
 
-    def load_embeddings(self, fname='../wiki-news-300d-1M.vec'):
-        fin = io.open(fname, 'r', encoding='utf-8', newline='\n', errors='ignore')
+    def load_embeddings(self, fname=FASTTEXT_FILE, vocabulary=None):
+        if vocabulary is not None:
+            print('Loading FastText Embeddings for a vocabulary of {} words.'.format(len(vocabulary)))
+            self.embeddings = self.load_filtered(fname, vocabulary)
+            return
+        if EmbeddingsStore.exists(fname):
+            print('Loading FastText Embeddings (binary).')
+            self.embeddings = EmbeddingsStore.open(fname)
+            return
         print('Loading FastText Embeddings.')
-        for line in fin:
-            tokens = line.rstrip().split(' ')
-            self.embeddings[tokens[0]] = np.array(tokens[1:], dtype=np.float32)
+        self.embeddings = EmbeddingsStore.parse(fname, self.d)
 
 
 
@@ -181,11 +455,11 @@ class W2VEmbedding(Embeddings):
     def load_vectors(self, fname):
         pass
 
-    def load_embeddings(self, fname=''):
+    def load_embeddings(self, fname='', vocabulary=None):
         # TODO: Check this function. Right now it's the same as FTEmnbedding's
+        if vocabulary is not None:
+            print('Loading Word2Vec Embeddings for a vocabulary of {} words.'.format(len(vocabulary)))
+            self.embeddings = self.load_filtered(fname, vocabulary)
+            return
         print('Loading Word2Vec Embeddings.')
-        with open(fname, 'r') as fp:
-            file = fp.readlines()
-            for line in file:
-                tokens = line.rstrip().split(' ')
-                self.embeddings[tokens[0]] = np.array(tokens[1:], dtype=np.float32)
\ No newline at end of file
+        self.embeddings = EmbeddingsStore.parse(fname, self.d)
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+Evaluation of the models on the test and dev sets (see BaseModel.predict). The predictions are accumulated batch by
+batch in a confusion matrix, so the whole set of predictions is never kept in memory, and every metric (accuracy,
+precision, recall and F1 per class, macro and weighted averages and the ROC AUC of the hard predictions) is derived
+from that matrix instead of passing over the labels once per metric.
+"""
+import numpy as np
+
+
+def to_classes(outputs):
+    """Class ids of a batch of softmax outputs or one-hot labels. With 2 columns a tie goes to class 1, as in the
+    previous evaluation loops (p[0] > p[1] -> 0, else 1). Vectors of class ids are returned as they are.
+    """
+    outputs = np.asarray(outputs)
+    if outputs.ndim == 1:
+        return outputs.astype(np.int64)
+    if outputs.shape[1] == 2:
+        return (outputs[:, 1] >= outputs[:, 0]).astype(np.int64)
+    return np.argmax(outputs, axis=1)
+
+
+class ConfusionMatrix:
+    """Confusion matrix (rows: true class, columns: predicted class) accumulated over batches.
+    """
+
+    def __init__(self, n_classes=2):
+        """Sole constructor for the class
+        Arguments:
+            - n_classes: number of classes.
+        """
+        self.n_classes = n_classes
+        self.matrix = np.zeros((n_classes, n_classes), dtype=np.int64)
+
+    @classmethod
+    def from_arrays(cls, y_true, y_pred, n_classes=2):
+        """Confusion matrix of all the labels and predictions at once.
+        """
+        matrix = cls(n_classes)
+        matrix.update(y_true, y_pred)
+        return matrix
+
+    def update(self, y_true, y_pred):
+        """Add a batch to the matrix.
+        Arguments:
+            - y_true: one-hot labels or class ids.
+            - y_pred: softmax outputs or class ids.
+        """
+        y_true, y_pred = to_classes(y_true), to_classes(y_pred)
+        self.matrix += np.bincount(self.n_classes * y_true + y_pred,
+                                   minlength=self.n_classes ** 2).reshape(self.n_classes, self.n_classes)
+
+    def __len__(self):
+        return int(self.matrix.sum())
+
+    def metrics(self):
+        """Every metric, derived from the matrix. The precision (recall) of a class never predicted (without
+        examples) is 0, as sklearn does with zero_division='warn'.
+        Returns:
+            - dict with accuracy, precision, recall, f1 and support (np.arrays with a value per class), present
+            (classes in the labels or in the predictions), macro_f1,
+            weighted_f1 and roc_auc. For 2 classes roc_auc is the one of the hard predictions of class 1,
+            (TPR + TNR) / 2, and nan if the labels have a single class.
+        """
+        tp = np.diag(self.matrix).astype(np.float64)
+        predicted = self.matrix.sum(axis=0)
+        support = self.matrix.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(predicted > 0, tp / predicted, 0.)
+            recall = np.where(support > 0, tp / support, 0.)
+            f1 = np.where(predicted + support > 0, 2 * tp / (predicted + support), 0.)
+        total = max(len(self), 1)
+        # As sklearn, the averages are over the classes in the labels or in the predictions
+        present = (support + predicted) > 0
+        metrics = {'accuracy': float(tp.sum() / total), 'precision': precision, 'recall': recall, 'f1': f1,
+                   'support': support, 'present': present, 'macro_f1': float(f1[present].mean()),
+                   'weighted_f1': float(np.average(f1, weights=support)) if support.sum() else 0.,
+                   'roc_auc': float('nan')}
+        if self.n_classes == 2 and (support > 0).all():
+            # TNR is the recall of class 0 and TPR the recall of class 1
+            metrics['roc_auc'] = float(recall.mean())
+        return metrics
+
+    def classification_report(self, digits=2):
+        """Same text as sklearn.metrics.classification_report.
+        """
+        metrics = self.metrics()
+        total = len(self)
+        present = np.flatnonzero(metrics['present'])
+        names = [str(i) for i in present]
+        width = max(len('weighted avg'), digits, *map(len, names))
+        head = '{:>{width}s} ' + ' {:>9}' * 4
+        row = '{:>{width}s} ' + ' {:>9.{digits}f}' * 3 + ' {:>9}\n'
+        report = head.format('', 'precision', 'recall', 'f1-score', 'support', width=width) + '\n\n'
+        for i, name in zip(present, names):
+            report += row.format(name, metrics['precision'][i], metrics['recall'][i], metrics['f1'][i],
+                                 metrics['support'][i], width=width, digits=digits)
+        report += '\n'
+        report += ('{:>{width}s} ' + ' {:>9.{digits}}' * 2 + ' {:>9.{digits}f}' + ' {:>9}\n').format(
+            'accuracy', '', '', metrics['accuracy'], total, width=width, digits=digits)
+        # Same order of the operations as sklearn, so the rounding is the same
+        weights = metrics['support'] if total > 0 else None
+        averages = [('macro avg', lambda values: values[present].mean()),
+                    ('weighted avg', lambda values: np.average(values, weights=weights))]
+        for name, average in averages:
+            report += row.format(name, average(metrics['precision']), average(metrics['recall']),
+                                 average(metrics['f1']), total, width=width, digits=digits)
+        return report
+
+    def print_report(self):
+        """Print the report and the metrics that the models printed before.
+        """
+        metrics = self.metrics()
+        print(self.classification_report())
+        print('Roc auc score: ', metrics['roc_auc'])
+        print('Accuracy: ', metrics['accuracy'])
+        print('Precision-Propaganda: ', metrics['precision'][1])
+        print('Recall-Propaganda: ', metrics['recall'][1])
+        print('F1-Propaganda: ', metrics['f1'][1])
+        print('Macro F1-Propaganda: ', metrics['macro_f1'])
+
+
+def iterate_batches(inputs, labels, batch_size):
+    """Split the inputs (np.array, list or dict of np.arrays) and the labels in batches of batch_size rows.
+    """
+    for start in range(0, len(labels), batch_size):
+        batch = slice(start, start + batch_size)
+        if isinstance(inputs, dict):
+            batch_inputs = {name: values[batch] for name, values in inputs.items()}
+        elif isinstance(inputs, (list, tuple)):
+            batch_inputs = [values[batch] for values in inputs]
+        else:
+            batch_inputs = inputs[batch]
+        yield batch_inputs, labels[batch]
+
+
+def evaluate(model, batches, n_classes=2, verbose=True):
+    """Evaluate a Keras model over a stream of batches. Only the confusion matrix and the first predictions are
+    kept.
+    Arguments:
+        - model: Keras model with softmax outputs.
+        - batches: iterable of (inputs, labels) batches, e.g. a tf.data.Dataset or iterate_batches.
+        - n_classes: number of classes.
+        - verbose: print the first 10 predictions and the report.
+    Returns:
+        - The ConfusionMatrix.
+    """
+    matrix = ConfusionMatrix(n_classes)
+    first_preds = []
+    for inputs, labels in batches:
+        preds = to_classes(np.asarray(model.predict_on_batch(inputs)))
+        if len(first_preds) < 10:
+            first_preds.extend(preds[:10 - len(first_preds)].tolist())
+        matrix.update(np.asarray(labels), preds)
+    if verbose:
+        print(first_preds)
+        matrix.print_report()
+    return matrix
@@ -1,9 +1,21 @@
-from embeddings import GloveEmbeddings, FTEmbeddings
+import os
+from collections import OrderedDict
+from embeddings import GloveEmbeddings, FTEmbeddings, EmbeddingsStore, GLOVE_FILE, FASTTEXT_FILE
+
+# Environment variable with the embeddings published in shared memory by a coordinator process (see sweep.py),
+# as a comma separated list of type=name, e.g. "glove=tfm_glove,fasttext=tfm_fasttext".
+SHARED_EMBEDDINGS_ENV = 'TFM_SHARED_EMBEDDINGS'
 
 class FactoryEmbeddings:
     """Factory class
     This class will be used to initialize the different embeddings with just one parameter.
+    The embeddings loaded are kept in a cache shared by all the instances of the factory, so the same file is
+    never parsed twice in the same process (sweeps, notebooks, both_embeddings, mean document embeddings...).
     """
+    # (type, vocabulary) -> Embeddings. The vocabulary is None for the full embeddings. Ordered by last use.
+    _cache = OrderedDict()
+    # Max bytes kept in memory by the cache (None means no limit). Memory mapped embeddings don't count.
+    max_cache_bytes = None
 
     def __init__(self):
         """Sole constructor for the class
@@ -22,16 +34,93 @@ class FactoryEmbeddings:
         return locals()
     embeddings = property(**embeddings())
 
-    def load_embeddings(self, type):
+    def load_embeddings(self, type, vocabulary=None):
         """Initilize the embeddings from the factory
         Arguments:
             - type (str): Name of the embeddings to use (glove or fasttext).
+            - vocabulary: If given, only the embeddings of these words are loaded.
         """
         self.__type = type.lower()
-        if self.__type == 'glove':
-            self.__embeddings = GloveEmbeddings()
-        elif self.__type == 'fasttext':
-            self.__embeddings = FTEmbeddings()
-        else:
+        if self.__type not in ('glove', 'fasttext'):
             print('No other embeddings implemented yet.')
+            return
+        key = (self.__type, None if vocabulary is None else frozenset(vocabulary))
+        # The full embeddings are valid for any vocabulary
+        for cached_key in [(self.__type, None), key]:
+            if cached_key in FactoryEmbeddings._cache:
+                print('Using the cached ' + self.__type + ' embeddings.')
+                FactoryEmbeddings._cache.move_to_end(cached_key)
+                self.__embeddings = FactoryEmbeddings._cache[cached_key]
+                return
+        shared_name = FactoryEmbeddings.shared_embeddings().get(self.__type)
+        if shared_name is not None:
+            # Attach to the embeddings loaded by the coordinator, they are valid for any vocabulary
+            print('Attaching to the ' + self.__type + ' embeddings in shared memory.')
+            store = EmbeddingsStore.from_shared_memory(shared_name)
+            embeddings_class = GloveEmbeddings if self.__type == 'glove' else FTEmbeddings
+            self.__embeddings = embeddings_class.from_store(store)
+            key = (self.__type, None)
+        elif self.__type == 'glove':
+            self.__embeddings = GloveEmbeddings(vocabulary=vocabulary)
+        elif self.__type == 'fasttext':
+            self.__embeddings = FTEmbeddings(vocabulary=vocabulary)
+        FactoryEmbeddings._cache[key] = self.__embeddings
+        FactoryEmbeddings._fit_cache()
+
+    @staticmethod
+    def embeddings_files(type):
+        """Paths of the files the embeddings of the type are read from: the text file and its binary conversion
+        (see EmbeddingsStore).
+        """
+        fname = {'glove': GLOVE_FILE, 'fasttext': FASTTEXT_FILE}.get(type.lower())
+        if fname is None:
+            return []
+        return [fname] + list(EmbeddingsStore.binary_paths(fname))
+
+    @staticmethod
+    def shared_embeddings():
+        """Read the embeddings published in shared memory from the environment.
+        Returns:
+            - dict type -> name of the shared memory segments.
+        """
+        value = os.environ.get(SHARED_EMBEDDINGS_ENV, '')
+        return dict(item.split('=', 1) for item in value.split(',') if '=' in item)
 
+    @staticmethod
+    def _fit_cache():
+        """Evict the least recently used embeddings until the cache fits in max_cache_bytes. The last embeddings
+        loaded are never evicted.
+        """
+        if FactoryEmbeddings.max_cache_bytes is None:
+            return
+        while len(FactoryEmbeddings._cache) > 1 and \
+                FactoryEmbeddings.cache_bytes() > FactoryEmbeddings.max_cache_bytes:
+            key, _ = FactoryEmbeddings._cache.popitem(last=False)
+            print('Evicted the ' + key[0] + ' embeddings from the cache.')
+
+    @staticmethod
+    def cache_bytes():
+        """Bytes kept in memory by the cache. Memory mapped and shared embeddings don't count.
+        """
+        return sum(emb.nbytes for emb in FactoryEmbeddings._cache.values() if not emb.mapped)
+
+    @staticmethod
+    def cache_info():
+        """Describe the embeddings in the cache.
+        Returns:
+            - list of dicts with the type, if it's filtered by a vocabulary, the number of words, the bytes and if
+            the embeddings are memory mapped, from the least to the most recently used.
+        """
+        return [{'type': type, 'filtered': vocabulary is not None, 'words': len(emb.embeddings),
+                 'bytes': emb.nbytes, 'mapped': emb.mapped}
+                for (type, vocabulary), emb in FactoryEmbeddings._cache.items()]
+
+    @staticmethod
+    def evict(type=None):
+        """Remove embeddings from the cache.
+        Arguments:
+            - type (str): Name of the embeddings to remove (glove or fasttext). If None, the cache is emptied.
+        """
+        for key in list(FactoryEmbeddings._cache):
+            if type is None or key[0] == type.lower():
+                del FactoryEmbeddings._cache[key]
@@ -6,7 +6,6 @@ import datetime
 import pandas as pd
 import numpy as np
 import tensorflow as tf
-import tensorflow_datasets as tfds
 
 from transformers import BertForSequenceClassification, AlbertForSequenceClassification, \
     ElectraForSequenceClassification
@@ -0,0 +1,179 @@
+"""
+Options of the tf.data input pipelines of the models (see BaseModel.prepare_data_as_tensors) and a callback that
+tells if the training is waiting for the input pipeline.
+With trim_padding every batch drops the padding columns that all its sequences share, so a batch of short documents
+is as short as its longest document instead of max_sequence_len (the models must accept batches of any length).
+"""
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+
+class InputPipeline:
+    """Builds the tf.data datasets: optional cache, bounded shuffle buffer with a fixed seed, parallel maps, batching
+    and autotuned prefetch.
+    """
+
+    def __init__(self, batch_size=32, shuffle_buffer=10000, seed=42, cache=None, prefetch=AUTOTUNE,
+                 num_parallel_calls=AUTOTUNE, deterministic=True, trim_padding=False):
+        """Sole constructor for the class
+        Arguments:
+            - batch_size: size of the batches.
+            - shuffle_buffer: max number of elements in the shuffle buffer. The buffer is never larger than the data.
+            - seed: seed of the shuffle, so the order of the batches is the same in every run.
+            - cache: None to not cache the elements, '' to cache them in memory, or a directory to cache them on
+            disk (a file per dataset).
+            - prefetch: number of batches prepared while the model trains. AUTOTUNE lets tf.data choose it.
+            - num_parallel_calls: parallelism of the maps.
+            - deterministic: keep the order of the elements in the parallel maps.
+            - trim_padding: trim every batch to its longest sequence (see trim_batch).
+        """
+        self.batch_size = batch_size
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.cache = cache
+        self.prefetch = prefetch
+        self.num_parallel_calls = num_parallel_calls
+        self.deterministic = deterministic
+        self.trim_padding = trim_padding
+
+    def prepare(self, dataset, n_elements, training=True, name='data'):
+        """Cache the elements and, for training, shuffle them.
+        Arguments:
+            - dataset: tf.data.Dataset of single elements.
+            - n_elements: number of elements of the dataset.
+            - training: shuffle the elements (in every epoch).
+            - name: name of the cache file when caching on disk.
+        Returns:
+            - The dataset.
+        """
+        options = tf.data.Options()
+        options.experimental_deterministic = self.deterministic
+        dataset = dataset.with_options(options)
+        if self.cache == '':
+            dataset = dataset.cache()
+        elif self.cache is not None:
+            os.makedirs(self.cache, exist_ok=True)
+            dataset = dataset.cache(os.path.join(self.cache, name))
+        if training:
+            dataset = dataset.shuffle(max(1, min(self.shuffle_buffer, n_elements)), seed=self.seed,
+                                      reshuffle_each_iteration=True)
+        return dataset
+
+    def map(self, dataset, function):
+        """Apply the function to every element of the dataset in parallel.
+        """
+        return dataset.map(function, num_parallel_calls=self.num_parallel_calls)
+
+    @staticmethod
+    def trim_batch(inputs, labels):
+        """Drop the columns of padding shared by all the sequences of a batch. The sequences are padded at the start
+        (pad_sequences) and the index 0 is only padding, so the batch keeps its last <longest sequence> columns.
+        Arguments:
+            - inputs: sequences, or a dict (sequences as seq_input) or tuple (sequences first) of inputs.
+            - labels: labels of the batch.
+        Returns:
+            - The batch with the trimmed sequences.
+        """
+        sequences = inputs['seq_input'] if isinstance(inputs, dict) else \
+            inputs[0] if isinstance(inputs, (list, tuple)) else inputs
+        longest = tf.reduce_max(tf.math.count_nonzero(sequences, axis=1, dtype=tf.int32))
+        # At least a column, so a batch of empty documents is still a valid input
+        sequences = sequences[:, tf.shape(sequences)[1] - tf.maximum(longest, 1):]
+        if isinstance(inputs, dict):
+            return dict(inputs, seq_input=sequences), labels
+        if isinstance(inputs, (list, tuple)):
+            return (sequences,) + tuple(inputs[1:]), labels
+        return sequences, labels
+
+    def finish(self, dataset):
+        """Trim the batches, if trim_padding, and prefetch them.
+        """
+        if self.trim_padding:
+            dataset = self.map(dataset, self.trim_batch)
+        return dataset.prefetch(self.prefetch)
+
+    def from_tensor_slices(self, inputs, labels, training=True, name='data'):
+        """Dataset of batches of (inputs, labels).
+        Arguments:
+            - inputs: np.array, list or dict of np.arrays with the inputs of the model.
+            - labels: np.array with the labels.
+            - training: shuffle the elements (in every epoch).
+            - name: name of the cache file when caching on disk.
+        Returns:
+            - The dataset.
+        """
+        dataset = tf.data.Dataset.from_tensor_slices((inputs, labels))
+        dataset = self.prepare(dataset, len(labels), training=training, name=name)
+        return self.finish(dataset.batch(self.batch_size))
+
+    @staticmethod
+    def seconds_per_batch(dataset, n_batches=20):
+        """Seconds that the pipeline alone needs to produce a batch, measured over the first n_batches (without the
+        first one, which includes filling the buffers).
+        """
+        iterator = iter(dataset)
+        try:
+            next(iterator)
+        except StopIteration:
+            return 0.
+        start = time.perf_counter()
+        produced = 0
+        for _ in range(n_batches):
+            try:
+                next(iterator)
+            except StopIteration:
+                break
+            produced += 1
+        return (time.perf_counter() - start) / max(produced, 1)
+
+
+class InputBoundCallback(tf.keras.callbacks.Callback):
+    """Reports after every epoch if the training was input-bound or compute-bound, comparing the time of every
+    training step with the time the input pipeline alone needs to produce a batch (measured when training starts).
+    """
+
+    def __init__(self, dataset, n_batches=20, threshold=0.8):
+        """Sole constructor for the class
+        Arguments:
+            - dataset: training dataset given to fit.
+            - n_batches: number of batches used to measure the input pipeline alone.
+            - threshold: the epoch is input-bound if the input time is at least this fraction of the step time.
+        """
+        super(InputBoundCallback, self).__init__()
+        self.dataset = dataset
+        self.n_batches = n_batches
+        self.threshold = threshold
+        self.input_seconds = None
+        self.epochs = []
+
+    def on_train_begin(self, logs=None):
+        self.input_seconds = InputPipeline.seconds_per_batch(self.dataset, self.n_batches)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.step_seconds = []
+        self.epoch_start = time.perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step_seconds.append(time.perf_counter() - self.batch_start)
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_seconds = time.perf_counter() - self.epoch_start
+        # The first step of the first epoch includes tracing the model
+        steps = self.step_seconds[1:] if epoch == 0 and len(self.step_seconds) > 1 else self.step_seconds
+        step = float(np.median(steps)) if steps else 0.
+        n_steps = len(self.step_seconds)
+        input_fraction = self.input_seconds / step if step > 0 else 0.
+        bound = 'input-bound' if input_fraction >= self.threshold else 'compute-bound'
+        self.epochs.append({'epoch': epoch, 'seconds': epoch_seconds, 'steps': n_steps,
+                            'train_seconds': float(sum(self.step_seconds)),
+                            'input_seconds': self.input_seconds * n_steps, 'bound': bound})
+        print('\nEpoch {}: {:.1f} s, {:.4f} s/step, input pipeline alone {:.4f} s/batch ({:.0%} of the step) -> '
+              '{}'.format(epoch + 1, epoch_seconds, step, self.input_seconds, input_fraction, bound))
@@ -6,54 +6,156 @@ import time
 import os
 import random
 
-from cnnrnn_model import BiLSTMModel
-from attention_model import AttentionModel
-from mean_model import LocalAttentionModel
-from modeltransformer import TransformerModel
-from finetune import FineTuningModel
-from bertmodel import BertModel
-from bertbilstmmodel import LocalAttentionModelNela
-from preprocessing import Preprocessing
-import pandas as pd
+# The modules of the models, TensorFlow and the rest of heavy libraries are imported only by the mode that uses
+# them (see main), so e.g. the preprocessing doesn't load TensorFlow.
 from modelconfiguration import ModelConfig
 
 
+def preprocess_split(path, output, cache, workers=None):
+    """Preprocess one split of the data, or take it from the cache if the file and the pipeline haven't changed.
+    The result is written as TSV and Parquet (output + '.tsv' and output + '.parquet').
+    Arguments:
+        - path: raw TSV file of the split.
+        - output: path of the output files without extension.
+        - cache: PreprocessingCache to use.
+        - workers: number of processes for the preprocessing. By default the number of cores.
+    """
+    import pandas as pd
+    from preprocessing import Preprocessing
+
+    def compute(path):
+        data = pd.read_csv(path, sep='\t', header=None)
+        # pipeline and pipeline_simple at once, in parallel
+        data_stem, data_join, data_simple = Preprocessing.parallel_pipeline(data[data.columns[0]], workers=workers)
+        data_processed_df = pd.DataFrame(columns=['text_stem', 'text_join', 'text', 'label'])
+        data_processed_df['text_stem'], data_processed_df['text_join'] = data_stem, data_join
+        data_processed_df['label'] = data[data.columns[len(data.columns) - 1]]
+        data_processed_df['text'] = data_simple
+        return data_processed_df
+
+    data_processed_df, cached = cache.get_or_compute(path, compute)
+    if not cached or not os.path.exists(output + '.tsv'):
+        # The lists of stems read from Parquet are numpy arrays; as lists the TSV is the same as in a new run
+        data_processed_df.assign(text_stem=data_processed_df['text_stem'].map(list)).to_csv(
+            output + '.tsv', sep='\t', index=False, index_label=False)
+    if not cached or not os.path.exists(output + '.parquet'):
+        data_processed_df.to_parquet(output + '.parquet', index=False)
+
+
+def stream_split(path, output, cache, workers=None, chunksize=10000):
+    """Same as preprocess_split, but the split is read, preprocessed and written chunk by chunk (see
+    Preprocessing.stream_pipeline), so the memory used doesn't depend on the size of the file. The output is
+    copied to the cache when it is finished, and a cached output is copied back by row groups.
+    Arguments:
+        - path: raw TSV file of the split.
+        - output: path of the output files without extension.
+        - cache: PreprocessingCache to use.
+        - workers: number of processes for the preprocessing. By default the number of cores.
+        - chunksize: number of rows read at once.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from preprocessing import Preprocessing
+
+    schema = pa.schema([('text_stem', pa.list_(pa.string())), ('text_join', pa.string()), ('text', pa.string()),
+                        ('label', pa.int64())])
+    cached_path = cache.cached_path(path)
+    if cached_path is not None:
+        print('Using the cached preprocessing of ' + path)
+        parquet_file = pq.ParquetFile(cached_path)
+        chunks = (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunksize))
+        # The token lists are read as arrays; keep them as lists so the TSV is the same as the one preprocessed
+        chunks = (chunk.assign(text_stem=chunk['text_stem'].map(list)) for chunk in chunks)
+    else:
+        chunks = Preprocessing.stream_pipeline(path, chunksize=chunksize, workers=workers)
+    # Write to temporary files first so an interrupted run never leaves a truncated output
+    with pq.ParquetWriter(output + '.parquet.tmp', schema) as writer:
+        header = True
+        for chunk in chunks:
+            chunk.to_csv(output + '.tsv.tmp', sep='\t', index=False, index_label=False, header=header,
+                         mode='w' if header else 'a')
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            header = False
+    if header:
+        # Empty input: still write the header of the TSV
+        pd.DataFrame(columns=schema.names).to_csv(output + '.tsv.tmp', sep='\t', index=False, index_label=False)
+    os.replace(output + '.tsv.tmp', output + '.tsv')
+    os.replace(output + '.parquet.tmp', output + '.parquet')
+    if cached_path is None:
+        cache.store_file(path, output + '.parquet')
+
+
+def prepare_data_as_tensors(model, n_buckets=0, profile_input=False, tfrecords=None, mask_padding=False,
+                            trim_padding=False, features=()):
+    """Prepare the data of an attention or transformer model as tf.data datasets, in length buckets if n_buckets > 0
+    (see BaseModel.prepare_data_as_buckets). With profile_input fit_as_tensors reports per epoch whether the
+    training waits for the input pipeline. With tfrecords the data is read from the export of --mode 14 in that
+    directory instead of the TSVs, with the auxiliary inputs in features (e.g. ['nela_input']). With mask_padding
+    the model masks the padding and with trim_padding every batch is trimmed to its longest document (see
+    BaseModel).
+    """
+    model.check_padding_options(mask_padding, trim_padding)
+    model.profile_input = profile_input
+    model.mask_padding = mask_padding
+    model.input_pipeline.trim_padding = trim_padding
+    if tfrecords is not None:
+        model.prepare_data_from_tfrecords(tfrecords, features=features, n_buckets=n_buckets)
+    elif n_buckets:
+        model.prepare_data_as_buckets(n_buckets)
+    else:
+        model.prepare_data_as_tensors()
+
+
 def main():
     start_time = time.time()
     random.seed(42)
     # os.environ["CUDA_VISIBLE_DEVICES"] = '-1'
     parser = argparse.ArgumentParser()
     parser.add_argument('--mode', type=int, help='Preprocess or execute the data.', default=None)
+    parser.add_argument('--workers', type=int, help='Processes used to preprocess the data (--mode 1).',
+                        default=None)
+    parser.add_argument('--stream', action='store_true',
+                        help='Preprocess the data in chunks with bounded memory (--mode 1).')
+    parser.add_argument('--chunksize', type=int, help='Rows per chunk with --stream.', default=10000)
+    parser.add_argument('--buckets', type=int, default=0,
+                        help='Feed the attention and transformer models in this number of length buckets.')
+    parser.add_argument('--profile-input', action='store_true',
+                        help='Report per epoch if the training is input-bound or compute-bound.')
+    parser.add_argument('--download-nltk', action='store_true',
+                        help='Download the NLTK resources that are missing (--mode 1).')
+    parser.add_argument('--tfrecords', type=str, default=None,
+                        help='Directory of the TFRecord export (--mode 14). The attention and transformer models read '
+                             'the data from it instead of the TSVs.')
+    parser.add_argument('--shards', type=int, default=8, help='Shards of the train split with --mode 14.')
+    parser.add_argument('--tfrecord-features', type=lambda value: [name for name in value.split(',') if name],
+                        default=[], help='Auxiliary inputs exported with --mode 14, comma separated: mean_emb, '
+                                         'nela_input and/or fact_label. The NELA model (--mode 12) reads nela_input '
+                                         'with --tfrecords.')
+    parser.add_argument('--mask-padding', action='store_true',
+                        help='The attention and transformer models mask the padding (Embedding with mask_zero).')
+    parser.add_argument('--trim-padding', action='store_true',
+                        help='Trim every batch of the attention and transformer models to its longest document '
+                             '(needs --mask-padding).')
+    parser.add_argument('--vocabulary-cache', type=str, default=None,
+                        help='Directory where the fitted tokenizer and the embeddings matrices are cached between '
+                             'runs (e.g. ../data/cache/vocabulary). By default they are always built.')
     args = vars(parser.parse_args())  # Convert the arguments to a dict
     if args['mode'] == 1:
-        train = pd.read_csv('../data/proppy_1.0.train.tsv', sep='\t', header=None)
-        train_processed = Preprocessing.pipeline(train[train.columns[0]])
-        train_processed_df = pd.DataFrame(columns=['text_stem', 'text_join', 'text', 'label'])
-        train_processed_df['text_stem'], train_processed_df['text_join'] = train_processed
-        train_processed_df['label'] = train[train.columns[len(train.columns) - 1]]
-        train_processed_df['text'] = Preprocessing.pipeline_simple(train[train.columns[0]])
-        # train_processed_df['embedding'] = train_embeddings
-        train_processed_df.to_csv('../data/train_preprocessed.tsv', sep='\t', index=False,
-                                  index_label=False)
-        test = pd.read_csv('../data/proppy_1.0.test.tsv', sep='\t', header=None)
-        test_processed = Preprocessing.pipeline(test[test.columns[0]])
-        test_processed_df = pd.DataFrame(columns=['text_stem', 'text_join', 'text', 'label'])
-        test_processed_df['text_stem'], test_processed_df['text_join'] = test_processed
-        test_processed_df['label'] = test[test.columns[len(test.columns) - 1]]
-        test_processed_df['text'] = Preprocessing.pipeline_simple(test[test.columns[0]])
-        # train_processed_df['embedding'] = train_embeddings
-        test_processed_df.to_csv('../data/test_preprocessed.tsv', sep='\t', index=False,
-                                 index_label=False)
-        dev = pd.read_csv('../data/proppy_1.0.dev.tsv', sep='\t', header=None)
-        dev_processed = Preprocessing.pipeline(dev[dev.columns[0]])
-        dev_processed_df = pd.DataFrame(columns=['text_stem', 'text_join', 'text', 'label'])
-        dev_processed_df['text_stem'], dev_processed_df['text_join'] = dev_processed
-        dev_processed_df['label'] = dev[dev.columns[len(dev.columns) - 1]]
-        dev_processed_df['text'] = Preprocessing.pipeline_simple(dev[dev.columns[0]])
-        # train_processed_df['embedding'] = train_embeddings
-        dev_processed_df.to_csv('../data/dev_preprocessed.tsv', sep='\t', index=False,
-                                index_label=False)
+        from preprocessing import Preprocessing
+        from preprocessing_cache import PreprocessingCache
+        # Fail early, without touching the network, if the NLTK resources aren't installed
+        Preprocessing.check_nltk_resources(download=args['download_nltk'])
+        cache = PreprocessingCache()
+        for split in ['train', 'test', 'dev']:
+            if args['stream']:
+                stream_split('../data/proppy_1.0.{}.tsv'.format(split), '../data/{}_preprocessed'.format(split),
+                             cache, workers=args['workers'], chunksize=args['chunksize'])
+            else:
+                preprocess_split('../data/proppy_1.0.{}.tsv'.format(split), '../data/{}_preprocessed'.format(split),
+                                 cache, workers=args['workers'])
     elif args['mode'] == 2:
+        from attention_model import AttentionModel
         # Creación del modelo con embeddings de fasttext o glove
         config = ModelConfig.AttentionConfig.value
         model = AttentionModel(batch_size=config['batch_size'], epochs=config['epochs'],
@@ -67,9 +169,11 @@ def main():
                                buffer_size=config['buffer_size'], rate=config['rate'],
                                length_type=config['length_type'],
                                dense_units=config['dense_units'],
-                               att_units=config['att_units']
+                               att_units=config['att_units'],
+                               vocabulary_cache=args['vocabulary_cache']
                                )
-        model.prepare_data_as_tensors()
+        prepare_data_as_tensors(model, args['buckets'], args['profile_input'], args['tfrecords'], args['mask_padding'],
+                                args['trim_padding'])
         print('Building the model.')
         model.call()
         print('Previo a fit')
@@ -77,6 +181,7 @@ def main():
         print('Previo a predict')
         model.predict_test_dev()
     elif args['mode'] == 3:
+        from cnnrnn_model import BiLSTMModel
         # Creación del modelo con embeddings de fasttext o glove
         config = ModelConfig.TrainEmbeddings.value
         model = BiLSTMModel(batch_size=config['batch_size'], epochs=config['epochs'], vocab_size=config['vocab_size'],
@@ -87,7 +192,8 @@ def main():
                             pool_size=config['pool_size'], path_train=config['path_train'],
                             path_test=config['path_test'], path_dev=config['path_dev'], emb_type=config['emb_type'],
                             buffer_size=config['buffer_size'], rate=config['rate'], length_type=config['length_type'],
-                            dense_units=config['dense_units'], concat=config['concat']
+                            dense_units=config['dense_units'], concat=config['concat'],
+                            vocabulary_cache=args['vocabulary_cache']
                             )
         model.prepare_data_as_tensors()
         print('Building the model.')
@@ -99,6 +205,7 @@ def main():
         # print('Se guarda historial del loss:')
         # model.save_plot_history()
     elif args['mode'] == 4:
+        from cnnrnn_model import BiLSTMModel
         config = ModelConfig.SecondExperiment.value
         model = BiLSTMModel(batch_size=config['batch_size'], epochs=config['epochs'], vocab_size=config['vocab_size'],
                             max_len=config['max_len'], filters=config['filters'], kernel_size=config['kernel_size'],
@@ -108,7 +215,8 @@ def main():
                             pool_size=config['pool_size'], path_train=config['path_train'],
                             path_test=config['path_test'], path_dev=None, emb_type=config['emb_type'],
                             buffer_size=config['buffer_size'], rate=config['rate'], length_type=config['length_type'],
-                            dense_units=config['dense_units'], concat=config['concat']
+                            dense_units=config['dense_units'], concat=config['concat'],
+                            vocabulary_cache=args['vocabulary_cache']
                             )
         model.prepare_data_as_tensors()
         print('Building the model.')
@@ -118,6 +226,7 @@ def main():
         print('Previo a predict')
         model.predict()
     elif args['mode'] == 5:
+        from bertmodel import BertModel
         config = ModelConfig.BertConfig.value
         model = BertModel(max_len=config['max_len'], path_train=config['path_train'], path_test=config['path_test'],
                           path_dev=config['path_dev'], epochs=config['epochs'], optimizer=config['optimizer'],
@@ -134,6 +243,7 @@ def main():
         print('Predict the test set.')
         # model.predict()
     elif args['mode'] == 6:
+        from modeltransformer import TransformerModel
         config = ModelConfig.TransformerConfig.value
         model = TransformerModel(batch_size=config['batch_size'], epochs=config['epochs'],
                                  vocab_size=config['vocab_size'],
@@ -147,9 +257,13 @@ def main():
                                  emb_type=config['emb_type'],
                                  buffer_size=config['buffer_size'], rate=config['rate'],
                                  length_type=config['length_type'], dense_units=config['dense_units'],
-                                 attheads=config['attheads'], att_layers=config['att_layers']
+                                 attheads=config['attheads'], att_layers=config['att_layers'],
+                                 fused_qkv=config['fused_qkv'], attention_chunk_size=config['attention_chunk_size'],
+                                 attention_window=config['attention_window'], global_tokens=config['global_tokens'],
+                                 vocabulary_cache=args['vocabulary_cache']
                                  )
-        model.prepare_data_as_tensors()
+        prepare_data_as_tensors(model, args['buckets'], args['profile_input'], args['tfrecords'], args['mask_padding'],
+                                args['trim_padding'])
         print('Building the model.')
         model.call()
         print('Previo a fit')
@@ -157,6 +271,7 @@ def main():
         print('Previo a predict')
         model.predict()
     elif args['mode'] == 7:
+        from mean_model import LocalAttentionModel
         # Creación del modelo con embeddings de fasttext o glove
         config = ModelConfig.MeanModelConfig.value
         model = LocalAttentionModel(batch_size=config['batch_size'], epochs=config['epochs'],
@@ -171,9 +286,11 @@ def main():
                                     emb_type=config['emb_type'],
                                     buffer_size=config['buffer_size'], rate=config['rate'],
                                     length_type=config['length_type'],
-                                    dense_units=config['dense_units']
+                                    dense_units=config['dense_units'], topk_mode=config['topk_mode'],
+                                    vocabulary_cache=args['vocabulary_cache']
                                     )
-        model.prepare_data_as_tensors()
+        prepare_data_as_tensors(model, args['buckets'], args['profile_input'], args['tfrecords'], args['mask_padding'],
+                                args['trim_padding'])
         print('Building the model.')
         model.call()
         print('Previo a fit')
@@ -183,6 +300,7 @@ def main():
         print('Se muestra la atención:')
         # model.plot_attention()
     elif args['mode'] == 8:
+        from attention_model import AttentionModel
         config = ModelConfig.SecondExperiment.value
         model = AttentionModel(batch_size=config['batch_size'], epochs=config['epochs'],
                                vocab_size=config['vocab_size'],
@@ -194,9 +312,11 @@ def main():
                                path_test=config['path_test'], path_dev=None, emb_type=config['emb_type'],
                                buffer_size=config['buffer_size'], rate=config['rate'],
                                length_type=config['length_type'],
-                               dense_units=config['dense_units']
+                               dense_units=config['dense_units'],
+                               vocabulary_cache=args['vocabulary_cache']
                                )
-        model.prepare_data_as_tensors()
+        prepare_data_as_tensors(model, args['buckets'], args['profile_input'], args['tfrecords'], args['mask_padding'],
+                                args['trim_padding'])
         print('Building the model.')
         model.call()
         print('Previo a fit')
@@ -204,6 +324,7 @@ def main():
         print('Previo a predict')
         model.predict()
     elif args['mode'] == 9:
+        from attention_model import AttentionModel
         config = ModelConfig.AttentionConfig.value
         model = AttentionModel(batch_size=config['batch_size'], epochs=config['epochs'],
                                vocab_size=config['vocab_size'],
@@ -216,9 +337,11 @@ def main():
                                buffer_size=config['buffer_size'], rate=config['rate'],
                                length_type=config['length_type'],
                                dense_units=config['dense_units'], both_embeddings=config['both_embeddings'],
-                               att_units=config['att_units']
+                               att_units=config['att_units'],
+                               vocabulary_cache=args['vocabulary_cache']
                                )
-        model.prepare_data_as_tensors()
+        prepare_data_as_tensors(model, args['buckets'], args['profile_input'], args['tfrecords'], args['mask_padding'],
+                                args['trim_padding'])
         print('Building the model.')
         model.call()
         print('Previo a fit')
@@ -226,6 +349,7 @@ def main():
         print('Previo a predict')
         model.predict_test_dev()
     elif args['mode'] == 10:
+        from bertmodel import BertModel
         config = ModelConfig.BertConfigSecondExp.value
         model = BertModel(max_len=config['max_len'], path_train=config['path_train'], path_test=config['path_test'],
                           epochs=config['epochs'], optimizer=config['optimizer'],
@@ -242,6 +366,7 @@ def main():
         print('Predict the test set.')
         model.predict()
     elif args['mode'] == 11:
+        from mean_model import LocalAttentionModel
         config = ModelConfig.SecondExperiment.value
         model = LocalAttentionModel(batch_size=config['batch_size'], epochs=config['epochs'],
                                     vocab_size=config['vocab_size'],
@@ -254,9 +379,11 @@ def main():
                                     path_test=config['path_test'], path_dev=None, emb_type=config['emb_type'],
                                     buffer_size=config['buffer_size'], rate=config['rate'],
                                     length_type=config['length_type'],
-                                    dense_units=config['dense_units']
+                                    dense_units=config['dense_units'],
+                                    vocabulary_cache=args['vocabulary_cache']
                                     )
-        model.prepare_data_as_tensors()
+        prepare_data_as_tensors(model, args['buckets'], args['profile_input'], args['tfrecords'], args['mask_padding'],
+                                args['trim_padding'])
         print('Building the model.')
         model.call()
         print('Previo a fit')
@@ -264,6 +391,7 @@ def main():
         print('Previo a predict')
         model.predict()
     elif args['mode'] == 12:
+        from bertbilstmmodel import LocalAttentionModelNela
         config = ModelConfig.MeanModelConfig.value
         model = LocalAttentionModelNela(batch_size=config['batch_size'], epochs=config['epochs'],
                                         vocab_size=config['vocab_size'],
@@ -278,15 +406,50 @@ def main():
                                         emb_type=config['emb_type'],
                                         buffer_size=config['buffer_size'], rate=config['rate'],
                                         length_type=config['length_type'],
-                                        dense_units=config['dense_units']
+                                        dense_units=config['dense_units'], topk_mode=config['topk_mode'],
+                                        vocabulary_cache=args['vocabulary_cache']
                                         )
-        model.prepare_data()
+        if args['tfrecords'] is not None:
+            # The sequences and the NELA features are read from the export (--tfrecord-features nela_input)
+            prepare_data_as_tensors(model, args['buckets'], args['profile_input'], args['tfrecords'],
+                                    args['mask_padding'], args['trim_padding'], features=['nela_input'])
+        else:
+            model.prepare_data()
         print('Building the model.')
         model.call()
         print('Previo a fit')
-        model.fit(with_validation=False)
+        if args['tfrecords'] is not None:
+            model.fit_as_tensors(with_validation=False)
+        else:
+            model.fit(with_validation=False)
         print('Previo a predict')
         model.predict_test_dev()
+    elif args['mode'] == 13:
+        from embeddings import EmbeddingsStore, GLOVE_FILE, FASTTEXT_FILE
+        # One-time conversion of the embeddings to the binary format (.npy + .vocab) that is opened with np.memmap
+        EmbeddingsStore.convert(GLOVE_FILE)
+        EmbeddingsStore.convert(FASTTEXT_FILE)
+    elif args['mode'] == 14:
+        from attention_model import AttentionModel
+        # One-time export of the tokenized splits to sharded TFRecord files, read later with --tfrecords
+        config = ModelConfig.AttentionConfig.value
+        model = AttentionModel(batch_size=config['batch_size'], epochs=config['epochs'],
+                               vocab_size=config['vocab_size'],
+                               max_len=config['max_len'], filters=config['filters'], kernel_size=config['kernel_size'],
+                               optimizer=config['optimizer'], learning_rate=config['learning_rate'],
+                               max_sequence_len=config['max_sequence_len'], lstm_units=config['lstm_units'],
+                               embedding_size=config['embedding_size'], load_embeddings=config['load_embeddings'],
+                               pool_size=config['pool_size'], path_train=config['path_train'],
+                               path_test=config['path_test'], path_dev=config['path_dev'], emb_type=config['emb_type'],
+                               buffer_size=config['buffer_size'], rate=config['rate'],
+                               length_type=config['length_type'],
+                               dense_units=config['dense_units'],
+                               att_units=config['att_units'],
+                               vocabulary_cache=args['vocabulary_cache']
+                               )
+        model.prepare_data()
+        model.export_tfrecords(args['tfrecords'] or '../data/tfrecords', features=args['tfrecord_features'],
+                               n_shards=args['shards'])
     else:
         print('No other mode implemented yed.')
 
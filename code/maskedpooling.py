@@ -0,0 +1,26 @@
+import tensorflow as tf
+from tensorflow.keras import layers
+
+
+class MaskedGlobalMaxPool1D(layers.Layer):
+    """GlobalMaxPool1D that only takes the max over the timesteps of the mask (the tokens, not the padding).
+    Without a mask it is the same as GlobalMaxPool1D. A sequence without tokens gives zeros.
+    """
+
+    def __init__(self, **kwargs):
+        super(MaskedGlobalMaxPool1D, self).__init__(**kwargs)
+        self.supports_masking = True
+
+    def call(self, inputs, mask=None):
+        if mask is None:
+            return tf.reduce_max(inputs, axis=1)                                                    # (B, H)
+        mask = tf.expand_dims(tf.cast(mask, tf.bool), axis=-1)                                      # (B, S, 1)
+        # The padded timesteps get the lowest value of the dtype, so they never are the max
+        outputs = tf.reduce_max(tf.where(mask, inputs, inputs.dtype.min), axis=1)                  # (B, H)
+        return tf.where(tf.reduce_any(mask, axis=1), outputs, tf.zeros_like(outputs))              # (B, H)
+
+    def compute_mask(self, inputs, mask=None):
+        return None
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0], input_shape[2])
@@ -79,7 +79,17 @@ class ModelConfig(Enum):
         'dense_units': 64,
         'attheads': 12,
         'att_layers': 2,
-        'l2_rate': 1e-5
+        'l2_rate': 1e-5,
+        # Single Dense for the query, key and value of the self attention. Faster, but the checkpoints saved with
+        # the three Dense layers can't be loaded with it
+        'fused_qkv': False,
+        # None for the full self attention, or the size of the blocks of the chunked one (e.g. 128 for long
+        # max_sequence_len, it never holds the (max_sequence_len, max_sequence_len) matrices)
+        'attention_chunk_size': None,
+        # None, or the window of the local self attention (e.g. 128, or one per block as [128, None]), with
+        # global_tokens learned tokens that attend to the whole sequence. Linear in max_sequence_len
+        'attention_window': None,
+        'global_tokens': 0
     }
 
     AttentionConfig = {
@@ -209,5 +219,7 @@ class ModelConfig(Enum):
         'rate': 0.2,
         'length_type': 'fixed',
         'dense_units': 128,
-        'l2_rate': 1e-5
+        'l2_rate': 1e-5,
+        # 'dense' or 'gather' (score only the top window_width timesteps of local-p*)
+        'topk_mode': 'dense'
     }
\ No newline at end of file
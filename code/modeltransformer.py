@@ -13,6 +13,7 @@ from tensorflow.keras.regularizers import l2, l1, l1_l2
 from sklearn.metrics import classification_report, accuracy_score, roc_auc_score
 from tensorflow.keras.callbacks import ReduceLROnPlateau, EarlyStopping, ModelCheckpoint
 from basemodel import BaseModel
+from maskedpooling import MaskedGlobalMaxPool1D
 from tokenposembeddings import TokenAndPositionEmbedding
 from transformerblock import TransformerBlock
 
@@ -27,8 +28,18 @@ class TransformerModel(BaseModel):
                  path_train, path_test, path_dev, filters=64, kernel_size=5,
                  vocab_size=None, learning_rate=1e-3, pool_size=4, rate=0.2, l2_rate=1e-5,
                  embedding_size=300, max_len=1900, load_embeddings=True, buffer_size=3, emb_type='fasttext',
-                 length_type='median', dense_units=128, attheads=12, att_layers=2):
-        """Init function for the model.
+                 length_type='median', dense_units=128, attheads=12, att_layers=2, fused_qkv=False,
+                 attention_chunk_size=None, attention_window=None, global_tokens=0, **kwargs):
+        """Init function for the model. The keyword arguments not listed here are passed to BaseModel.
+        fused_qkv and attention_chunk_size are the options of the self attention of the transformer blocks (see
+        MultiHeadSelfAttention): a single Dense for the query, key and value (off by default, as the checkpoints of
+        the three Dense layers can't be loaded with it), and None for the full attention or
+        the size of the blocks of the chunked one, which doesn't hold the (max_sequence_len, max_sequence_len)
+        matrices.
+        attention_window is None for those, or the window of the local attention, every token only attends to the
+        attention_window tokens at each side and to global_tokens learned tokens that attend to the whole
+        sequence, so the cost grows linearly with max_sequence_len. A list gives one window (or None) per block,
+        e.g. [128, None] for a local block followed by a full (or chunked) one.
         """
         super(TransformerModel, self).__init__(max_len=max_len, path_train=path_train,
                                                path_test=path_test, path_dev=path_dev, batch_size=batch_size,
@@ -38,19 +49,32 @@ class TransformerModel(BaseModel):
                                                optimizer=optimizer, load_embeddings=load_embeddings, rate=rate,
                                                length_type=length_type, dense_units=dense_units,
                                                filters=filters, kernel_size=kernel_size, pool_size=pool_size,
-                                               buffer_size=buffer_size, l2_rate=l2_rate
+                                               buffer_size=buffer_size, l2_rate=l2_rate, **kwargs
                                                )
         self.lstm_units = lstm_units
         self.attheads = attheads
         self.att_layers = att_layers
+        self.fused_qkv = fused_qkv
+        self.attention_chunk_size = attention_chunk_size
+        if not isinstance(attention_window, (list, tuple)):
+            attention_window = [attention_window] * att_layers
+        if len(attention_window) != att_layers:
+            raise ValueError(f"attention_window has {len(attention_window)} windows for {att_layers} blocks")
+        self.attention_window = list(attention_window)
+        self.global_tokens = global_tokens
         # Create N transformer layers
 
     def call(self):
-        self.inputs = tf.keras.layers.Input(shape=(self.max_sequence_len,), dtype="int32", name="seq_input")
+        self.inputs = tf.keras.layers.Input(shape=(self.input_sequence_len,), dtype="int32", name="seq_input")
         self.embedding_layer = TokenAndPositionEmbedding(self.max_sequence_len, self.nb_words, self.embedding_size,
-                                                         self.embeddings_matrix)
-        self.transformer_layers = [TransformerBlock(self.embedding_size, self.attheads, self.dense_units, self.rate)
-                                   for _ in range(self.att_layers)]
+                                                         self.embeddings_matrix, mask_zero=self.mask_padding,
+                                                         first_token_positions=self.bucketed)
+        self.transformer_layers = [TransformerBlock(self.embedding_size, self.attheads, self.dense_units, self.rate,
+                                                    fused_qkv=self.fused_qkv,
+                                                    chunk_size=self.attention_chunk_size if window is None else None,
+                                                    window_size=window,
+                                                    global_tokens=self.global_tokens if window is not None else 0)
+                                   for window in self.attention_window]
         x = self.embedding_layer(self.inputs)
         # Create the transformer layers
         for i in range(self.att_layers):
@@ -60,7 +84,7 @@ class TransformerModel(BaseModel):
         # x = transformer_block(x)
         # Now shape = # (None, input_seq_len, embeddings_dim)
         x = Dense(self.dense_units, activation='relu', kernel_regularizer=l2(self.l2_rate), name='dense_layer1')(x)
-        x = GlobalMaxPool1D()(x)
+        x = MaskedGlobalMaxPool1D()(x)
         # Now shape = (None, embeddings_dim)
         # x = Dropout(self.rate)(x)
         # x = Dense(self.dense_units)(x)
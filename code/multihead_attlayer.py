@@ -1,8 +1,23 @@
+import numpy as np
 import tensorflow as tf
 import tensorflow.keras as keras
 
 class MultiHeadSelfAttention(keras.layers.Layer):
-    def __init__(self, embed_dim, num_heads=8):
+    def __init__(self, embed_dim, num_heads=8, fused_qkv=False, chunk_size=None, window_size=None, global_tokens=0):
+        """Initializer for the multi-head self attention.
+        Args:
+            - embed_dim: Embeddings dimension
+            - num_heads: number of heads
+            - fused_qkv: project the query, the key and the value with a single Dense(3 * embed_dim), one matmul
+            instead of three. False, by default, keeps the three Dense layers, so the existing checkpoints load.
+            - chunk_size: if given, the attention goes over blocks of chunk_size keys with an online softmax (see
+            chunked_attention), so the (seq_len, seq_len) scores are never held in memory.
+            None computes the full matrices.
+            - window_size: if given, every token only attends to the window_size tokens before and after it (see
+            local_attention), so the cost grows linearly with seq_len. It can't be used with chunk_size.
+            - global_tokens: number of learned global tokens of the local attention. They attend to the whole
+            sequence and every token attends to them, so the information still goes from one end to the other.
+        """
         super(MultiHeadSelfAttention, self).__init__()
         self.embed_dim = embed_dim # 300 in my case
         self.num_heads = num_heads
@@ -10,42 +25,226 @@ class MultiHeadSelfAttention(keras.layers.Layer):
             raise ValueError(
                 f"embedding dimension = {embed_dim} should be divisible by number of heads = {num_heads}"
             )
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError(f"chunk size = {chunk_size} should be None or positive")
+        if window_size is not None and window_size < 1:
+            raise ValueError(f"window size = {window_size} should be None or positive")
+        if window_size is not None and chunk_size is not None:
+            raise ValueError("Can't use the chunked attention with the local attention")
+        if global_tokens and window_size is None:
+            raise ValueError("The global tokens are only used by the local attention (window_size)")
         self.projection_dim = embed_dim // num_heads
-        self.query_dense = keras.layers.Dense(embed_dim)
-        self.key_dense = keras.layers.Dense(embed_dim)
-        self.value_dense = keras.layers.Dense(embed_dim)
+        self.fused_qkv = fused_qkv
+        self.chunk_size = chunk_size
+        self.window_size = window_size
+        self.global_tokens = global_tokens
+        if fused_qkv:
+            self.qkv_dense = keras.layers.Dense(3 * embed_dim)
+        else:
+            self.query_dense = keras.layers.Dense(embed_dim)
+            self.key_dense = keras.layers.Dense(embed_dim)
+            self.value_dense = keras.layers.Dense(embed_dim)
         self.combine_heads = keras.layers.Dense(embed_dim)
+        # The outputs keep the mask of the inputs
+        self.supports_masking = True
+
+    def build(self, input_shape):
+        if self.global_tokens:
+            self.global_embeddings = self.add_weight(name='global_embeddings',
+                                                     shape=(self.global_tokens, self.embed_dim),
+                                                     initializer='glorot_uniform', trainable=True)
+        super(MultiHeadSelfAttention, self).build(input_shape)
 
-    def attention(self, query, key, value):
-        """Function that computes the Scaled Dot-Product Attention
+    def attention(self, query, key, value, mask=None):
+        """Function that computes the Scaled Dot-Product Attention. With the mask (batch_size, seq_len) of the keys
+        the padding gets zero weights.
         """
         score = tf.matmul(query, key, transpose_b=True)
         dim_key = tf.cast(tf.shape(key)[-1], tf.float32)
         scaled_score = score / tf.math.sqrt(dim_key)
+        if mask is not None:
+            # The lowest value to the padding so the softmax gives it 0
+            scaled_score = tf.where(tf.cast(mask, tf.bool)[:, None, None, :], scaled_score,
+                                    scaled_score.dtype.min)  # (batch_size, num_heads, seq_len, seq_len)
         weights = tf.nn.softmax(scaled_score, axis=-1)
         output = tf.matmul(weights, value)
         return output, weights
 
+    def chunked_attention(self, query, key, value, mask=None):
+        """Same Scaled Dot-Product Attention, going over the keys and values in blocks of chunk_size with an online
+        softmax: it keeps the running max and sum of the exponentials of the scores of every query and rescales the
+        accumulated output when the max grows. Only the (seq_len, chunk_size) scores of a block exist at a time. The
+        gradient is computed block by block too, from the log-sum-exp of the scores of every query (the weights
+        are recomputed instead of kept), so the training doesn't hold the (seq_len, seq_len) matrices either.
+        The weights aren't returned.
+        """
+        batch_size, seq_len = tf.shape(query)[0], tf.shape(query)[2]
+        chunk = self.chunk_size
+        n_chunks = (seq_len + chunk - 1) // chunk
+        padding = n_chunks * chunk - seq_len
+        # The keys added to complete the last block are masked
+        if mask is None:
+            mask = tf.ones((batch_size, seq_len), dtype=tf.bool)
+        mask = tf.pad(tf.cast(mask, tf.bool), [[0, 0], [0, padding]])  # (batch_size, n_chunks * chunk)
+        # (batch_size, num_heads, n_chunks * chunk, projection_dim)
+        key = tf.pad(key, [[0, 0], [0, 0], [0, padding], [0, 0]])
+        value = tf.pad(value, [[0, 0], [0, 0], [0, padding], [0, 0]])
+        scale = 1. / tf.math.sqrt(tf.cast(self.projection_dim, query.dtype))
+
+        def block(x, i):
+            return x[:, :, i * chunk:(i + 1) * chunk]  # (batch_size, num_heads, chunk, projection_dim)
+
+        @tf.custom_gradient
+        def online_softmax_attention(query, key, value):
+            def scores(i):
+                # (batch_size, num_heads, seq_len, chunk)
+                score = tf.matmul(query, block(key, i), transpose_b=True) * scale
+                return tf.where(mask[:, None, None, i * chunk:(i + 1) * chunk], score, score.dtype.min)
+
+            def step(i, running_max, running_sum, output):
+                score = scores(i)
+                block_max = tf.maximum(running_max, tf.reduce_max(score, axis=-1, keepdims=True))
+                exp_score = tf.exp(score - block_max)
+                # Rescale what was accumulated with the previous max
+                correction = tf.exp(running_max - block_max)
+                running_sum = running_sum * correction + tf.reduce_sum(exp_score, axis=-1, keepdims=True)
+                output = output * correction + tf.matmul(exp_score, block(value, i))
+                return i + 1, block_max, running_sum, output
+
+            stats_shape = tf.concat([tf.shape(query)[:-1], [1]], axis=0)  # (batch_size, num_heads, seq_len, 1)
+            _, running_max, running_sum, output = tf.while_loop(
+                lambda i, *_: i < n_chunks, step,
+                [tf.constant(0), tf.fill(stats_shape, query.dtype.min), tf.zeros(stats_shape, query.dtype),
+                 tf.zeros_like(query)], parallel_iterations=1)  # A block at a time, or they would be in memory at once
+            output = output / running_sum  # (batch_size, num_heads, seq_len, projection_dim)
+            log_sum_exp = running_max + tf.math.log(running_sum)  # (batch_size, num_heads, seq_len, 1)
+
+            def grad(d_output):
+                d_output_dot_output = tf.reduce_sum(d_output * output, axis=-1, keepdims=True)
+
+                def backward_step(i, d_query, d_key, d_value):
+                    weights = tf.exp(scores(i) - log_sum_exp)  # (batch_size, num_heads, seq_len, chunk)
+                    d_value = d_value.write(i, tf.matmul(weights, d_output, transpose_a=True))
+                    d_weights = tf.matmul(d_output, block(value, i), transpose_b=True)
+                    # Gradient of the softmax: weights * (d_weights - sum(weights * d_weights))
+                    d_score = weights * (d_weights - d_output_dot_output) * scale
+                    d_key = d_key.write(i, tf.matmul(d_score, query, transpose_a=True))
+                    d_query += tf.matmul(d_score, block(key, i))
+                    return i + 1, d_query, d_key, d_value
+
+                _, d_query, d_key, d_value = tf.while_loop(
+                    lambda i, *_: i < n_chunks, backward_step,
+                    [tf.constant(0), tf.zeros_like(query), tf.TensorArray(query.dtype, size=n_chunks),
+                     tf.TensorArray(query.dtype, size=n_chunks)], parallel_iterations=1)
+
+                def concat_blocks(blocks):  # (n_chunks, batch_size, num_heads, chunk, projection_dim)
+                    blocks = tf.transpose(blocks.stack(), perm=[1, 2, 0, 3, 4])
+                    return tf.reshape(blocks, tf.shape(key))
+
+                return d_query, concat_blocks(d_key), concat_blocks(d_value)
+
+            return output, grad
+
+        return online_softmax_attention(query, key, value), None
+
+    def local_attention(self, query, key, value, mask=None):
+        """Sliding window attention: the query of the position i only attends to the keys of the positions
+        [i - window_size, i + window_size] and to the global tokens. The sequence is split in blocks of
+        window_size, and every block of queries is scored against its own block of keys and the previous and next
+        ones, masked to the window: (seq_len, 3 * window_size) scores instead of (seq_len, seq_len).
+        The global tokens are learned embeddings projected as the inputs. Their queries attend to the whole
+        sequence (global_tokens x seq_len scores), which gives their values, and every query attends to their
+        keys. The weights aren't returned.
+        """
+        batch_size, seq_len = tf.shape(query)[0], tf.shape(query)[2]
+        window = self.window_size
+        n_blocks = (seq_len + window - 1) // window
+        padding = n_blocks * window - seq_len
+        if mask is None:
+            mask = tf.ones((batch_size, seq_len), dtype=tf.bool)
+        mask = tf.cast(mask, tf.bool)
+        scale = 1. / tf.math.sqrt(tf.cast(self.projection_dim, query.dtype))
+
+        def blocks(x):
+            x = tf.pad(x, [[0, 0], [0, 0], [0, padding], [0, 0]])
+            return tf.reshape(x, (batch_size, self.num_heads, n_blocks, window, self.projection_dim))
+
+        def with_neighbours(x, axis):
+            # Previous, own and next block of every block (the ones out of the sequence are zeros/False)
+            paddings = [[0, 0]] * len(x.shape)
+            paddings[axis] = [1, 1]
+            x = tf.pad(x, paddings)
+            size = [-1] * len(x.shape)
+            size[axis] = n_blocks
+            parts = [tf.slice(x, [0] * axis + [offset] + [0] * (len(x.shape) - axis - 1), size) for offset in range(3)]
+            return tf.concat(parts, axis=axis + 1)
+
+        query_blocks = blocks(query * scale)  # (batch_size, num_heads, n_blocks, window, projection_dim)
+        # (batch_size, num_heads, n_blocks, 3 * window, projection_dim)
+        key_windows = with_neighbours(blocks(key), axis=2)
+        value_windows = with_neighbours(blocks(value), axis=2)
+        # (batch_size, n_blocks, 3 * window)
+        mask_windows = with_neighbours(tf.reshape(tf.pad(mask, [[0, 0], [0, padding]]),
+                                                  (batch_size, n_blocks, window)), axis=1)
+        # Offset of the key j of the window to the query i of the block: j - window - i
+        offsets = np.arange(3 * window)[None, :] - window - np.arange(window)[:, None]
+        band = np.abs(offsets) <= window  # (window, 3 * window)
+        if self.global_tokens:
+            # (1, num_heads, global_tokens, projection_dim)
+            global_query, global_key, global_value = self.project(self.global_embeddings[None], 1)
+            # The global tokens attend to the whole sequence (and not to the padding)
+            # (batch_size, num_heads, global_tokens, seq_len)
+            global_score = tf.matmul(global_query, key, transpose_b=True) * scale
+            global_score = tf.where(mask[:, None, None, :], global_score, global_score.dtype.min)
+            # (batch_size, num_heads, global_tokens, projection_dim)
+            global_value = tf.matmul(tf.nn.softmax(global_score, axis=-1), value)
+            # And every token attends to them: they go at the end of every window of keys. This is faster than
+            # scoring them apart and concatenating the scores
+            global_key = tf.tile(global_key[:, :, None], [batch_size, 1, n_blocks, 1, 1])
+            global_value = tf.tile(global_value[:, :, None], [1, 1, n_blocks, 1, 1])
+            # (batch_size, num_heads, n_blocks, 3 * window + global_tokens, projection_dim)
+            key_windows = tf.concat([key_windows, global_key], axis=3)
+            value_windows = tf.concat([value_windows, global_value], axis=3)
+            band = np.concatenate([band, np.ones((window, self.global_tokens), dtype=bool)], axis=1)
+            mask_windows = tf.concat([mask_windows, tf.ones((batch_size, n_blocks, self.global_tokens), dtype=tf.bool)],
+                                     axis=-1)
+        allowed = tf.logical_and(tf.constant(band)[None, None, None], mask_windows[:, None, :, None, :])
+        # (batch_size, num_heads, n_blocks, window, 3 * window + global_tokens)
+        score = tf.einsum('bhnqd,bhnkd->bhnqk', query_blocks, key_windows)
+        score = tf.where(allowed, score, score.dtype.min)
+        weights = tf.nn.softmax(score, axis=-1)
+        output = tf.einsum('bhnqk,bhnkd->bhnqd', weights, value_windows)
+        output = tf.reshape(output, (batch_size, self.num_heads, n_blocks * window, self.projection_dim))
+        return output[:, :, :seq_len], None
+
+    def project(self, inputs, batch_size):
+        """Query, key and value of the inputs, separated in heads: (batch_size, num_heads, seq_len, projection_dim)
+        each.
+        """
+        if self.fused_qkv:
+            qkv = self.qkv_dense(inputs)  # (batch_size, seq_len, 3 * embed_dim)
+            query, key, value = tf.split(qkv, 3, axis=-1)  # (batch_size, seq_len, embed_dim) each
+        else:
+            query = self.query_dense(inputs)  # (batch_size, seq_len, embed_dim)
+            key = self.key_dense(inputs)  # (batch_size, seq_len, embed_dim)
+            value = self.value_dense(inputs)  # (batch_size, seq_len, embed_dim)
+        return (self.separate_heads(query, batch_size), self.separate_heads(key, batch_size),
+                self.separate_heads(value, batch_size))
+
     def separate_heads(self, x, batch_size):
         x = tf.reshape(x, (batch_size, -1, self.num_heads, self.projection_dim))
         return tf.transpose(x, perm=[0, 2, 1, 3])
 
-    def call(self, inputs):
+    def call(self, inputs, mask=None):
         # x.shape = [batch_size, seq_len, embedding_dim]
         batch_size = tf.shape(inputs)[0]
-        query = self.query_dense(inputs)  # (batch_size, seq_len, embed_dim)
-        key = self.key_dense(inputs)  # (batch_size, seq_len, embed_dim)
-        value = self.value_dense(inputs)  # (batch_size, seq_len, embed_dim)
-        query = self.separate_heads(
-            query, batch_size
-        )  # (batch_size, num_heads, seq_len, projection_dim)
-        key = self.separate_heads(
-            key, batch_size
-        )  # (batch_size, num_heads, seq_len, projection_dim)
-        value = self.separate_heads(
-            value, batch_size
-        )  # (batch_size, num_heads, seq_len, projection_dim)
-        attention, weights = self.attention(query, key, value)
+        query, key, value = self.project(inputs, batch_size)  # (batch_size, num_heads, seq_len, projection_dim)
+        if self.window_size is not None:
+            attention, weights = self.local_attention(query, key, value, mask)
+        elif self.chunk_size is not None:
+            attention, weights = self.chunked_attention(query, key, value, mask)
+        else:
+            attention, weights = self.attention(query, key, value, mask)
         attention = tf.transpose(
             attention, perm=[0, 2, 1, 3]
         )  # (batch_size, seq_len, num_heads, projection_dim)
@@ -55,4 +254,4 @@ class MultiHeadSelfAttention(keras.layers.Layer):
         output = self.combine_heads(
             concat_attention
         )  # (batch_size, seq_len, embed_dim)
-        return output
\ No newline at end of file
+        return output
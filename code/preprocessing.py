@@ -2,14 +2,18 @@
 Document that contain all the functions to preprocess the text.
 This includes, tokenize, delete stopwords, lower_case and stemming.
 """
+import os
 import unicodedata
 import re
 import copy
+import time
+import functools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-import nltk
+import pandas as pd
 
-nltk.download('stopwords')
-nltk.download('punkt')
+import nltk
 from nltk import word_tokenize, sent_tokenize
 from nltk.corpus import stopwords
 from stop_words import get_stop_words
@@ -17,9 +21,171 @@ from nltk.stem import PorterStemmer
 from factory_embeddings import FactoryEmbeddings
 
 
+# NLTK resources used by the preprocessing, as (name for nltk.download, path for nltk.data.find).
+NLTK_RESOURCES = [('stopwords', 'corpora/stopwords'), ('punkt', 'tokenizers/punkt')]
+
+
+# Contractions expanded by Preprocessing.remove_contractions. "u", "ur" and "n" are only expanded as whole words.
+CONTRACTIONS = {
+    "ain't": "am not",
+    "aren't": "are not",
+    "can't": "cannot",
+    "can't've": "cannot have",
+    "'cause": "because",
+    "could've": "could have",
+    "couldn't": "could not",
+    "couldn't've": "could not have",
+    "didn't": "did not",
+    "doesn't": "does not",
+    "don't": "do not",
+    "hadn't": "had not",
+    "hadn't've": "had not have",
+    "hasn't": "has not",
+    "haven't": "have not",
+    "he'd": "he would",
+    "he'd've": "he would have",
+    "he'll": "he will",
+    "he'll've": "he will have",
+    "he's": "he is",
+    "how'd": "how did",
+    "how'd'y": "how do you",
+    "how'll": "how will",
+    "how's": "how does",
+    "i'd": "i would",
+    "i'd've": "i would have",
+    "i'll": "i will",
+    "i'll've": "i will have",
+    "i'm": "i am",
+    "i've": "i have",
+    "isn't": "is not",
+    "it'd": "it would",
+    "it'd've": "it would have",
+    "it'll": "it will",
+    "it'll've": "it will have",
+    "it's": "it is",
+    "let's": "let us",
+    "ma'am": "madam",
+    "mayn't": "may not",
+    "might've": "might have",
+    "mightn't": "might not",
+    "mightn't've": "might not have",
+    "must've": "must have",
+    "mustn't": "must not",
+    "mustn't've": "must not have",
+    "needn't": "need not",
+    "needn't've": "need not have",
+    "o'clock": "of the clock",
+    "oughtn't": "ought not",
+    "oughtn't've": "ought not have",
+    "shan't": "shall not",
+    "sha'n't": "shall not",
+    "shan't've": "shall not have",
+    "she'd": "she would",
+    "she'd've": "she would have",
+    "she'll": "she will",
+    "she'll've": "she will have",
+    "she's": "she is",
+    "should've": "should have",
+    "shouldn't": "should not",
+    "shouldn't've": "should not have",
+    "so've": "so have",
+    "so's": "so is",
+    "that'd": "that would",
+    "that'd've": "that would have",
+    "that's": "that is",
+    "there'd": "there would",
+    "there'd've": "there would have",
+    "there's": "there is",
+    "they'd": "they would",
+    "they'd've": "they would have",
+    "they'll": "they will",
+    "they'll've": "they will have",
+    "they're": "they are",
+    "they've": "they have",
+    "to've": "to have",
+    "wasn't": "was not",
+    "u": "you",
+    "ur": "your",
+    "n": "and"}
+
+# Whitespace other than a plain space. Texts without it are split with str.split(' ') in remove_contractions.
+OTHER_WHITESPACE_RE = re.compile(r'[^\S ]')
+# Splits a text in words, keeping the whitespace between them.
+WHITESPACE_RE = re.compile(r'(\s+)')
+
+
+class StemCache:
+    '''Porter stemmer memoized at vocabulary level. The stems are computed once per distinct token, and the cache
+    is kept for the whole life of the process, so it is shared by all the documents and by all the chunks that a
+    worker of Preprocessing.parallel_pipeline preprocesses.
+    '''
+
+    def __init__(self, maxsize=None):
+        """Sole constructor for the class
+        Arguments:
+            - maxsize: max number of stems kept (LRU). By default the whole vocabulary is kept.
+        """
+        self.maxsize = maxsize
+        self.stemmer = PorterStemmer()
+        self.stem = functools.lru_cache(maxsize=maxsize)(self.stemmer.stem)
+
+    def counts(self):
+        """Hits and misses of the cache.
+        """
+        info = self.stem.cache_info()
+        return info.hits, info.misses
+
+    def hit_rate(self):
+        """Fraction of the tokens served by the cache.
+        """
+        hits, misses = self.counts()
+        return hits / max(hits + misses, 1)
+
+    def clear(self):
+        """Delete all the stems and reset the counters.
+        """
+        self.stem.cache_clear()
+
+    def __len__(self):
+        return self.stem.cache_info().currsize
+
+
 class Preprocessing:
     '''Class to preprocess text data.
     '''
+    # Settings of the pipeline. Change the version whenever the output of the pipeline changes, so the cached
+    # outputs (see preprocessing_cache.py) are not used anymore.
+    SETTINGS = {
+        'version': 2,
+        'stemmer': 'porter',
+        'stopwords': ['stop_words-en', 'nltk-english'],
+    }
+    # Stopwords of SETTINGS as a frozenset, built on the first use (see stop_words).
+    _stop_words = None
+    # Stems cache of this process.
+    stem_cache = StemCache()
+
+    @staticmethod
+    def check_nltk_resources(download=False):
+        '''Check that the NLTK resources are installed, looking only at the local nltk_data directories.
+
+        Arguments:
+            - download: download the missing resources instead of raising an error.
+        Raises:
+            - LookupError if a resource is missing and download is False.
+        '''
+        missing = []
+        for name, path in NLTK_RESOURCES:
+            try:
+                nltk.data.find(path)
+            except LookupError:
+                missing.append(name)
+        if missing and download:
+            for name in missing:
+                nltk.download(name)
+        elif missing:
+            raise LookupError('Missing NLTK resources: {}. Download them with nltk.download or with '
+                              'python main.py --mode 1 --download-nltk.'.format(', '.join(missing)))
 
     @staticmethod
     def pipeline(data):
@@ -42,14 +208,140 @@ class Preprocessing:
         print('Tokenización.')
         # Tokenize the data.
         pdata = Preprocessing.tokenize(pdata)
-        print('Eliminación de stopwords.')
-        # Delete stopwords from the data
-        pdata = Preprocessing.delete_stopwords(pdata)
-        print('Stemming.')
-        # Stem the data
-        pdata_stem, pdata_join = Preprocessing.stemming(pdata)
+        print('Eliminación de stopwords y stemming.')
+        # Delete stopwords from the data and stem it
+        pdata_stem, pdata_join = Preprocessing.normalize_tokens(pdata)
+        print('Stem cache: {:.1f}% hit rate.'.format(100 * Preprocessing.stem_cache.hit_rate()))
         return pdata_stem, pdata_join
 
+    @staticmethod
+    def _pipeline_chunk(chunk):
+        '''Apply every stage of pipeline to a chunk of documents, timing every stage.
+
+        Arguments:
+            - chunk: list with the documents.
+        Returns:
+            - pdata_stem, pdata_join: same as pipeline.
+            - pdata_simple: same as pipeline_simple.
+            - stats: dict stage -> (seconds, tokens processed).
+            - stem_counts: hits and misses of the stem cache in this chunk.
+        '''
+        stats = {}
+        hits, misses = Preprocessing.stem_cache.counts()
+        start = time.perf_counter()
+        pdata = [Preprocessing.preprocess_sentence(doc) for doc in chunk]
+        stats['preprocess_sentence'] = (time.perf_counter() - start, sum(len(doc.split()) for doc in chunk))
+        start = time.perf_counter()
+        pdata = [Preprocessing.remove_contractions(doc) for doc in pdata]
+        pdata_simple = pdata
+        stats['remove_contractions'] = (time.perf_counter() - start, sum(len(doc.split()) for doc in pdata))
+        start = time.perf_counter()
+        pdata = Preprocessing.tokenize(pdata)
+        stats['tokenize'] = (time.perf_counter() - start, sum(len(doc) for doc in pdata))
+        start = time.perf_counter()
+        n_tokens = sum(len(doc) for doc in pdata)
+        pdata_stem, pdata_join = Preprocessing.normalize_tokens(pdata)
+        stats['normalize_tokens'] = (time.perf_counter() - start, n_tokens)
+        new_hits, new_misses = Preprocessing.stem_cache.counts()
+        return pdata_stem, pdata_join, pdata_simple, stats, (new_hits - hits, new_misses - misses)
+
+    @staticmethod
+    def parallel_pipeline(data, workers=None, chunk_size=1000):
+        '''Same as pipeline and pipeline_simple at once, but the data is split in chunks that go through all the
+        stages in a pool of processes. The results keep the order of the data. The throughput of every stage is
+        printed at the end.
+
+        Arguments:
+            - data: data to preprocess
+            - workers: number of processes. By default the number of cores.
+            - chunk_size: number of documents per chunk.
+        Returns:
+            - pdata_stem: Data with all the preprocess applied.
+            - pdata_join: Same as pdata_stem but each instance ins joined as sentence.
+            - pdata_simple: data with sencences preprocesed (as pipeline_simple).
+        '''
+        start = time.perf_counter()
+        data = list(data)
+        chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+        pdata_stem, pdata_join, pdata_simple = [], [], []
+        stats = {}
+        hits, misses = 0, 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk_stem, chunk_join, chunk_simple, chunk_stats, (chunk_hits, chunk_misses) in \
+                    executor.map(Preprocessing._pipeline_chunk, chunks):
+                pdata_stem.extend(chunk_stem)
+                pdata_join.extend(chunk_join)
+                pdata_simple.extend(chunk_simple)
+                for stage, (seconds, tokens) in chunk_stats.items():
+                    total_seconds, total_tokens = stats.get(stage, (0., 0))
+                    stats[stage] = (total_seconds + seconds, total_tokens + tokens)
+                hits += chunk_hits
+                misses += chunk_misses
+        Preprocessing.print_stage_stats(stats, len(data), time.perf_counter() - start)
+        print('Stem cache: {} hits, {} misses ({:.1f}% hit rate).'.format(hits, misses,
+                                                                         100 * hits / max(hits + misses, 1)))
+        return pdata_stem, pdata_join, pdata_simple
+
+    @staticmethod
+    def stream_pipeline(path, chunksize=10000, workers=None, max_pending=None):
+        '''Generator version of parallel_pipeline for files that don't fit in memory. The TSV is read in chunks
+        of chunksize rows that go through all the stages in a pool of processes, and every chunk is yielded as soon
+        as it is preprocessed (in the order of the file). Only max_pending chunks are in flight at any time, so
+        the memory used doesn't depend on the size of the file. The throughput of every stage is printed at the end.
+
+        Arguments:
+            - path: raw TSV file, with the text in the first column and the label in the last one.
+            - chunksize: number of rows per chunk.
+            - workers: number of processes. By default the number of cores.
+            - max_pending: max number of chunks read but not yielded yet. By default twice the number of workers.
+        Returns:
+            - Generator of DataFrames with the columns text_stem, text_join, text and label.
+        '''
+        start = time.perf_counter()
+        stats = {}
+        n_docs, hits, misses = 0, 0, 0
+        pending = deque()
+        if max_pending is None:
+            max_pending = 2 * (workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+
+            def collect():
+                nonlocal n_docs, hits, misses
+                future, labels = pending.popleft()
+                chunk_stem, chunk_join, chunk_simple, chunk_stats, (chunk_hits, chunk_misses) = future.result()
+                for stage, (seconds, tokens) in chunk_stats.items():
+                    total_seconds, total_tokens = stats.get(stage, (0., 0))
+                    stats[stage] = (total_seconds + seconds, total_tokens + tokens)
+                n_docs += len(labels)
+                hits += chunk_hits
+                misses += chunk_misses
+                return pd.DataFrame({'text_stem': chunk_stem, 'text_join': chunk_join, 'text': chunk_simple,
+                                     'label': labels})
+
+            for chunk in pd.read_csv(path, sep='\t', header=None, chunksize=chunksize):
+                pending.append((executor.submit(Preprocessing._pipeline_chunk, list(chunk[chunk.columns[0]])),
+                                list(chunk[chunk.columns[len(chunk.columns) - 1]])))
+                if len(pending) >= max_pending:
+                    yield collect()
+            while pending:
+                yield collect()
+        Preprocessing.print_stage_stats(stats, n_docs, time.perf_counter() - start)
+        print('Stem cache: {} hits, {} misses ({:.1f}% hit rate).'.format(hits, misses,
+                                                                         100 * hits / max(hits + misses, 1)))
+
+    @staticmethod
+    def print_stage_stats(stats, n_docs, elapsed):
+        '''Print the throughput of every stage of the pipeline. The seconds of every stage are summed over all
+        the processes, so docs/s and tokens/s are per core.
+        '''
+        total = sum(seconds for seconds, _ in stats.values()) or 1.
+        print('{:<22}{:>10}{:>8}{:>12}{:>14}'.format('Stage', 'seconds', '%', 'docs/s', 'tokens/s'))
+        for stage, (seconds, tokens) in stats.items():
+            seconds = max(seconds, 1e-9)
+            print('{:<22}{:>10.2f}{:>8.1f}{:>12.1f}{:>14.1f}'.format(stage, seconds, 100 * seconds / total,
+                                                                    n_docs / seconds, tokens / seconds))
+        print('Preprocessed {} documents in {:.2f} seconds.'.format(n_docs, elapsed))
+
     @staticmethod
     def pipeline_simple(data):
         '''Seconf pipeline of preprocessing. Preprocess all the data without embeddings.
@@ -125,93 +417,15 @@ class Preprocessing:
     def remove_contractions(text):
         """
         Remove all the possible contractions in the text so we can tokenize it
-        better and to delete more stopwords.
+        better and to delete more stopwords. Every word is looked up once in CONTRACTIONS, so the
+        text is only traversed once and the original whitespace is kept.
         """
-        contractions = {
-            "ain't": "am not",
-            "aren't": "are not",
-            "can't": "cannot",
-            "can't've": "cannot have",
-            "'cause": "because",
-            "could've": "could have",
-            "couldn't": "could not",
-            "couldn't've": "could not have",
-            "didn't": "did not",
-            "doesn't": "does not",
-            "don't": "do not",
-            "hadn't": "had not",
-            "hadn't've": "had not have",
-            "hasn't": "has not",
-            "haven't": "have not",
-            "he'd": "he would",
-            "he'd've": "he would have",
-            "he'll": "he will",
-            "he'll've": "he will have",
-            "he's": "he is",
-            "how'd": "how did",
-            "how'd'y": "how do you",
-            "how'll": "how will",
-            "how's": "how does",
-            "i'd": "i would",
-            "i'd've": "i would have",
-            "i'll": "i will",
-            "i'll've": "i will have",
-            "i'm": "i am",
-            "i've": "i have",
-            "isn't": "is not",
-            "it'd": "it would",
-            "it'd've": "it would have",
-            "it'll": "it will",
-            "it'll've": "it will have",
-            "it's": "it is",
-            "let's": "let us",
-            "ma'am": "madam",
-            "mayn't": "may not",
-            "might've": "might have",
-            "mightn't": "might not",
-            "mightn't've": "might not have",
-            "must've": "must have",
-            "mustn't": "must not",
-            "mustn't've": "must not have",
-            "needn't": "need not",
-            "needn't've": "need not have",
-            "o'clock": "of the clock",
-            "oughtn't": "ought not",
-            "oughtn't've": "ought not have",
-            "shan't": "shall not",
-            "sha'n't": "shall not",
-            "shan't've": "shall not have",
-            "she'd": "she would",
-            "she'd've": "she would have",
-            "she'll": "she will",
-            "she'll've": "she will have",
-            "she's": "she is",
-            "should've": "should have",
-            "shouldn't": "should not",
-            "shouldn't've": "should not have",
-            "so've": "so have",
-            "so's": "so is",
-            "that'd": "that would",
-            "that'd've": "that would have",
-            "that's": "that is",
-            "there'd": "there would",
-            "there'd've": "there would have",
-            "there's": "there is",
-            "they'd": "they would",
-            "they'd've": "they would have",
-            "they'll": "they will",
-            "they'll've": "they will have",
-            "they're": "they are",
-            "they've": "they have",
-            "to've": "to have",
-            "wasn't": "was not",
-            " u ": " you ",
-            " ur ": " your ",
-            " n ": " and "}
-        for word in text.split():
-            if word.lower() in contractions:
-                text = text.replace(word, contractions[word.lower()])
-        return text
+        get = CONTRACTIONS.get
+        if OTHER_WHITESPACE_RE.search(text) is None:
+            return ' '.join([get(word.lower(), word) for word in text.split(' ')])
+        parts = WHITESPACE_RE.split(text)
+        parts[::2] = [get(word.lower(), word) for word in parts[::2]]
+        return ''.join(parts)
 
     @staticmethod
     def preprocess_all_sentences(data):
@@ -225,6 +439,14 @@ class Preprocessing:
             data[i] = Preprocessing.preprocess_sentence(data[i])
         return data
 
+    @staticmethod
+    def stop_words():
+        '''Stopwords in english of stop_words and NLTK as a frozenset, built once per process.
+        '''
+        if Preprocessing._stop_words is None:
+            Preprocessing._stop_words = frozenset(get_stop_words('en')) | frozenset(stopwords.words('english'))
+        return Preprocessing._stop_words
+
     @staticmethod
     def stemming(text):
         '''Function to get the stem for every word
@@ -233,9 +455,9 @@ class Preprocessing:
         Returns:
             - list of lists with the stem applied.
         '''
-        stemmer = PorterStemmer()
+        stem = Preprocessing.stem_cache.stem
         # Stem all the data
-        stem_list = [[stemmer.stem(token) for token in sentence] for sentence in text]
+        stem_list = [[stem(token) for token in sentence] for sentence in text]
         # Generate the instances with join
         stem_join = [' '.join(sentence) for sentence in stem_list]
         return stem_list, stem_join
@@ -248,13 +470,25 @@ class Preprocessing:
         Returns:
             - text without stopwords
         '''
-        # Pick all the stopwords in english
-        stop_words_en = list(get_stop_words('en'))
-        nltk_words_en = list(stopwords.words('english'))
-        all_stop_words = stop_words_en + nltk_words_en
+        all_stop_words = Preprocessing.stop_words()
         # Delete all the stopwords
         return [[w for w in word if w not in all_stop_words] for word in text]
 
+    @staticmethod
+    def normalize_tokens(text):
+        '''Same as delete_stopwords followed by stemming, in a single pass over the tokens.
+        Arguments:
+            - text: list of lists with the text tokenized.
+        Returns:
+            - list of lists without stopwords and with the stem applied.
+            - same as the first one but each instance is joined as sentence.
+        '''
+        all_stop_words = Preprocessing.stop_words()
+        stem = Preprocessing.stem_cache.stem
+        stem_list = [[stem(token) for token in sentence if token not in all_stop_words] for sentence in text]
+        stem_join = [' '.join(sentence) for sentence in stem_list]
+        return stem_list, stem_join
+
     @staticmethod
     def pad_sentences(text, max_len=10):
         '''Function to pad the sentences from the text to a max_len.
@@ -0,0 +1,98 @@
+"""
+Content-addressed cache for the outputs of the preprocessing (main.py --mode 1).
+Every output is stored in a columnar binary file (Parquet) whose name is the hash of the input file and of the
+preprocessing settings, so a re-run with the same inputs and settings reads it back instead of preprocessing again,
+and any change in the data or in the pipeline produces a new entry.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import pandas as pd
+
+from preprocessing import Preprocessing
+
+
+def read_table(path):
+    """Read a split of the data, either a TSV or a Parquet file (by the extension).
+    """
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, sep='\t')
+
+
+class PreprocessingCache:
+    """Cache of preprocessed DataFrames keyed by input file hash and pipeline settings.
+    """
+
+    def __init__(self, cache_dir='../data/cache', settings=None):
+        """Sole constructor for the class
+        Arguments:
+            - cache_dir: directory where the files are stored.
+            - settings: dict with the settings of the pipeline. By default Preprocessing.SETTINGS.
+        """
+        self.cache_dir = cache_dir
+        self.settings = Preprocessing.SETTINGS if settings is None else settings
+
+    def key(self, path):
+        """Hash of the content of the file and of the pipeline settings.
+        """
+        sha = hashlib.sha256()
+        sha.update(json.dumps(self.settings, sort_keys=True).encode('utf-8'))
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        return sha.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.parquet')
+
+    def load(self, path):
+        """Return the cached output for the input file, or None if it isn't cached.
+        """
+        cached_path = self.path(self.key(path))
+        if not os.path.exists(cached_path):
+            return None
+        return pd.read_parquet(cached_path)
+
+    def store(self, path, data):
+        """Store the output for the input file.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cached_path = self.path(self.key(path))
+        # Write to a temporary file first so an interrupted run never leaves a broken entry
+        data.to_parquet(cached_path + '.tmp', index=False)
+        os.replace(cached_path + '.tmp', cached_path)
+        return cached_path
+
+    def cached_path(self, path):
+        """Path of the cached output for the input file, or None if it isn't cached.
+        """
+        cached_path = self.path(self.key(path))
+        return cached_path if os.path.exists(cached_path) else None
+
+    def store_file(self, path, parquet_file):
+        """Store a Parquet file already written (e.g. by a streaming run) as the output for the input file.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cached_path = self.path(self.key(path))
+        shutil.copyfile(parquet_file, cached_path + '.tmp')
+        os.replace(cached_path + '.tmp', cached_path)
+        return cached_path
+
+    def get_or_compute(self, path, compute):
+        """Return the cached output for the input file, computing and storing it if needed.
+        Arguments:
+            - path: input file.
+            - compute: function that receives the path and returns the DataFrame to cache.
+        Returns:
+            - The DataFrame and True if it was read from the cache.
+        """
+        data = self.load(path)
+        if data is not None:
+            print('Using the cached preprocessing of ' + path)
+            return data, True
+        data = compute(path)
+        self.store(path, data)
+        return data, False
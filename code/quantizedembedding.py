@@ -0,0 +1,76 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import layers
+
+
+class QuantizedMatrix:
+    """Embeddings matrix stored as int8 values with a float32 scale per row (symmetric quantization).
+    Every row is recovered as values[i] * scale[i].
+    """
+
+    def __init__(self, values, scale):
+        """Sole constructor for the class
+        Arguments:
+            - values: np.array with shape (rows, d) and dtype int8.
+            - scale: np.array with shape (rows,) and dtype float32.
+        """
+        self.values = values
+        self.scale = scale
+
+    @classmethod
+    def from_float(cls, matrix):
+        """Quantize a float matrix row by row, so the largest absolute value of every row is mapped to 127.
+        """
+        scale = np.abs(matrix).max(axis=1).astype(np.float32) / 127.
+        # The rows of the words not found are all zeros, give them any scale to avoid dividing by 0
+        scale[scale == 0] = 1.
+        values = np.rint(matrix / scale[:, None]).astype(np.int8)
+        return cls(values, scale)
+
+    def dequantize(self):
+        return self.values.astype(np.float32) * self.scale[:, None]
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.scale.nbytes
+
+
+class QuantizedEmbedding(layers.Layer):
+    """Frozen embedding layer built from a QuantizedMatrix. It keeps the int8 values and the scales as
+    non-trainable weights and only dequantizes the rows of the words in the batch. With mask_zero the index 0 is
+    padding and the layer outputs its mask, as tf.keras.layers.Embedding.
+    """
+
+    def __init__(self, matrix, input_length=None, mask_zero=False, **kwargs):
+        super(QuantizedEmbedding, self).__init__(trainable=False, **kwargs)
+        self.matrix = matrix
+        self.input_dim, self.output_dim = matrix.shape
+        self.input_length = input_length
+        self.mask_zero = mask_zero
+
+    def build(self, input_shape):
+        self.values = self.add_weight(name='values', shape=(self.input_dim, self.output_dim), dtype=tf.int8,
+                                      initializer='zeros', trainable=False)
+        self.scale = self.add_weight(name='scale', shape=(self.input_dim,), dtype=tf.float32,
+                                     initializer='ones', trainable=False)
+        self.values.assign(self.matrix.values)
+        self.scale.assign(self.matrix.scale)
+        super(QuantizedEmbedding, self).build(input_shape)
+
+    def call(self, inputs):
+        inputs = tf.cast(inputs, tf.int32)
+        values = tf.cast(tf.gather(self.values, inputs), self.compute_dtype)  # (B, S, E)
+        scale = tf.gather(self.scale, inputs)  # (B, S)
+        return values * tf.expand_dims(tf.cast(scale, self.compute_dtype), -1)
+
+    def compute_mask(self, inputs, mask=None):
+        if not self.mask_zero:
+            return None
+        return tf.not_equal(inputs, 0)
+
+    def compute_output_shape(self, input_shape):
+        return tuple(input_shape) + (self.output_dim,)
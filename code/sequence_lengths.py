@@ -0,0 +1,115 @@
+"""
+Profile of the lengths of the sequences of the corpus, used to choose max_sequence_len.
+The lengths are counted once into a histogram, and every statistic (mean, mode, median, percentiles and the
+fraction of padded tokens for any max_sequence_len) is computed from it with NumPy.
+"""
+import numpy as np
+
+
+class LengthProfile:
+    """Histogram of the lengths of a list of sequences.
+    """
+
+    def __init__(self, lengths):
+        """Sole constructor for the class
+        Arguments:
+            - lengths: length of every sequence.
+        """
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        if self.lengths.size == 0:
+            raise ValueError('Cannot profile an empty list of sequences')
+        self.histogram = np.bincount(self.lengths)
+
+    @classmethod
+    def from_sequences(cls, sequences):
+        """Profile of the output of Tokenizer.texts_to_sequences (or any list of lists).
+        """
+        return cls(np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences)))
+
+    def __len__(self):
+        return int(self.lengths.size)
+
+    @property
+    def mean(self):
+        return int(self.lengths.mean())
+
+    @property
+    def mode(self):
+        return int(self.histogram.argmax())
+
+    @property
+    def median(self):
+        return int(np.median(self.lengths))
+
+    @property
+    def max(self):
+        return int(self.histogram.size - 1)
+
+    def percentile(self, q):
+        """Length under which lie the q percent of the sequences.
+        """
+        return int(np.percentile(self.lengths, q))
+
+    def percentiles(self, qs=(50, 75, 90, 95, 99)):
+        """Dict q -> percentile q of the lengths.
+        """
+        return dict(zip(qs, np.percentile(self.lengths, qs).astype(int).tolist()))
+
+    def padding_curve(self):
+        """Fraction of padded and of truncated tokens for every max_sequence_len from 1 to max, at once.
+        Returns:
+            - padded: padded[L - 1] is the fraction of the L * n tokens of the padded sequences that are padding.
+            - truncated: truncated[L - 1] is the fraction of the tokens of the corpus lost by truncating to L.
+        """
+        sizes = np.arange(self.histogram.size)
+        # Number of sequences and of tokens in the sequences shorter than L, for L = 1..max
+        shorter = np.cumsum(self.histogram)[:-1]
+        shorter_tokens = np.cumsum(sizes * self.histogram)[:-1]
+        max_lens = sizes[1:]
+        padded_tokens = max_lens * shorter - shorter_tokens
+        total_tokens = int((sizes * self.histogram).sum())
+        kept_tokens = shorter_tokens + max_lens * (len(self) - shorter)
+        padded = padded_tokens / (max_lens * len(self))
+        truncated = 1. - kept_tokens / max(total_tokens, 1)
+        return padded, truncated
+
+    def padded_fraction(self, max_sequence_len):
+        """Fraction of the tokens that are padding when every sequence is padded or truncated to max_sequence_len.
+        """
+        padded = np.clip(max_sequence_len - self.lengths, 0, None).sum()
+        return float(padded / (max_sequence_len * len(self)))
+
+    def recommend(self, max_padding=0.2):
+        """Longest max_sequence_len whose fraction of padded tokens is at most max_padding, so the sequences are
+        truncated as little as possible without spending more than that fraction of the compute in padding.
+        """
+        padded, _ = self.padding_curve()
+        valid = np.flatnonzero(padded <= max_padding)
+        return int(valid[-1] + 1) if valid.size else 1
+
+    def bucket_boundaries(self, n_buckets=8, max_sequence_len=None):
+        """Boundaries for tf.data bucket_by_sequence_length with pad_to_bucket_boundary=True, so that every bucket
+        holds about the same number of sequences. The last boundary is max_sequence_len + 1, so every sequence
+        truncated to max_sequence_len falls in a bucket.
+        Arguments:
+            - n_buckets: max number of buckets (there are less if several quantiles are the same length).
+            - max_sequence_len: length to which the sequences are truncated. By default max.
+        Returns:
+            - Sorted list of boundaries.
+        """
+        max_sequence_len = self.max if max_sequence_len is None else max_sequence_len
+        quantiles = np.percentile(np.minimum(self.lengths, max_sequence_len), np.linspace(0, 100, n_buckets + 1)[1:-1])
+        # A sequence of length l goes to the first bucket with boundary > l, and it's padded to boundary - 1
+        boundaries = np.unique(np.clip(quantiles.astype(int) + 1, 2, max_sequence_len))
+        return [int(b) for b in boundaries if b < max_sequence_len + 1] + [max_sequence_len + 1]
+
+    def print_summary(self, max_sequence_len=None):
+        """Print the statistics of the lengths, and the padding and truncation for max_sequence_len.
+        """
+        print('Sequences: {} - mean {} - mode {} - median {} - max {}'.format(len(self), self.mean, self.mode,
+                                                                             self.median, self.max))
+        print('Percentiles: ' + ', '.join('p{}={}'.format(q, v) for q, v in self.percentiles().items()))
+        if max_sequence_len is not None:
+            truncated = np.clip(self.lengths - max_sequence_len, 0, None).sum() / max(self.lengths.sum(), 1)
+            print('With max_sequence_len={}: {:.1f}% padded tokens, {:.1f}% truncated tokens.'.format(
+                max_sequence_len, 100 * self.padded_fraction(max_sequence_len), 100 * truncated))
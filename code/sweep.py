@@ -0,0 +1,62 @@
+"""
+Run several modes of main.py in parallel sharing the pretrained embeddings. The embeddings are loaded once by
+this process and copied to shared memory, and every worker attaches to them without copying them, so running N
+configurations costs roughly one table of embeddings instead of N.
+Usage: python sweep.py --modes 2 7 9 --emb_types fasttext --workers 3
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from factory_embeddings import FactoryEmbeddings, SHARED_EMBEDDINGS_ENV
+
+
+def main():
+    start_time = time.time()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', type=int, nargs='+', required=True, help='Modes of main.py to run.')
+    parser.add_argument('--emb_types', nargs='+', default=['fasttext'], choices=['glove', 'fasttext'],
+                        help='Embeddings to share with the workers.')
+    parser.add_argument('--workers', type=int, default=None, help='Max modes running at the same time.')
+    args = vars(parser.parse_args())
+    workers = args['workers'] or len(args['modes'])
+    segments = []
+    shared = []
+    try:
+        for emb_type in args['emb_types']:
+            factory = FactoryEmbeddings()
+            factory.load_embeddings(emb_type)
+            name = 'tfm_{}_{}'.format(emb_type, os.getpid())
+            segments += factory.embeddings.embeddings_full.to_shared_memory(name)
+            shared.append(emb_type + '=' + name)
+            # Only the shared copy is kept
+            FactoryEmbeddings.evict(emb_type)
+            print('The {} embeddings are shared as {}.'.format(emb_type, name))
+        env = dict(os.environ)
+        env[SHARED_EMBEDDINGS_ENV] = ','.join(shared)
+        running = []
+        pending = list(args['modes'])
+        while pending or running:
+            while pending and len(running) < workers:
+                mode = pending.pop(0)
+                log = open('sweep_mode_{}.txt'.format(mode), 'w')
+                print('Running mode {} (output in {}).'.format(mode, log.name))
+                running.append((mode, log, subprocess.Popen([sys.executable, 'main.py', '--mode', str(mode)],
+                                                            env=env, stdout=log, stderr=subprocess.STDOUT)))
+            time.sleep(1)
+            for mode, log, process in list(running):
+                if process.poll() is not None:
+                    log.close()
+                    print('Mode {} finished with code {}.'.format(mode, process.returncode))
+                    running.remove((mode, log, process))
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+    print('The sweep took: ' + str(time.time() - start_time) + ' seconds.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Metrics of the evaluation (evaluation.py) against sklearn. Run with: python -m pytest -q test_evaluation.py
+"""
+import warnings
+
+import numpy as np
+import pytest
+from sklearn.metrics import classification_report, f1_score, roc_auc_score
+
+from evaluation import ConfusionMatrix
+
+
+def random_labels(seed, n_examples=200, p_true=0.5, p_pred=0.5):
+    """One-hot labels and softmax-like outputs of 2 classes.
+    """
+    rng = np.random.default_rng(seed)
+    y_true = (rng.random(n_examples) < p_true).astype(int)
+    y_pred = (rng.random(n_examples) < p_pred).astype(int)
+    return np.eye(2)[y_true], np.eye(2)[y_pred] * 0.8 + 0.1, y_true, y_pred
+
+
+# Balanced, unbalanced and a class never predicted
+@pytest.mark.parametrize('seed, p_true, p_pred', [(0, 0.5, 0.5), (1, 0.2, 0.7), (2, 0.4, 0.0)])
+def test_metrics_match_sklearn(seed, p_true, p_pred):
+    labels, outputs, y_true, y_pred = random_labels(seed, p_true=p_true, p_pred=p_pred)
+    matrix = ConfusionMatrix()
+    for batch_labels, batch_outputs in zip(np.array_split(labels, 7), np.array_split(outputs, 7)):
+        matrix.update(batch_labels, batch_outputs)
+    metrics = matrix.metrics()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for digits in [2, 4]:
+            assert matrix.classification_report(digits=digits) == classification_report(y_true, y_pred,
+                                                                                         digits=digits)
+        assert metrics['macro_f1'] == pytest.approx(f1_score(y_true, y_pred, average='macro'))
+    assert metrics['roc_auc'] == pytest.approx(roc_auc_score(y_true, y_pred))
+
+
+def test_roc_auc_is_nan_with_a_single_class():
+    matrix = ConfusionMatrix.from_arrays(np.ones(10, dtype=int), np.arange(10) % 2)
+    assert np.isnan(matrix.metrics()['roc_auc'])
+
@@ -0,0 +1,39 @@
+"""
+Padding of the TransformerModel (modeltransformer.py). Run with: python -m pytest -q test_modeltransformer.py
+"""
+import numpy as np
+import pytest
+
+from input_pipeline import InputPipeline
+from modeltransformer import TransformerModel
+
+
+def transformer(**kwargs):
+    """Small TransformerModel with random embeddings, without loading data.
+    """
+    model = TransformerModel(batch_size=4, epochs=1, optimizer='adam', max_sequence_len=20, lstm_units=8,
+                             path_train=None, path_test=None, path_dev=None, load_embeddings=False,
+                             embedding_size=16, attheads=2, att_layers=2, dense_units=8, **kwargs)
+    model.nb_words = 50
+    model.embeddings_matrix = np.random.default_rng(42).standard_normal((50, 16)).astype(np.float32)
+    return model
+
+
+def test_trim_padding_needs_mask_padding():
+    with pytest.raises(ValueError):
+        transformer(trim_padding=True)
+
+
+def test_same_output_trimmed_and_untrimmed():
+    model = transformer(mask_padding=True, trim_padding=True)
+    model.call()
+    batch = np.zeros((2, 20), dtype=np.int32)
+    batch[0, -3:] = [7, 8, 9]
+    batch[1, -5:] = [3, 4, 5, 6, 7]
+    trimmed = InputPipeline.trim_batch(batch, None)[0]
+    assert trimmed.shape == (2, 5)
+    np.testing.assert_allclose(model.model.predict_on_batch(batch), model.model.predict_on_batch(trimmed),
+                               atol=1e-5)
+    # The first document alone, trimmed to its own length
+    np.testing.assert_allclose(model.model.predict_on_batch(batch[:1]),
+                               model.model.predict_on_batch(batch[:1, -3:]), atol=1e-5)
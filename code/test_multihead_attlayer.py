@@ -0,0 +1,72 @@
+"""
+Self attention of the transformer blocks (multihead_attlayer.py and transformerblock.py).
+Run with: python -m pytest -q test_multihead_attlayer.py
+"""
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from multihead_attlayer import MultiHeadSelfAttention
+from transformerblock import TransformerBlock
+
+
+def heads(seq_len=23, batch_size=2, num_heads=4, projection_dim=4):
+    """Random query, key and value (batch_size, num_heads, seq_len, projection_dim) and a mask of the tokens with
+    the first document padded at the start.
+    """
+    query, key, value = (tf.random.stateless_normal((batch_size, num_heads, seq_len, projection_dim), seed=(42, i))
+                         for i in range(3))
+    mask = np.ones((batch_size, seq_len), dtype=bool)
+    mask[0, :7] = False
+    return query, key, value, mask
+
+
+def masked_attention(query, key, value, allowed):
+    """Full softmax attention with the keys not allowed (batch_size, seq_len, seq_len) masked out.
+    """
+    score = tf.matmul(query, key, transpose_b=True) / np.sqrt(query.shape[-1])
+    score = tf.where(allowed[:, None], score, score.dtype.min)
+    return tf.matmul(tf.nn.softmax(score, axis=-1), value)
+
+
+def test_default_block_loads_unfused_checkpoint(tmp_path):
+    inputs = tf.random.stateless_normal((2, 7, 16), seed=(42, 0))
+    # The layout of the checkpoints saved before fused_qkv: a Dense for each of the query, key and value
+    unfused = TransformerBlock(16, 4, 32, fused_qkv=False)
+    expected = unfused(inputs, training=False)
+    path = str(tmp_path / 'checkpoint')
+    tf.train.Checkpoint(block=unfused).write(path)
+    block = TransformerBlock(16, 4, 32)
+    block(inputs, training=False)
+    tf.train.Checkpoint(block=block).read(path).assert_consumed()
+    np.testing.assert_allclose(block(inputs, training=False), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize('window_size', [5, 8])
+def test_local_attention_is_band_attention(window_size):
+    query, key, value, mask = heads()
+    layer = MultiHeadSelfAttention(16, 4, window_size=window_size)
+    output, _ = layer.local_attention(query, key, value, tf.constant(mask))
+    positions = np.arange(query.shape[2])
+    band = np.abs(positions[:, None] - positions[None, :]) <= window_size
+    expected = masked_attention(query, key, value, band[None] & mask[:, None, :])
+    # Only the tokens, the rows of the padding aren't used
+    np.testing.assert_allclose(output[0, :, 7:], expected[0, :, 7:], atol=1e-5)
+    np.testing.assert_allclose(output[1], expected[1], atol=1e-5)
+
+
+@pytest.mark.parametrize('masked', [False, True])
+def test_chunked_attention_matches_full_attention(masked):
+    query, key, value, mask = heads()
+    mask = tf.constant(mask) if masked else None
+    layer = MultiHeadSelfAttention(16, 4, chunk_size=5)
+    d_output = tf.random.stateless_normal(query.shape, seed=(42, 3))
+    results = []
+    for attention in [layer.attention, layer.chunked_attention]:
+        with tf.GradientTape() as tape:
+            tape.watch([query, key, value])
+            output, _ = attention(query, key, value, mask)
+            loss = tf.reduce_sum(output * d_output)
+        results.append([output] + tape.gradient(loss, [query, key, value]))
+    for full, chunked in zip(*results):
+        np.testing.assert_allclose(chunked, full, atol=1e-5)
@@ -0,0 +1,41 @@
+"""
+Round trip of the TFRecord export (tfrecords.py). Run with: python -m pytest -q test_tfrecords.py
+"""
+import numpy as np
+import pytest
+
+from input_pipeline import InputPipeline
+from tfrecords import TFRecordShards
+
+
+def padded_split(n_examples=50, max_sequence_len=20, seed=42):
+    """Sequences padded at the start as pad_sequences, of random lengths, and one-hot labels.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.zeros((n_examples, max_sequence_len), dtype=np.int32)
+    for i, length in enumerate(rng.integers(1, max_sequence_len // 2, n_examples)):
+        X[i, max_sequence_len - length:] = rng.integers(1, 100, length)
+    y = np.eye(2, dtype=np.float32)[rng.integers(0, 2, n_examples)]
+    return X, y
+
+
+@pytest.mark.parametrize('trim_padding', [False, True])
+def test_arrays_round_trip(tmp_path, trim_padding):
+    X, y = padded_split()
+    shards = TFRecordShards.write(str(tmp_path / 'test'), X, y, {'mean_emb': np.ones((len(X), 3))}, n_shards=3)
+    pipeline = InputPipeline(batch_size=8, trim_padding=trim_padding)
+    X_read, y_read = shards.arrays(pipeline)
+    np.testing.assert_array_equal(X_read, X)
+    np.testing.assert_array_equal(y_read, y)
+    inputs, _ = shards.arrays(pipeline, features=['mean_emb'])
+    np.testing.assert_array_equal(inputs['seq_input'], X)
+    assert inputs['mean_emb'].shape == (len(X), 3)
+
+
+def test_dataset_trims_batches(tmp_path):
+    X, y = padded_split()
+    shards = TFRecordShards.write(str(tmp_path / 'train'), X, y, n_shards=3)
+    batches = list(shards.dataset(InputPipeline(batch_size=8, trim_padding=True), training=False))
+    for i, (inputs, _) in enumerate(batches):
+        batch = X[8 * i:8 * (i + 1)]
+        np.testing.assert_array_equal(inputs.numpy(), batch[:, -np.count_nonzero(batch, axis=1).max():])
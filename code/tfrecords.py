@@ -0,0 +1,169 @@
+"""
+Export of the tokenized splits to sharded TFRecord files, so the training jobs stream them with interleaved reads
+instead of reading the TSVs and fitting the tokenizer again (see BaseModel.export_tfrecords and
+BaseModel.prepare_data_from_tfrecords).
+Every split is a set of shards PREFIX-00000-of-00008.tfrecord plus PREFIX.json with the number of examples and the
+shapes of the auxiliary inputs. Every example has the tokens without padding, the label and the auxiliary inputs
+(e.g. mean_emb, nela_input, fact_label) flattened. The JSON also has the histogram of the lengths, used to make
+the length buckets without reading the shards.
+"""
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from input_pipeline import AUTOTUNE
+from sequence_lengths import LengthProfile
+
+
+class TFRecordShards:
+    """Split of the data stored as shards of tf.train.Example.
+    """
+
+    def __init__(self, prefix):
+        """Sole constructor for the class
+        Arguments:
+            - prefix: path of the shards without the -XXXXX-of-XXXXX.tfrecord suffix.
+        """
+        self.prefix = prefix
+        with open(prefix + '.json') as f:
+            self.meta = json.load(f)
+
+    @property
+    def shard_paths(self):
+        n_shards = self.meta['n_shards']
+        return ['{}-{:05d}-of-{:05d}.tfrecord'.format(self.prefix, i, n_shards) for i in range(n_shards)]
+
+    @property
+    def features(self):
+        """Dict name -> shape of the auxiliary inputs.
+        """
+        return {name: tuple(shape) for name, shape in self.meta['features'].items()}
+
+    def __len__(self):
+        return self.meta['n_examples']
+
+    def length_profile(self):
+        """LengthProfile of the exported sequences.
+        """
+        histogram = self.meta['length_histogram']
+        return LengthProfile(np.repeat(np.arange(len(histogram)), histogram))
+
+    @classmethod
+    def write(cls, prefix, X, y, features=None, n_shards=8):
+        """Write a split.
+        Arguments:
+            - prefix: path of the shards without suffix. The directory is created if needed.
+            - X: sequences padded by pad_sequences (index 0 only as padding, it's removed).
+            - y: one-hot labels.
+            - features: dict name -> np.array with an auxiliary input for every example.
+            - n_shards: number of files. Every shard holds a contiguous range of the examples.
+        Returns:
+            - The TFRecordShards.
+        """
+        features = {} if features is None else {name: np.asarray(values, dtype=np.float32)
+                                                  for name, values in features.items()}
+        labels = np.argmax(y, axis=1)
+        n_shards = max(1, min(n_shards, len(X)))
+        os.makedirs(os.path.dirname(prefix) or '.', exist_ok=True)
+        meta = {'n_shards': n_shards, 'n_examples': len(X), 'max_sequence_len': int(X.shape[1]),
+                'features': {name: list(values.shape[1:]) for name, values in features.items()},
+                'length_histogram': np.bincount(np.count_nonzero(X, axis=1)).tolist()}
+        bounds = np.linspace(0, len(X), n_shards + 1).astype(int)
+        for shard in range(n_shards):
+            path = '{}-{:05d}-of-{:05d}.tfrecord'.format(prefix, shard, n_shards)
+            with tf.io.TFRecordWriter(path) as writer:
+                for i in range(bounds[shard], bounds[shard + 1]):
+                    tokens = X[i][X[i] != 0]
+                    example = {
+                        'tokens': tf.train.Feature(int64_list=tf.train.Int64List(value=tokens)),
+                        'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[labels[i]])),
+                    }
+                    for name, values in features.items():
+                        example[name] = tf.train.Feature(float_list=tf.train.FloatList(value=values[i].ravel()))
+                    writer.write(tf.train.Example(features=tf.train.Features(feature=example)).SerializeToString())
+        with open(prefix + '.json', 'w') as f:
+            json.dump(meta, f)
+        return cls(prefix)
+
+    def _parse_function(self, features):
+        """Function that parses a serialized example into (tokens, features dict, one-hot label).
+        """
+        spec = {'tokens': tf.io.VarLenFeature(tf.int64), 'label': tf.io.FixedLenFeature([], tf.int64)}
+        shapes = self.features
+        for name in features:
+            spec[name] = tf.io.FixedLenFeature([int(np.prod(shapes[name]))], tf.float32)
+
+        def parse(serialized):
+            example = tf.io.parse_single_example(serialized, spec)
+            tokens = tf.cast(tf.sparse.to_dense(example['tokens']), tf.int32)
+            aux = {name: tf.reshape(example[name], shapes[name]) for name in features}
+            return tokens, aux, tf.one_hot(example['label'], 2)
+        return parse
+
+    def dataset(self, pipeline, features=(), max_sequence_len=None, training=True, bucket_boundaries=None,
+                cycle_length=4, finish=True):
+        """Dataset of batches read from the shards.
+        Arguments:
+            - pipeline: InputPipeline with the batch size, shuffle, cache and prefetch options.
+            - features: names of the auxiliary inputs to read. Without them the inputs are only the sequences,
+            otherwise they are a dict with the sequences as seq_input.
+            - max_sequence_len: length of the padded sequences (padding at the start). By default the one of the
+            export.
+            - training: shuffle the shards and the examples. Without it the examples keep the order of the export.
+            - bucket_boundaries: if given, every batch is padded only to the boundary of its length bucket (see
+            BaseModel.bucketed_dataset).
+            - cycle_length: number of shards read at the same time.
+            - finish: trim (with the trim_padding of the pipeline) and prefetch the batches (see
+            InputPipeline.finish). Without it every batch keeps the padding to max_sequence_len or its bucket.
+        Returns:
+            - tf.data.Dataset of (inputs, labels) batches.
+        """
+        features = list(features)
+        max_sequence_len = self.meta['max_sequence_len'] if max_sequence_len is None else max_sequence_len
+        files = tf.data.Dataset.from_tensor_slices(self.shard_paths)
+        if training:
+            files = files.shuffle(len(self.shard_paths), seed=pipeline.seed)
+        dataset = files.interleave(tf.data.TFRecordDataset, cycle_length=cycle_length if training else 1,
+                                   num_parallel_calls=AUTOTUNE if training else None)
+        dataset = pipeline.prepare(dataset, len(self), training=training, name=os.path.basename(self.prefix))
+        dataset = pipeline.map(dataset, self._parse_function(features))
+
+        def inputs(tokens, aux):
+            return dict(aux, seq_input=tokens) if features else tokens
+
+        if bucket_boundaries is None:
+            def pad(tokens, aux, label):
+                tokens = tokens[-max_sequence_len:]
+                tokens = tf.pad(tokens, [[max_sequence_len - tf.shape(tokens)[0], 0]])
+                tokens.set_shape([max_sequence_len])
+                return inputs(tokens, aux), label
+            dataset = pipeline.map(dataset, pad).batch(pipeline.batch_size)
+        else:
+            # Same trick as BaseModel.bucketed_dataset to pad at the start
+            dataset = pipeline.map(dataset, lambda tokens, aux, label: (tf.reverse(tokens[-max_sequence_len:],
+                                                                                    axis=[0]), aux, label))
+            dataset = dataset.apply(tf.data.experimental.bucket_by_sequence_length(
+                element_length_func=lambda tokens, aux, label: tf.shape(tokens)[0],
+                bucket_boundaries=bucket_boundaries,
+                bucket_batch_sizes=[pipeline.batch_size] * (len(bucket_boundaries) + 1),
+                pad_to_bucket_boundary=True))
+            dataset = pipeline.map(dataset, lambda tokens, aux, labels: (inputs(tf.reverse(tokens, axis=[1]), aux),
+                                                                         labels))
+        return pipeline.finish(dataset) if finish else dataset
+
+    def arrays(self, pipeline, features=(), max_sequence_len=None):
+        """All the split in memory, in the order of the export, as prepare_data leaves X_test and y_test.
+        The batches aren't trimmed, so they can be concatenated; evaluate_split trims them again.
+        Returns:
+            - inputs: np.array with the padded sequences, or dict with them as seq_input and the auxiliary inputs.
+            - labels: np.array with the one-hot labels.
+        """
+        batches = list(self.dataset(pipeline, features=features, max_sequence_len=max_sequence_len, training=False,
+                                    finish=False))
+        labels = np.concatenate([batch_labels.numpy() for _, batch_labels in batches])
+        if not features:
+            return np.concatenate([batch.numpy() for batch, _ in batches]), labels
+        return {name: np.concatenate([batch[name].numpy() for batch, _ in batches])
+                for name in ['seq_input'] + list(features)}, labels
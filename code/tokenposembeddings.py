@@ -1,18 +1,47 @@
+import numpy as np
 import tensorflow as tf
 from tensorflow.keras import layers
+from quantizedembedding import QuantizedMatrix, QuantizedEmbedding
 
 class TokenAndPositionEmbedding(layers.Layer):
-    def __init__(self, maxlen, vocab_size, embed_dim, weights):
+    def __init__(self, maxlen, vocab_size, embed_dim, weights, mask_zero=False, first_token_positions=False):
+        """Initializer for the token and position embeddings.
+        Args:
+            - maxlen: max length of the sequences (number of positions)
+            - vocab_size: size of the vocabulary
+            - embed_dim: Embeddings dimension
+            - weights: embeddings matrix (np.array or QuantizedMatrix)
+            - mask_zero: the index 0 is padding. The layer outputs the mask of the tokens and the positions are
+            counted from the first token, so they don't change with the padding of the batch.
+            - first_token_positions: count the positions from the first token also without mask_zero, for the batches
+            padded to different lengths (length buckets) that are evaluated with the full padding.
+        """
         super(TokenAndPositionEmbedding, self).__init__()
-        self.token_emb = layers.Embedding(input_dim=vocab_size, output_dim=embed_dim, weights=[weights], trainable=False)
+        self.mask_zero = mask_zero
+        self.first_token_positions = first_token_positions or mask_zero
+        if isinstance(weights, QuantizedMatrix):
+            self.token_emb = QuantizedEmbedding(weights)
+        else:
+            dtype = 'float16' if weights.dtype == np.float16 else 'float32'
+            self.token_emb = layers.Embedding(input_dim=vocab_size, output_dim=embed_dim, weights=[weights],
+                                              trainable=False, dtype=dtype)
         self.pos_emb = layers.Embedding(input_dim=maxlen, output_dim=embed_dim)
 
     def call(self, x):
-        maxlen = tf.shape(x)[-1] # We took the maxlen from the x layer, 463 in my case if I choose the median as max_sequence_len
-        # Now create the range of the positions for the sequence.
-        positions = tf.range(start=0, limit=maxlen, delta=1) # Array 0..300 [0,1,2...,298,299,300]
+        if self.first_token_positions:
+            # The padding is at the start, so the first token is the position 0 (and the padding too, it's masked)
+            positions = tf.maximum(tf.cumsum(tf.cast(tf.not_equal(x, 0), tf.int32), axis=-1) - 1, 0)
+        else:
+            maxlen = tf.shape(x)[-1] # We took the maxlen from the x layer, 463 in my case if I choose the median as max_sequence_len
+            # Now create the range of the positions for the sequence.
+            positions = tf.range(start=0, limit=maxlen, delta=1) # Array 0..300 [0,1,2...,298,299,300]
         # Add the positions to the embeddings positions
         positions = self.pos_emb(positions)
         # Add the positions embeddings to the tokens embeddings.
-        x = self.token_emb(x)
-        return x + positions
\ No newline at end of file
+        x = tf.cast(self.token_emb(x), positions.dtype)
+        return x + positions
+
+    def compute_mask(self, x, mask=None):
+        if not self.mask_zero:
+            return None
+        return tf.not_equal(x, 0)
@@ -4,16 +4,22 @@ from multihead_attlayer import MultiHeadSelfAttention
 
 
 class TransformerBlock(layers.Layer):
-    def __init__(self, embed_dim, num_heads, ff_dim, rate=0.1):
+    def __init__(self, embed_dim, num_heads, ff_dim, rate=0.1, fused_qkv=False, chunk_size=None, window_size=None,
+                 global_tokens=0):
         """Initializer for the transformer block.
         Args:
             - embed_dim: Embeddings dimension
             - num_heads: num heads for the self attetion layer
             - ff_dim: Units for the dense layer
             - rate: rate for drop_out
+            - fused_qkv: single Dense for the query, key and value (see MultiHeadSelfAttention)
+            - chunk_size: None for the full attention, or the size of the blocks of the chunked attention
+            - window_size: None, or the window of the local attention (each side)
+            - global_tokens: number of global tokens of the local attention
         """
         super(TransformerBlock, self).__init__()
-        self.att = MultiHeadSelfAttention(embed_dim, num_heads)
+        self.att = MultiHeadSelfAttention(embed_dim, num_heads, fused_qkv=fused_qkv, chunk_size=chunk_size,
+                                          window_size=window_size, global_tokens=global_tokens)
         self.ffn = keras.Sequential(
             [layers.Dense(ff_dim, activation="relu"), layers.Dense(embed_dim),]
         )
@@ -21,9 +27,11 @@ class TransformerBlock(layers.Layer):
         self.layernorm2 = layers.LayerNormalization(epsilon=1e-6)
         self.dropout1 = layers.Dropout(rate)
         self.dropout2 = layers.Dropout(rate)
+        # The mask of the padding goes to the self attention and to the next block
+        self.supports_masking = True
 
-    def call(self, inputs, training=True):
-        attn_output = self.att(inputs) # (None, input_seq_len, embeddings_dim)
+    def call(self, inputs, training=True, mask=None):
+        attn_output = self.att(inputs, mask=mask) # (None, input_seq_len, embeddings_dim)
         attn_output = self.dropout1(attn_output, training=training)
         out1 = self.layernorm1(inputs + attn_output) # (None, input_seq_len, embeddings_dim)
         ffn_output = self.ffn(out1) # (None, input_seq_len, embeddings_dim)
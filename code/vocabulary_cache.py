@@ -0,0 +1,126 @@
+"""
+Cache of the fitted tokenizer and of the embeddings matrices built for its vocabulary, so the runs on the same
+corpus don't fit the tokenizer nor look up the embeddings again (see BaseModel.pad_sentences and
+BaseModel.create_1_embedding_matrix).
+Every corpus is a directory named by the hash of the texts, of the tokenizer options and of VERSION, with
+tokenizer.json (read back with tokenizer_from_json, it holds the word_index) and a matrix per embedding type,
+size, dtype and embeddings file: <emb_type>-<size>-<dtype>-<source>.npy, or .npz with the int8 values and the
+scales of a QuantizedMatrix, where source is the hash of the path, size and modification time of the embeddings
+file (see embeddings_fingerprint), so a new embeddings file builds a new matrix. Next to every matrix a .json keeps
+the coverage statistics of the embeddings, so a cached matrix reports the same as a new one.
+The float matrices are opened with np.load(mmap_mode='r'), so loading them doesn't read the file.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+from tensorflow.keras.preprocessing.text import tokenizer_from_json
+
+from quantizedembedding import QuantizedMatrix
+
+# Change it when the tokenizer options or the way the matrix is built change, so the old entries aren't used
+VERSION = 1
+
+
+class VocabularyCache:
+    """Tokenizer and embeddings matrices keyed by corpus hash and embedding type.
+    """
+
+    def __init__(self, cache_dir='../data/cache/vocabulary'):
+        """Sole constructor for the class
+        Arguments:
+            - cache_dir: directory where the entries are stored.
+        """
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def key(texts, num_words=None, lower=True, char_level=False):
+        """Hash of the texts the tokenizer is fitted on (in order) and of the options of the Tokenizer.
+        """
+        sha = hashlib.sha256()
+        sha.update(json.dumps({'version': VERSION, 'num_words': num_words, 'lower': lower,
+                               'char_level': char_level}, sort_keys=True).encode('utf-8'))
+        for text in texts:
+            sha.update(str(text).encode('utf-8'))
+            sha.update(b'\0')
+        return sha.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    @staticmethod
+    def embeddings_fingerprint(paths):
+        """Hash of the absolute path, size and modification time of the embeddings files that exist (the text
+        file and its binary conversion).
+        """
+        stats = [[os.path.abspath(path), os.path.getsize(path), os.stat(path).st_mtime_ns]
+                 for path in paths if os.path.exists(path)]
+        return hashlib.sha256(json.dumps(stats).encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def matrix_name(emb_type, embedding_size, dtype, source):
+        return '{}-{}-{}-{}'.format(emb_type, embedding_size, dtype, source)
+
+    def load_tokenizer(self, key):
+        """Return the tokenizer stored for the key, or None if it isn't cached.
+        """
+        path = os.path.join(self.path(key), 'tokenizer.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return tokenizer_from_json(f.read())
+
+    def store_tokenizer(self, key, tokenizer):
+        os.makedirs(self.path(key), exist_ok=True)
+        path = os.path.join(self.path(key), 'tokenizer.json')
+        # Write to a temporary file first so an interrupted run never leaves a broken entry
+        with open(path + '.tmp', 'w') as f:
+            f.write(tokenizer.to_json())
+        os.replace(path + '.tmp', path)
+        return path
+
+    def load_matrix(self, key, emb_type, embedding_size, dtype, source):
+        """Return the embeddings matrix stored for the key and its coverage statistics, or (None, None) if it isn't
+        cached.
+        Arguments:
+            - key: key of the corpus.
+            - emb_type: type of the embeddings (glove, fasttext...).
+            - embedding_size: dimension of the embeddings.
+            - dtype: dtype of the matrix (float64, float32, float16 or int8).
+            - source: embeddings_fingerprint of the embeddings files.
+        Returns:
+            - np.array (memory mapped) or QuantizedMatrix for int8.
+            - dict with the coverage statistics (see BaseModel.coverage_stats).
+        """
+        base = os.path.join(self.path(key), self.matrix_name(emb_type, embedding_size, dtype, source))
+        path = base + ('.npz' if dtype == 'int8' else '.npy')
+        if not os.path.exists(path) or not os.path.exists(base + '.json'):
+            return None, None
+        with open(base + '.json') as f:
+            coverage = json.load(f)
+        if dtype == 'int8':
+            with np.load(path) as data:
+                return QuantizedMatrix(data['values'], data['scale']), coverage
+        return np.load(path, mmap_mode='r'), coverage
+
+    def store_matrix(self, key, emb_type, embedding_size, dtype, source, matrix, coverage):
+        """Store the embeddings matrix (np.array or QuantizedMatrix) built for the vocabulary of the key, and its
+        coverage statistics.
+        """
+        os.makedirs(self.path(key), exist_ok=True)
+        base = os.path.join(self.path(key), self.matrix_name(emb_type, embedding_size, dtype, source))
+        # The statistics go first: a matrix without them isn't used
+        with open(base + '.json.tmp', 'w') as f:
+            json.dump(coverage, f)
+        os.replace(base + '.json.tmp', base + '.json')
+        # np.save adds the extension if the name doesn't end with it, so the file objects are used
+        if isinstance(matrix, QuantizedMatrix):
+            with open(base + '.npz.tmp', 'wb') as f:
+                np.savez(f, values=matrix.values, scale=matrix.scale)
+            os.replace(base + '.npz.tmp', base + '.npz')
+            return base + '.npz'
+        with open(base + '.npy.tmp', 'wb') as f:
+            np.save(f, matrix)
+        os.replace(base + '.npy.tmp', base + '.npy')
+        return base + '.npy'